@@ -9,13 +9,17 @@ from django.conf import settings
 
 from buckets.models import Bucket, BackupBucket
 from buckets.utils import BucketFileManagement
+from buckets.changelog import change_log
 from utils.oss.pyrados import FileWrapper, HarborObject
 from utils.oss.shortcuts import build_rados_harbor_object
-from utils.md5 import FileMD5Handler, EMPTY_HEX_MD5
+from utils.md5 import EMPTY_HEX_MD5
+from utils.transfer import sessions, ChunkUploader, ChunkUploadError
 
 
 backup_setting = getattr(settings, 'BACKUP_BUCKET_SETTINGS', {})
 meet_async_timedelta_minutes = backup_setting.get('meet_async_timedelta_minutes', 60)
+chunk_max_in_flight = backup_setting.get('chunk_max_in_flight', 4)
+chunk_retries = backup_setting.get('chunk_retries', 3)
 
 
 def async_close_old_connections(func):
@@ -67,7 +71,7 @@ class AsyncBucketManager:
             Bucket()    # exist
             None        # not exist
         """
-        return Bucket.objects.filter(id=bucket_id).first()
+        return Bucket.get_bucket_by_id(bucket_id)
 
     @staticmethod
     def _get_object_by_id(bucket, object_id):
@@ -209,6 +213,12 @@ class AsyncBucketManager:
     def _get_meet_time(self):
         return timezone.now() - timedelta(minutes=self.MEET_ASYNC_TIMEDELTA_MINUTES)
 
+    def get_meet_time(self):
+        """
+        对象修改时间早于此时间才允许同步
+        """
+        return self._get_meet_time()
+
     def _need_async_backup_map(self, bucket, obj, backup):
         """
         需要同步的备份点
@@ -248,14 +258,11 @@ class AsyncBucketManager:
     @staticmethod
     def _do_request(method: str, url: str, data, headders):
         """
-        :raises: Exception, requests.exceptions.RequestException
-        """
-        method = method.lower()
-        func = getattr(requests, method, None)
-        if func is None:
-            raise Exception(f'package requests no method {method}')
+        通过按endpoint复用的长连接会话请求
 
-        return func(url=url, data=data, headers=headders)
+        :raises: requests.exceptions.RequestException
+        """
+        return sessions.request(method=method, url=url, data=data, headers=headders)
 
     @async_close_old_connections
     def get_bucket_by_id(self, bucket_id):
@@ -463,53 +470,23 @@ class AsyncBucketManager:
 
     def post_object_by_chunk(self, obj, ho, backup: BackupBucket, per_size: int = 32*1024**2):
         """
-        分片上传一个对象
+        分片上传一个对象，多个分片并发上传，每个分片失败时单独重试
 
         :raises: AsyncError
         """
         async_time = timezone.now()
-        file = FileWrapper(ho=ho).open()
-        while True:
-            offset = file.offset
-            reset = None
-            if offset == 0:
-                reset = True
-
-            api = self._build_post_chunk_url(backup=backup, object_key=obj.na, offset=offset, reset=reset)
-            data = file.read(per_size)
-            if not data:
-                if offset >= file.size:
-                    break
-                raise AsyncError(f'Failed async object({obj.na}), {backup}, post by chunk, read empty bytes from ceph, 对象同步可能不完整',
-                                 code='FailedAsyncObject')
-
-            md5_handler = FileMD5Handler()
-            md5_handler.update(offset=0, data=data)
-            hex_md5 = md5_handler.hex_md5
-            headers = {
-                'Authorization': f'BucketToken {backup.bucket_token}',
-                'Content-MD5': hex_md5
-            }
-            try:
-                r = self._do_request(method='post', url=api, data=data, headders=headers)
-                if r.status_code == 200:
-                    continue
-            except requests.exceptions.RequestException as e:
-                pass
-
-            try:
-                r = self._do_request(method='post', url=api, data=data, headders=headers)
-            except requests.exceptions.RequestException as e:
-                raise AsyncError(f'Failed async object({obj.na}), {backup}, post by chunk, {str(e)}',
-                                 code='FailedAsyncObject')
-
-            if r.status_code == 200:
-                continue
-
-            raise AsyncError(f'Failed async object({obj.na}), {backup}, post by chunk, {r.text}',
+        uploader = ChunkUploader(
+            chunk_url=lambda offset, reset: self._build_post_chunk_url(
+                backup=backup, object_key=obj.na, offset=offset, reset=reset),
+            headers={'Authorization': f'BucketToken {backup.bucket_token}'},
+            per_size=per_size, max_in_flight=chunk_max_in_flight, retries=chunk_retries
+        )
+        try:
+            uploader.upload(ho=ho)
+        except ChunkUploadError as e:
+            raise AsyncError(f'Failed async object({obj.na}), {backup}, post by chunk, {str(e)}',
                              code='FailedAsyncObject')
 
-        file.close()
         self._update_object_async_time(obj=obj, async_time=async_time, backup_num=backup.backup_num)
 
     @async_close_old_connections
@@ -526,6 +503,9 @@ class AsyncBucketManager:
         obj = self._get_object(
             bucket=bucket, object_id=object_id, object_key=object_key
         )
+        if obj.upt is not None and obj.upt >= self._get_meet_time():    # 对象仍在修改中，重新追加变更日志稍后再同步
+            change_log.log_put(obj, force=True)
+            return
 
         backup_qs = BackupBucket.objects.filter(bucket_id=bucket_id, backup_num__in=BackupBucket.BackupNum.values,
                                              status=BackupBucket.Status.START).all()
@@ -534,6 +514,84 @@ class AsyncBucketManager:
             if not ok and err is not None:
                 raise err
 
+    @async_close_old_connections
+    def async_objects(self, bucket_id, bucket_name: str, objects: list):
+        """
+        同步一个桶的一批对象，桶和备份点只查询一次，对象通过一次id IN查询获取
+
+        :param objects: [(object_id, object_key), ]
+        :return: list
+            [[object_id, error], ]     # error: None(成功或不需要同步)，str(失败原因)
+        :raises: AsyncError     # 桶不存在
+        """
+        bucket = self._get_bucket(
+            bucket_id=bucket_id, bucket_name=bucket_name
+        )
+        backups = list(BackupBucket.objects.filter(
+            bucket_id=bucket_id, backup_num__in=BackupBucket.BackupNum.values, status=BackupBucket.Status.START))
+
+        table_name = bucket.get_bucket_table_name()
+        object_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        objs = object_class.objects.filter(id__in=[object_id for object_id, _ in objects], fod=True)
+        objs_map = {obj.id: obj for obj in objs}
+        meet_time = self._get_meet_time()
+        results = []
+        for object_id, object_key in objects:
+            obj = objs_map.get(object_id)
+            if obj is None:
+                results.append([object_id, f'The object with id "{object_id}" not exists'])
+                continue
+
+            if obj.na != object_key:
+                results.append([object_id, f'The object name with ID {object_id} is inconsistent with '
+                                           f'the given object key "{object_key}".'])
+                continue
+
+            if obj.upt is not None and obj.upt >= meet_time:     # 对象仍在修改中，重新追加变更日志稍后再同步
+                change_log.log_put(obj, force=True)
+                results.append([object_id, None])
+                continue
+
+            error = None
+            for backup in backups:
+                ok, err = self.async_bucket_object(bucket=bucket, obj=obj, backup=backup)
+                if not ok and err is not None:
+                    error = str(err)
+                    break
+
+            if error is not None:   # 同步失败，重新追加变更日志稍后重试
+                change_log.log_put(obj, force=True)
+
+            results.append([object_id, error])
+
+        return results
+
+    @async_close_old_connections
+    def relog_changes(self, bucket_id, bucket_name: str, put: list = None, deleted: list = None):
+        """
+        同步任务失败(异常、超时)后重新追加对象的变更日志，按变更日志同步时稍后重试
+
+        :param put: 上传或修改的对象，[(object_id, object_key), ]
+        :param deleted: 删除的对象，[(object_id, object_key), ]
+        :raises: AsyncError     # 桶不存在
+        """
+        bucket = self._get_bucket(
+            bucket_id=bucket_id, bucket_name=bucket_name
+        )
+        change_log.log_changes(table_name=bucket.get_bucket_table_name(), deleted=deleted, put=put)
+
+    @async_close_old_connections
+    def get_objects_size(self, bucket, object_ids: list):
+        """
+        查询一批对象的大小
+
+        :return: dict
+            {object_id: size}   # 不存在的对象不包含
+        """
+        table_name = bucket.get_bucket_table_name()
+        object_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        return dict(object_class.objects.filter(id__in=object_ids, fod=True).values_list('id', 'si'))
+
     @async_close_old_connections
     def async_bucket_object(self, bucket, obj, backup):
         """
@@ -562,7 +620,8 @@ class AsyncBucketManager:
     def async_delete_object_to_backup_bucket(self, object_key, backup):
         url = self._build_object_base_url(backup=backup, object_key=object_key, api_version='v1')
         try:
-            response = requests.delete(url=url, headers={'Authorization': f'BucketToken {backup.bucket_token}'})
+            response = self._do_request(method='delete', url=url, data=None,
+                                        headders={'Authorization': f'BucketToken {backup.bucket_token}'})
         except requests.exceptions.RequestException as e:
             raise AsyncError(f'Failed async delete object({object_key}), {backup}, {str(e)}',
                              code='FailedAsyncDeleteObject')
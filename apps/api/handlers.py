@@ -182,7 +182,8 @@ class V2ObjectHandler:
 
         obj_key = obj.get_obj_key(bucket.id)
         pool_id = obj.get_pool_id()
-        uploader = storagers.FileUploadToCephHandler(request, using=str(pool_id), pool_name=None, obj_key=obj_key)
+        uploader = storagers.FileUploadToCephHandler(request, using=str(pool_id), pool_name=None, obj_key=obj_key,
+                                                     stripe_unit=obj.get_stripe_unit())
         request.upload_handlers = [uploader]
 
         def clean_put(_uploader, _obj, _created, _rados):
@@ -2,10 +2,10 @@ import logging
 
 from django.utils import timezone
 from django.db.models import Case, Value, When, F
-from django.db import close_old_connections
+from django.db import close_old_connections, router, transaction
 from django.db.models import BigIntegerField
 
-from buckets.models import Bucket
+from buckets.models import Bucket, GarbageObject
 from buckets.utils import BucketFileManagement
 from s3.harbor import MultipartUploadManager
 from s3 import exceptions as s3exceptions
@@ -295,58 +295,13 @@ class HarborManager:
         :raises: S3Error
         """
         bfm = BucketFileManagement(collection_name=table_name)
-        paths = PathParser(path).get_path_breadcrumb()
-        if len(paths) == 0:
+        if not PathParser(path).get_path_breadcrumb():
             return bfm.root_dir()  # 根目录对象
 
-        index_paths = list(enumerate(paths))
-        index = 0
-        last_exist_dir = None  # 路径中已存在的最后的目录
-        for index, item in reversed(index_paths):
-            dir_name, dir_path_name = item
-            try:
-                obj = bfm.get_obj(path=dir_path_name)
-            except Exception as e:
-                raise exceptions.HarborError.from_error(str(e))
-            if not obj:
-                continue
-
-            if obj.is_file():
-                raise exceptions.HarborError.from_error(exceptions.SameKeyAlreadyExists(
-                    "The path of the object's key conflicts with the existing object's key"))
-
-            last_exist_dir = obj
-            break
-
-        if index == (len(index_paths) - 1) and last_exist_dir:  # 整个路径已存在
-            return [last_exist_dir]
-
-        # 从整个路径上已存在的目录处开始向后创建路径
-        if last_exist_dir:
-            now_last_dir = last_exist_dir  # 记录现在已创建的路径上的最后的目录
-            create_paths = index_paths[index + 1:]  # index目录存在不需创建
-        else:
-            now_last_dir = bfm.root_dir()  # 根目录对象
-            create_paths = index_paths[index:]  # index目录不存在需创建
-
-        dirs = []
-        for i, p in create_paths:
-            p_id = now_last_dir.id
-            dir_name, dir_path_name = p
-            try:
-                dir1 = self._mkdir_metadata(table_name=table_name, p_id=p_id, dir_path_name=dir_path_name)
-            except Exception as e:      # 失败，检测目录是否已存在
-                dir1 = bfm.get_obj(path=dir_path_name)
-                if not dir1:
-                    raise e
-                if dir1.is_file():
-                    raise exceptions.HarborError.from_error(exceptions.SameKeyAlreadyExists(
-                        "The path of the object's key conflicts with the existing object's key"))
-
-            dirs.append(dir1)
-            now_last_dir = dir1
-
-        return dirs
+        try:
+            return bfm.create_dir_path(path=path)
+        except exceptions.Error as exc:
+            raise exceptions.HarborError.from_error(exc)
 
     @staticmethod
     def get_root_dir():
@@ -408,12 +363,13 @@ class HarborManager:
         data['dir_name'] = dir_name
         return data
 
-    def rmdir(self, bucket_name:str, dirpath:str, user=None):
+    def rmdir(self, bucket_name:str, dirpath:str, user=None, recursive: bool = False):
         """
         删除一个空目录
         :param bucket_name:桶名
         :param dirpath: 目录全路径
         :param user: 用户，默认为None，如果给定用户只删除属于此用户的目录（只查找此用户的存储桶）
+        :param recursive: True(递归删除非空目录)
         :return:
             True: success
             raise HarborError(): failed
@@ -430,13 +386,14 @@ class HarborManager:
             raise exceptions.HarborError.from_error(
                 exceptions.NoSuchBucket(message='存储桶不存在'))
 
-        return self._rmdir(bucket=bucket, dirpath=dirpath)
+        return self._rmdir(bucket=bucket, dirpath=dirpath, recursive=recursive)
 
-    def _rmdir(self, bucket, dirpath: str):
+    def _rmdir(self, bucket, dirpath: str, recursive: bool = False):
         """
         删除目录，不检测bucket用户权限
 
         :param bucket: bucket实例
+        :param recursive: True(递归删除非空目录，对象rados数据由后台删除)
         :return:
             True
 
@@ -463,8 +420,19 @@ class HarborManager:
                 exceptions.NoSuchKey(message='目录不存在'))
 
         if not bfm.dir_is_empty(_dir):
-            raise exceptions.HarborError.from_error(
-                exceptions.NoEmptyDir(message='无法删除非空目录'))
+            if not recursive:
+                raise exceptions.HarborError.from_error(
+                    exceptions.NoEmptyDir(message='无法删除非空目录'))
+
+            def delete_multipart_metadata(objs):
+                MultipartUploadManager.delete_multipart_uploads_by_bucket_objs(bucket=bucket, objs=objs)
+
+            try:
+                bfm.delete_dir_tree(dir_obj=_dir, bucket_id=bucket.id, before_delete=delete_multipart_metadata)
+            except exceptions.Error as exc:
+                raise exceptions.HarborError.from_error(exc)
+
+            return True
 
         if not _dir.do_delete():
             raise exceptions.HarborError(message='删除目录失败，数据库错误')
@@ -581,7 +549,7 @@ class HarborManager:
         return generator(queryset=qs, _per_num=per_num, _paginator=paginator)
 
     def list_dir(self, bucket_name: str, path: str, offset: int = 0,
-                 limit: int = 1000, user=None, paginator=None, only_obj: bool = None):
+                 limit: int = 1000, user=None, paginator=None, only_obj: bool = None, cursor: str = None):
         """
         获取目录下的文件列表信息
 
@@ -592,6 +560,7 @@ class HarborManager:
         :param user: 用户，默认为None，如果给定用户只获取属于此用户的目录下的文件列表信息（只查找此用户的存储桶）
         :param paginator: 分页器，默认为None
         :param only_obj: True(只列举对象), 其他忽略
+        :param cursor: 分页游标，不为None时按游标分页，忽略offset；''为第一页
         :return:
                 success:    (list[object, object,], bucket) # list和bucket实例
                 failed:      raise HarborError
@@ -611,6 +580,20 @@ class HarborManager:
         if offset < 0:
             offset = 0
 
+        if cursor is not None:
+            try:
+                position = paginator.decode_cursor_token(cursor)
+            except exceptions.Error as e:
+                raise exceptions.HarborError.from_error(e)
+
+            count_key = f'{bucket.get_bucket_table_name()}:{path.strip("/")}:{bool(only_obj)}'
+            try:
+                li = paginator.paginate_to_list_by_cursor(files, cursor=position, limit=limit, count_key=count_key)
+            except Exception as e:
+                raise exceptions.HarborError(message=str(e))
+
+            return li, bucket
+
         paginator.offset = offset
         paginator.limit = limit
 
@@ -677,7 +660,7 @@ class HarborManager:
 
     def move_rename(self, bucket_name: str, obj_path: str, rename=None, move=None, user=None):
         """
-        移动或重命名对象
+        移动或重命名对象，obj_path是目录时递归移动或重命名目录
 
         :param bucket_name: 桶名
         :param obj_path: 对象全路径
@@ -702,7 +685,7 @@ class HarborManager:
 
         # 存储桶验证和获取桶对象
         try:
-            bucket, obj = self.get_bucket_and_obj(bucket_name=bucket_name, obj_path=obj_path, user=user)
+            bucket, obj = self.get_bucket_and_obj_or_dir(bucket_name=bucket_name, path=obj_path, user=user)
         except exceptions.HarborError as e:
             raise e
 
@@ -712,17 +695,17 @@ class HarborManager:
 
         if obj is None:
             raise exceptions.HarborError.from_error(
-                exceptions.NoSuchKey(message='文件对象不存在'))
+                exceptions.NoSuchKey(message='对象或目录不存在'))
 
         return self._move_rename_obj(bucket=bucket, obj=obj, move_to=move_to, rename=rename)
 
     @staticmethod
     def _move_rename_obj(bucket, obj, move_to, rename):
         """
-        移动重命名对象
+        移动重命名对象，目录时递归移动重命名
 
         :param bucket: 对象所在桶
-        :param obj: 文件对象
+        :param obj: 文件对象或目录
         :param move_to: 移动目标路径
         :param rename: 重命名的新名称
         :return:
@@ -762,6 +745,14 @@ class HarborManager:
 
             obj.did = did
 
+        if obj.is_dir():
+            try:
+                bfm.move_dir_tree(dir_obj=obj, did=obj.did, na=new_na, name=new_obj_name)
+            except exceptions.Error as exc:
+                raise exceptions.HarborError.from_error(exc)
+
+            return obj, bucket
+
         obj.na = new_na
         obj.name = new_obj_name
         obj.reset_na_md5()
@@ -998,11 +989,13 @@ class HarborManager:
         old_ult = obj.ult
         old_size = obj.si
         old_md5 = obj.md5
+        old_manifest = (obj.manifest_part_size, obj.manifest_stride, obj.manifest_parts)
 
         obj.ult = timezone.now()
         obj.si = 0
         obj.md5 = ''
-        if not obj.do_save(update_fields=['ult', 'si', 'md5']):
+        update_fields = ['ult', 'si', 'md5'] + obj.clear_part_manifest()
+        if not obj.do_save(update_fields=update_fields):
             raise exceptions.HarborError(message='修改对象元数据失败')
 
         ok, _ = rados.delete()
@@ -1011,9 +1004,12 @@ class HarborManager:
             obj.ult = old_ult
             obj.si = old_size
             obj.md5 = old_md5
-            obj.do_save(update_fields=['ult', 'si', 'md5'])
+            obj.manifest_part_size, obj.manifest_stride, obj.manifest_parts = old_manifest
+            obj.do_save(update_fields=update_fields)
             raise exceptions.HarborError(message='rados文件对象删除失败')
 
+        rados.reset_manifest()
+
         return True
 
     def _save_one_chunk(self, obj, rados, offset:int, chunk:bytes, md5: str = ''):
@@ -1117,11 +1113,18 @@ class HarborManager:
         if md5 and len(md5) == 32:
             kwargs['md5'] = md5
         try:
-            # r = model.objects.filter(id=obj.id, si=obj.si).update(si=new_size, upt=timezone.now())  # 乐观锁方式
-            r = model.objects.filter(id=obj.id).update(**kwargs)
+            # 并发写同一对象时(如多个分片并发上传)，加锁读取当前大小，用量增量以数据库中的当前大小计算
+            with transaction.atomic(using=router.db_for_write(model)):
+                cur_size = model.objects.select_for_update().filter(id=obj.id).values_list('si', flat=True).first()
+                if cur_size is None:
+                    return False
+
+                r = model.objects.filter(id=obj.id).update(**kwargs)
         except Exception as e:
             return False
         if r > 0:  # 更新行数
+            obj.record_usage_size(max(new_size, cur_size), old_size=cur_size)
+            obj.record_change()
             return True
 
         return False
@@ -1158,20 +1161,13 @@ class HarborManager:
             raise exceptions.HarborError.from_error(
                 exceptions.NoSuchKey(message='文件对象不存在'))
 
-        obj_key = fileobj.get_obj_key(bucket.id)
         old_id = fileobj.id
-        # 先删除元数据，后删除rados对象（删除失败恢复元数据）
-        if not fileobj.do_delete():
+        # 删除元数据，rados数据加入删除队列，由后台删除
+        try:
+            GarbageObject.delete_obj(bucket_id=bucket.id, obj=fileobj)
+        except Exception as e:
             raise exceptions.HarborError(message='删除对象原数据时错误')
 
-        ho = build_rados_harbor_object(obj=fileobj, obj_rados_key=obj_key)
-        ok, _ = ho.delete()
-        if not ok:
-            # 恢复元数据
-            fileobj.id = old_id
-            fileobj.do_save(force_insert=True)  # 仅尝试创建文档，不修改已存在文档
-            raise exceptions.HarborError(message='删除对象rados数据时错误')
-
         # 尝试删除多部分上传元数据
         fileobj.id = old_id
         if not fileobj.is_dir():
@@ -1313,6 +1309,37 @@ class HarborManager:
 
         :raise HarborError
         """
+        bucket, obj, created = self._get_write_bucket_and_obj(bucket_name=bucket_name, obj_path=obj_path, user=user)
+        obj_key = obj.get_obj_key(bucket.id)
+
+        def generator():
+            ok = True
+            rados = build_rados_harbor_object(obj=obj, obj_rados_key=obj_key)
+            if (created is False) and (not is_break_point):  # 对象已存在，不是新建的,非断点续传，重置对象大小
+                self._pre_reset_upload(obj=obj, rados=rados)
+
+            md5_handler = FileMD5Handler()
+            hex_md5 = ''
+            while True:
+                offset, data = yield ok
+                try:
+                    if not is_break_point:      # 非断点续传计算MD5
+                        md5_handler.update(offset=offset, data=data)
+                        hex_md5 = md5_handler.hex_md5
+                    ok = self._save_one_chunk(obj=obj, rados=rados, offset=offset, chunk=data, md5=hex_md5)
+                except exceptions.HarborError:
+                    ok = False
+
+        return generator()
+
+    def _get_write_bucket_and_obj(self, bucket_name: str, obj_path: str, user=None):
+        """
+        获取要写入的存储桶和对象，对象不存在时创建
+
+        :return:
+            (bucket, obj, created)
+        :raise HarborError
+        """
         # 对象路径分析
         pp = PathParser(filepath=obj_path)
         path, filename = pp.get_path_and_filename()
@@ -1336,27 +1363,41 @@ class HarborManager:
 
         collection_name = bucket.get_bucket_table_name()
         obj, created = self._get_obj_and_check_limit_or_create(collection_name, path, filename)
-        obj_key = obj.get_obj_key(bucket.id)
+        return bucket, obj, created
 
-        def generator():
-            ok = True
-            rados = build_rados_harbor_object(obj=obj, obj_rados_key=obj_key)
-            if (created is False) and (not is_break_point):  # 对象已存在，不是新建的,非断点续传，重置对象大小
-                self._pre_reset_upload(obj=obj, rados=rados)
+    def copy_object(self, bucket, obj, to_bucket_name: str, to_obj_path: str, user=None):
+        """
+        复制对象到目标存储桶的对象路径，对象数据在服务端复制，不经过读写生成器逐块传输
 
-            md5_handler = FileMD5Handler()
-            hex_md5 = ''
-            while True:
-                offset, data = yield ok
-                try:
-                    if not is_break_point:      # 非断点续传计算MD5
-                        md5_handler.update(offset=offset, data=data)
-                        hex_md5 = md5_handler.hex_md5
-                    ok = self._save_one_chunk(obj=obj, rados=rados, offset=offset, chunk=data, md5=hex_md5)
-                except exceptions.HarborError:
-                    ok = False
+        :param bucket: 源对象所在存储桶实例
+        :param obj: 源对象实例
+        :param to_bucket_name: 目标桶名
+        :param to_obj_path: 目标对象全路径
+        :param user: 用户，默认为None，如果给定用户只查找此用户的存储桶
+        :return:
+            target obj      # success
+        :raise HarborError
+        """
+        to_bucket, target, created = self._get_write_bucket_and_obj(
+            bucket_name=to_bucket_name, obj_path=to_obj_path, user=user)
+        rados = build_rados_harbor_object(obj=target, obj_rados_key=target.get_obj_key(to_bucket.id))
+        if created is False:  # 对象已存在，重置对象大小
+            self._pre_reset_upload(obj=target, rados=rados)
 
-        return generator()
+        source_rados = build_rados_harbor_object(obj=obj, obj_rados_key=obj.get_obj_key(bucket.id))
+        source_md5 = obj.hex_md5
+        md5_handler = None if len(source_md5) == 32 else FileMD5Handler()
+        ok, ret = rados.copy_from(source=source_rados, md5_handler=md5_handler)
+        if not ok:
+            rados.delete()
+            raise exceptions.HarborError(message='对象rados数据复制失败:' + ret)
+
+        md5 = source_md5 if md5_handler is None else md5_handler.hex_md5
+        if not self._update_obj_metadata(target, size=ret, md5=md5):
+            rados.delete()
+            raise exceptions.HarborError(message='修改对象元数据失败')
+
+        return target
 
     @staticmethod
     def check_public_or_user_bucket(bucket, user, all_public):
@@ -1749,7 +1790,7 @@ class FtpHarborManager:
     @ftp_close_old_connections
     def ftp_rmdir(self, bucket_name:str, path:str):
         """
-        删除一个空目录
+        删除一个目录，递归删除目录下的所有对象和子目录
         :param bucket_name:桶名
         :param path: 目录全路径
         :return:
@@ -1758,7 +1799,7 @@ class FtpHarborManager:
 
         :raise HarborError()
         """
-        return self.__hbManager.rmdir(bucket_name, path)
+        return self.__hbManager.rmdir(bucket_name, path, recursive=True)
 
     @ftp_close_old_connections
     def ftp_is_dir(self, bucket_name:str, path_name:str):
@@ -1,9 +1,13 @@
+import base64
 from urllib import parse
 from collections import OrderedDict
 
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.pagination import CursorPagination, LimitOffsetPagination, _divide_with_ceil
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 from . import exceptions
 
 
@@ -48,17 +52,136 @@ class BucketFileCursorPagination(CursorPagination):
 class BucketFileLimitOffsetPagination(LimitOffsetPagination):
     '''
     存储桶分页器
+
+    * offset模式：参数offset、limit；
+    * 游标模式：有参数cursor时(第一页cursor为空值)，按(fod, -id)游标分页，不需要扫描offset之前的记录，
+      不返回总数，参数count=true时返回缓存的近似总数
     '''
     default_limit = 200
     limit_query_param = 'limit'
     offset_query_param = 'offset'
     max_limit = 2000
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    count_cache_prefix = 'iharbor:dir_count:'
+    cursor_mode = False
 
     def paginate_queryset(self, queryset, request, view=None):
         limit = self.get_limit(request)
+        cursor = self.get_cursor(request)
+        if cursor is not None:
+            return self.paginate_to_list_by_cursor(
+                queryset, cursor=self.decode_cursor_token(cursor), limit=limit, request=request)
+
         offset = self.get_offset(request)
         return self.pagenate_to_list(queryset, request=request, offset=offset, limit=limit)
 
+    def get_cursor(self, request):
+        """
+        :return:
+            str     # 游标模式
+            None    # offset模式
+        """
+        return request.query_params.get(self.cursor_query_param, None)
+
+    @staticmethod
+    def encode_cursor_token(obj):
+        token = f'{int(obj.fod)}:{obj.id}'
+        return base64.urlsafe_b64encode(token.encode('ascii')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor_token(token: str):
+        """
+        :return:
+            (fod, id)   # 上一页最后一条记录
+            None        # 第一页
+
+        :raises: InvalidArgument
+        """
+        if not token:
+            return None
+
+        try:
+            fod, id_ = base64.urlsafe_b64decode(token.encode('ascii')).decode('ascii').split(':')
+            fod, id_ = int(fod), int(id_)
+        except Exception:
+            raise exceptions.InvalidArgument(message='invalid param "cursor"')
+
+        if fod not in (0, 1) or id_ < 0:
+            raise exceptions.InvalidArgument(message='invalid param "cursor"')
+
+        return bool(fod), id_
+
+    def paginate_to_list_by_cursor(self, queryset, cursor, limit, request=None, count_key: str = None):
+        """
+        按(fod, -id)游标分页，目录在前，对象在后，与BucketFileBase.Meta.ordering一致
+
+        :param queryset: 目录下对象和目录的QuerySet
+        :param cursor: (fod, id)上一页最后一条记录; None为第一页
+        :param limit: 每页数量
+        :param request:
+        :param count_key: 近似总数的缓存key，None不缓存
+        :return: list
+        """
+        if request:
+            self.request = request
+
+        self.cursor_mode = True
+        self.offset = 0
+        self.limit = limit
+        self.count = None
+        results = []
+        for fod in (False, True):
+            if cursor is not None and fod < cursor[0]:
+                continue
+
+            qs = queryset.filter(fod=fod)
+            if cursor is not None and fod == cursor[0]:
+                qs = qs.filter(id__lt=cursor[1])
+
+            results += list(qs.order_by('-id')[0:limit + 1 - len(results)])
+            if len(results) > limit:
+                break
+
+        self.has_next = len(results) > limit
+        results = results[0:limit]
+        self.next_cursor = self.encode_cursor_token(results[-1]) if self.has_next else None
+
+        request = getattr(self, 'request', None)
+        if request is not None and request.query_params.get(self.count_query_param, '').lower() == 'true':
+            self.count = self.get_approximate_count(queryset, count_key=count_key)
+
+        return results
+
+    def get_approximate_count(self, queryset, count_key: str = None):
+        """
+        近似总数，缓存DIR_COUNT_CACHE_TTL秒，期间目录的修改不会反映到总数
+        """
+        if count_key is None:
+            return queryset.count()
+
+        key = self.count_cache_prefix + count_key
+        try:
+            count = cache.get(key)
+        except Exception:
+            count = None
+
+        if count is None:
+            count = queryset.count()
+            try:
+                cache.set(key, count, timeout=getattr(settings, 'DIR_COUNT_CACHE_TTL', 60))
+            except Exception:
+                pass
+
+        return count
+
+    def get_next_cursor_link(self):
+        if not self.next_cursor or getattr(self, 'request', None) is None:
+            return None
+
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
     def pagenate_to_list(self, queryset, offset, limit, request=None):
         if request:
             self.request = request
@@ -109,6 +232,17 @@ class BucketFileLimitOffsetPagination(LimitOffsetPagination):
         return dirs + objs
 
     def get_paginated_response(self, data):
+        if self.cursor_mode:
+            d = OrderedDict([
+                ('count', self.count),
+                ('next', self.get_next_cursor_link()),
+                ('next_cursor', self.next_cursor),
+                ('previous', None),
+            ])
+            if isinstance(data, OrderedDict):
+                data.update(d)
+            return Response(data)
+
         # content = self.get_html_context()
         current, final = self.get_current_and_final_page_number()
         d = OrderedDict([
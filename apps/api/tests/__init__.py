@@ -2,7 +2,8 @@ from django.conf import settings
 
 from ceph.ceph_settings import ceph_settings_update
 from ceph.models import CephCluster
-from s3.models import MultipartUpload
+from s3.models import MultipartUpload, MultipartUploadPart
+from buckets.models import GarbageObject
 from buckets.utils import is_model_table_exists, create_table_for_model_class
 
 
@@ -39,8 +40,6 @@ def config_ceph_clustar_settings():
 
 
 def ensure_s3_multipart_table_exists():
-    ok = is_model_table_exists(model=MultipartUpload)
-    if ok:
-        return
-
-    create_table_for_model_class(model=MultipartUpload)
+    for model in [MultipartUpload, MultipartUploadPart, GarbageObject]:
+        if not is_model_table_exists(model=model):
+            create_table_for_model_class(model=model)
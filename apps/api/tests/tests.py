@@ -15,9 +15,12 @@ from django.utils import timezone
 from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework.test import APIClient
 
-from buckets.models import BucketToken, BucketFileBase, Bucket, Archive
+from buckets.models import BucketToken, BucketFileBase, Bucket, Archive, GarbageObject
 from buckets.management.commands.clearbucket import Command as ClearBucketCommand
 from buckets.utils import BucketFileManagement
+from buckets.usage import bucket_usage
+from s3.harbor import HarborManager as S3HarborManager
+from s3.models import MultipartUpload, MultipartUploadPart
 from ceph.models import CephCluster
 from users.models import UserProfile
 from . import config_ceph_clustar_settings, ensure_s3_multipart_table_exists
@@ -646,6 +649,7 @@ class DirAPITests(MyAPITransactionTestCase):
     def setUp(self):
         settings.BUCKET_LIMIT_DEFAULT = 2
         config_ceph_clustar_settings()
+        ensure_s3_multipart_table_exists()
         self.user_password = 'password'
         user = get_or_create_user(password=self.user_password)
         # self.client.force_login(user=user)
@@ -703,6 +707,36 @@ class DirAPITests(MyAPITransactionTestCase):
             'na': sub_dir_path, 'name': sub_dir, 'fod': False, 'si': 0
         })
 
+        # list dir by cursor
+        other_dir = 'other'
+        response = self.create_dir_response(self.client, bucket_name, dirpath=other_dir)
+        self.assertEqual(response.status_code, 201)
+        url = reverse('api:dir-list', kwargs={'bucket_name': bucket_name})
+        query = parse.urlencode({'cursor': '', 'limit': 1, 'count': 'true'})
+        response = self.client.get(f'{url}?{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertKeysIn(['files', 'count', 'next', 'next_cursor', 'previous'], response.data)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['files']), 1)
+        self.assertEqual(response.data['files'][0]['na'], other_dir)
+        next_cursor = response.data['next_cursor']
+        self.assertIsNotNone(next_cursor)
+
+        query = parse.urlencode({'cursor': next_cursor, 'limit': 1})
+        response = self.client.get(f'{url}?{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(len(response.data['files']), 1)
+        self.assertEqual(response.data['files'][0]['na'], parent_dir)
+        self.assertIsNone(response.data['next_cursor'])
+
+        response = self.client.get(f'{url}?cursor=invalid')
+        self.assertEqual(response.status_code, 400)
+
+        url = reverse('api:dir-detail', kwargs={'bucket_name': bucket_name, 'dirpath': other_dir})
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, 204)
+
         # set permission
         share_password = 'testcode'
         url = reverse('api:dir-detail', kwargs={'bucket_name': bucket_name, 'dirpath': sub_dir_path})
@@ -732,6 +766,25 @@ class DirAPITests(MyAPITransactionTestCase):
         share_url = reverse('share:share-view', kwargs={'share_base': f'{bucket_name}/{sub_dir_path}'})
         self.assertIn(share_url, response.data['share_uri'])
 
+        # move and rename dir
+        new_parent_dir = '新父目录名'
+        url = reverse('api:move-detail', kwargs={'bucket_name': bucket_name, 'objpath': parent_dir})
+        response = self.client.post(f'{url}?{parse.urlencode({"rename": new_parent_dir})}')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['obj']['na'], new_parent_dir)
+        url = reverse('api:dir-detail', kwargs={'bucket_name': bucket_name, 'dirpath': new_parent_dir})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertDictIsSubDict(response.data['files'][0], {
+            'na': f'{new_parent_dir}/{sub_dir}', 'name': sub_dir, 'fod': False
+        })
+
+        url = reverse('api:move-detail', kwargs={'bucket_name': bucket_name, 'objpath': new_parent_dir})
+        response = self.client.post(f'{url}?{parse.urlencode({"move_to": f"{new_parent_dir}/{sub_dir}"})}')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f'{url}?{parse.urlencode({"rename": parent_dir})}')
+        self.assertEqual(response.status_code, 201)
+
         # delete dir
         url = reverse('api:dir-detail', kwargs={'bucket_name': bucket_name, 'dirpath': parent_dir})
         response = self.client.delete(url)
@@ -744,6 +797,16 @@ class DirAPITests(MyAPITransactionTestCase):
         response = self.client.delete(url)
         self.assertOldErrorResponse(404, 'NoSuchKey', response)
 
+        # recursive delete dir
+        response = self.create_dir_response(self.client, bucket_name, dirpath=sub_dir_path)
+        self.assertEqual(response.status_code, 201)
+        url = reverse('api:dir-detail', kwargs={'bucket_name': bucket_name, 'dirpath': parent_dir})
+        response = self.client.delete(f'{url}?recursive=true')
+        self.assertEqual(response.status_code, 204)
+        url = reverse('api:dir-detail', kwargs={'bucket_name': bucket_name, 'dirpath': sub_dir_path})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
     def tearDown(self):
         # delete bucket
         response = BucketsAPITests.delete_bucket(self.client, self.bucket_name)
@@ -945,6 +1008,11 @@ class ObjectsAPITests(MyAPITransactionTestCase):
 
         response = self.delete_object_response(self.client, bucket_name=self.bucket_name, key=key4)
         self.assertEqual(response.status_code, 204)
+        # rados数据加入删除队列
+        garbage = GarbageObject.objects.filter(obj_key=obj.get_obj_key(self.bucket.id)).first()
+        self.assertIsNotNone(garbage)
+        self.assertEqual(garbage.size, obj.si)
+        self.assertEqual(garbage.pool_id, obj.get_pool_id())
 
     def test_multipart_upload_download_delete(self):
         file = random_bytes_io(mb_num=16)
@@ -962,6 +1030,35 @@ class ObjectsAPITests(MyAPITransactionTestCase):
         response = self.delete_object_response(self.client, bucket_name=self.bucket_name, key=key)
         self.assertEqual(response.status_code, 204)
 
+    def test_s3_delete_objects_multipart_uploaded(self):
+        """
+        S3 DeleteObjects批量删除包含多部分上传完成的对象，对象和多部分上传记录都被删除
+        """
+        key1 = 'multipart.pdf'
+        key2 = 'test.pdf'
+        for key in [key1, key2]:
+            response = self.put_object_response(self.client, bucket_name=self.bucket_name, key=key,
+                                                file=random_bytes_io(mb_num=1))
+            self.assertEqual(response.status_code, 200)
+
+        bfm = BucketFileManagement(path="", collection_name=self.bucket.get_bucket_table_name())
+        obj = bfm.get_obj(path=key1)
+        upload = MultipartUpload(id=f'test{obj.id}', bucket_id=self.bucket.id, bucket_name=self.bucket_name,
+                                 obj_id=obj.id, obj_key=key1, key_md5=obj.na_md5, chunk_size=5 * 1024 ** 2,
+                                 status=MultipartUpload.UploadStatus.COMPLETED)
+        upload.save(force_insert=True)
+        MultipartUploadPart(upload_id=upload.id, part_number=1, size=obj.si, etag='"test"',
+                            last_modified=timezone.now()).save(force_insert=True)
+
+        deleted, errors = S3HarborManager().delete_objects(
+            bucket_name=self.bucket_name, obj_keys=[{'Key': key1}, {'Key': key2}], user=self.user)
+        self.assertEqual(errors, [])
+        self.assertEqual({d['Key'] for d in deleted}, {key1, key2})
+        self.assertIsNone(bfm.get_obj(path=key1))
+        self.assertIsNone(bfm.get_obj(path=key2))
+        self.assertFalse(MultipartUpload.objects.filter(id=upload.id).exists())
+        self.assertFalse(MultipartUploadPart.objects.filter(upload_id=upload.id).exists())
+
     def test_share_object(self):
         file = random_bytes_io(mb_num=6)
         dir_path = 'aa'
@@ -1310,6 +1407,7 @@ class StatsAPITests(MyAPITransactionTestCase):
     def set_bucket_stat_time(self):
         self.bucket.stats_time = timezone.now() - timedelta(days=1)
         self.bucket.save(update_fields=['stats_time'])
+        bucket_usage.flush()   # 桶用量增量写入数据库
 
     def test_stats_ceph(self):
         self.user.is_superuser = True
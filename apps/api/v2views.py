@@ -87,7 +87,8 @@ class V2ObjViewSet(CustomGenericViewSet):
               已上传的分片数据会丢失。
 
             注意：
-            分片上传现不支持并发上传，并发上传可能造成脏数据，上传分片顺序没有要求，请一个分片上传成功后再上传另一个分片
+            上传分片顺序没有要求，带reset参数的第一个分片上传成功后，不同偏移量的其他分片可以并发上传，
+            对象大小按已写入分片的最大结尾偏移量更新；同一偏移量范围的分片不要并发上传，可能造成脏数据
 
             Http Code: 状态码200：上传成功无异常时，返回数据：
             {
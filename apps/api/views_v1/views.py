@@ -1188,7 +1188,8 @@ class ObjViewSet(CustomGenericViewSet):
         pool_id = obj.get_pool_id()
         obj_key = obj.get_obj_key(bucket.id)
 
-        uploader = FileUploadToCephHandler(request, using=str(pool_id), pool_name=None, obj_key=obj_key)
+        uploader = FileUploadToCephHandler(request, using=str(pool_id), pool_name=None, obj_key=obj_key,
+                                           stripe_unit=obj.get_stripe_unit())
         request.upload_handlers = [uploader]
 
         def clean_put(_uploader, _obj, _created, _rados):
@@ -1674,6 +1675,18 @@ class DirectoryViewSet(CustomGenericViewSet):
                 type=openapi.TYPE_INTEGER,
                 description="Number of results to return per page",
                 required=False,
+            ),
+            openapi.Parameter(
+                name='cursor', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description=gettext_lazy("游标分页，第一页传空值，之后传上一页返回的next_cursor；有此参数时忽略offset"),
+                required=False,
+            ),
+            openapi.Parameter(
+                name='count', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_BOOLEAN,
+                description=gettext_lazy("游标分页时，true(返回近似总数)"),
+                required=False,
             )
         ],
         responses={
@@ -1737,10 +1750,12 @@ class DirectoryViewSet(CustomGenericViewSet):
         except Exception as e:
             return Response(data={'code': 400, 'code_text': _('offset或limit参数无效')}, status=status.HTTP_400_BAD_REQUEST)
 
+        cursor = paginator.get_cursor(request)
         h_manager = HarborManager()
         try:
             files, bucket = h_manager.list_dir(bucket_name=bucket_name, path=dir_path, offset=offset, limit=limit,
-                                               user=request.user, paginator=paginator, only_obj=only_obj)
+                                               user=request.user, paginator=paginator, only_obj=only_obj,
+                                               cursor=cursor)
         except exceptions.HarborError as e:
             return Response(data=e.err_data_old(), status=e.status_code)
 
@@ -1843,6 +1858,12 @@ class DirectoryViewSet(CustomGenericViewSet):
                 description=gettext_lazy("目录绝对路径"),
                 required=True
             ),
+            openapi.Parameter(
+                name='recursive', in_=openapi.IN_QUERY,
+                type=openapi.TYPE_BOOLEAN,
+                description=gettext_lazy("true(递归删除目录下所有对象和子目录); 其他值忽略"),
+                required=False
+            ),
         ],
         responses={
             status.HTTP_204_NO_CONTENT: 'NO CONTENT'
@@ -1850,7 +1871,7 @@ class DirectoryViewSet(CustomGenericViewSet):
     )
     def destroy(self, request, *args, **kwargs):
         """
-        删除一个目录, 目录必须为空，否则400错误
+        删除一个目录, 目录必须为空，否则409错误；参数recursive=true时递归删除目录下所有对象和子目录，对象数据由后台删除
 
             >>Http Code: 状态码204,成功删除;
             >>Http Code: 400 401 403 404 500
@@ -1861,6 +1882,7 @@ class DirectoryViewSet(CustomGenericViewSet):
         """
         bucket_name = kwargs.get('bucket_name', '')
         dirpath = kwargs.get(self.lookup_field, '')
+        recursive = request.query_params.get('recursive', '').lower() == 'true'
 
         try:
             check_authenticated_or_bucket_token(request, bucket_name=bucket_name, act='write', view=self)
@@ -1869,7 +1891,7 @@ class DirectoryViewSet(CustomGenericViewSet):
 
         h_manager = HarborManager()
         try:
-            h_manager.rmdir(bucket_name=bucket_name, dirpath=dirpath, user=request.user)
+            h_manager.rmdir(bucket_name=bucket_name, dirpath=dirpath, user=request.user, recursive=recursive)
         except exceptions.HarborError as e:
             return Response(data=e.err_data_old(), status=e.status_code)
 
@@ -2177,6 +2199,7 @@ class MoveViewSet(CustomGenericViewSet):
 
         参数move_to指定对象移动的目标路径（bucket桶下的目录路径），/或空字符串表示桶下根目录；参数rename指定重命名对象的新名称；
         请求时至少提交其中一个参数，亦可同时提交两个参数；只提交参数move_to只移动对象，只提交参数rename只重命名对象；
+        路径是目录时，移动或重命名整个目录，目录不能移动到自身或子目录下；
 
         >>Http Code: 状态码201,成功：
         >>Http Code: 状态码400, 请求参数有误，已存在同名的对象或目录:
@@ -2208,7 +2231,7 @@ class MoveViewSet(CustomGenericViewSet):
             openapi.Parameter(
                 name='objpath', in_=openapi.IN_PATH,
                 type=openapi.TYPE_STRING,
-                description=gettext_lazy("文件对象绝对路径"),
+                description=gettext_lazy("文件对象或目录绝对路径"),
                 required=True
             ),
             openapi.Parameter(
@@ -3384,6 +3407,8 @@ class SearchObjectViewSet(CustomGenericViewSet):
             serializer = serializers.ObjInfoSerializer(files, many=True, context={
                 'bucket_name': bucket_name, 'bucket': bucket, 'request': request})
             files = serializer.data
+        except exceptions.Error as exc:
+            return Response(data=exc.err_data(), status=exc.status_code)
         except Exception as exc:
             exc = exceptions.Error(message=str(exc))
             return Response(data=exc.err_data(), status=exc.status_code)
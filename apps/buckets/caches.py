@@ -0,0 +1,429 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+
+
+# 进程内的django cache后端，版本戳不能在多个进程间共享
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class BucketCache:
+    """
+    进程内存储桶(Bucket)查询缓存，LRU + TTL;
+
+    * 桶按桶名缓存，并维护桶id到桶名的索引；
+    * 本进程内桶修改或删除时，通过post_save/post_delete信号失效；
+    * 其他进程(uwsgi worker)通过django cache中的版本戳感知桶的修改，版本戳变化时清空本进程缓存；
+    * django cache需要配置为多进程共享的缓存后端(如memcached、redis)，未配置时(默认LocMemCache)不缓存；
+    """
+    VERSION_KEY = 'iharbor:bucket_cache_version'
+    # 只修改这些字段时（桶统计信息），不通知其他进程
+    STATS_FIELDS = {'objs_count', 'size', 'stats_time'}
+
+    def __init__(self, max_size: int = 1024, ttl: int = 10, cache_alias: str = 'default'):
+        """
+        :param max_size: 最多缓存的桶数量
+        :param ttl: 缓存有效时间(秒)，<=0不缓存
+        :param cache_alias: 版本戳使用的django cache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._buckets = OrderedDict()  # {name: (bucket, expire_time)}
+        self._name_index = {}  # {id: name}
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._shared = None
+
+    @property
+    def enabled(self):
+        if self.ttl <= 0:
+            return False
+
+        if self._shared is None:
+            self._shared = is_shared_cache(self.cache_alias)
+
+        return self._shared
+
+    def get_by_name(self, name: str, loader):
+        """
+        :param name: 桶名
+        :param loader: 缓存未命中时查询桶的函数，loader() -> Bucket or None
+        :return:
+            Bucket()    # 缓存桶的副本，调用者可以修改
+            None
+        """
+        if not self.enabled:
+            return loader()
+
+        self._check_version()
+        bucket = self._get(name)
+        if bucket is not None:
+            return bucket
+
+        bucket = loader()
+        if bucket is not None:
+            self._set(bucket)
+
+        return bucket
+
+    def get_by_id(self, bucket_id: int, loader):
+        """
+        :param bucket_id: 桶id
+        :param loader: 缓存未命中时查询桶的函数，loader() -> Bucket or None
+        """
+        if not self.enabled:
+            return loader()
+
+        self._check_version()
+        name = self._name_index.get(bucket_id)
+        if name is not None:
+            bucket = self._get(name)
+            if bucket is not None and bucket.id == bucket_id:
+                return bucket
+
+        bucket = loader()
+        if bucket is not None:
+            self._set(bucket)
+
+        return bucket
+
+    def invalidate(self, bucket, notify: bool = True):
+        """
+        失效一个桶的缓存
+
+        :param bucket: 桶
+        :param notify: True(通知其他进程)
+        """
+        with self._lock:
+            self._buckets.pop(bucket.name, None)
+            name = self._name_index.pop(bucket.id, None)
+            if name is not None:
+                self._buckets.pop(name, None)
+
+        if notify and self.enabled:
+            self._bump_version()
+
+    def invalidate_by_table(self, table_names):
+        """
+        失效桶数据库表名对应桶的缓存，只失效本进程的缓存，用于只修改了桶统计信息时
+
+        :param table_names: 桶的数据库表名列表
+        """
+        table_names = set(table_names)
+        with self._lock:
+            names = [name for name, (b, _) in self._buckets.items() if b.collection_name in table_names]
+            for name in names:
+                b, _ = self._buckets.pop(name)
+                self._name_index.pop(b.id, None)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._name_index.clear()
+
+    def stats(self):
+        """
+        缓存命中统计
+
+        :return: {
+            'hits': int,
+            'misses': int,
+            'hit_ratio': float,
+            'size': int
+        }
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'size': len(self._buckets)
+        }
+
+    def _get(self, name: str):
+        now = time.monotonic()
+        with self._lock:
+            item = self._buckets.get(name)
+            if item is not None:
+                bucket, expire = item
+                if expire > now:
+                    self._buckets.move_to_end(name)
+                    self.hits += 1
+                    return copy.deepcopy(bucket)
+
+                self._buckets.pop(name, None)
+                self._name_index.pop(bucket.id, None)
+
+            self.misses += 1
+
+        return None
+
+    def _set(self, bucket):
+        item = (copy.deepcopy(bucket), time.monotonic() + self.ttl)
+        with self._lock:
+            self._buckets[bucket.name] = item
+            self._buckets.move_to_end(bucket.name)
+            self._name_index[bucket.id] = bucket.name
+            while len(self._buckets) > self.max_size:
+                name, (b, _) = self._buckets.popitem(last=False)
+                self._name_index.pop(b.id, None)
+
+    def _check_version(self):
+        """
+        其他进程修改了桶，清空缓存
+        """
+        ok, version = get_shared_version(self.cache_alias, self.VERSION_KEY)
+        if ok and version != self._version:
+            self.clear()
+            self._version = version
+
+    def _bump_version(self):
+        bump_shared_version(self.cache_alias, self.VERSION_KEY)
+
+
+class DirMetadataCache:
+    """
+    进程内目录元数据缓存，按(桶数据库表名，目录路径)缓存，LRU + TTL;
+
+    * 只缓存目录，对象元数据(大小、md5等)上传时频繁修改，不缓存；
+    * 可以缓存不存在的路径(negative entry)，negative_ttl<=0时不缓存；
+    * 本进程内目录修改或删除时失效，通过django cache中每个桶表的版本戳通知其他进程；
+    * 其他进程使用过期的目录缓存会在已删除或移动的目录下创建对象，django cache不是多进程共享的缓存后端时不缓存；
+    """
+    VERSION_KEY_PREFIX = 'iharbor:dir_cache_version:'
+    MISSING = object()  # 路径不存在
+
+    def __init__(self, max_size: int = 10000, ttl: int = 10, negative_ttl: int = 0, cache_alias: str = 'default'):
+        """
+        :param max_size: 最多缓存的目录数量
+        :param ttl: 缓存有效时间(秒)，<=0不缓存
+        :param negative_ttl: 不存在路径的缓存有效时间(秒)，<=0不缓存
+        :param cache_alias: 版本戳使用的django cache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_alias = cache_alias
+        self._items = OrderedDict()  # {(table_name, path): (obj, expire_time)}
+        self._versions = {}  # {table_name: version}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._shared = None
+
+    @property
+    def enabled(self):
+        if self.ttl <= 0:
+            return False
+
+        if self._shared is None:
+            self._shared = is_shared_cache(self.cache_alias)
+
+        return self._shared
+
+    def get(self, table_name: str, path: str):
+        """
+        :return:
+            (True, obj)     # 命中，obj是缓存目录的副本
+            (True, None)    # 命中，路径不存在
+            (False, None)   # 未命中
+        """
+        if not self.enabled:
+            return False, None
+
+        self._check_version(table_name)
+        key = (table_name, path)
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                obj, expire = item
+                if expire > now:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    if obj is self.MISSING:
+                        return True, None
+
+                    return True, copy.deepcopy(obj)
+
+                self._items.pop(key, None)
+
+            self.misses += 1
+
+        return False, None
+
+    def set(self, table_name: str, path: str, obj):
+        """
+        缓存目录，obj为None时缓存路径不存在，对象(非目录)不缓存
+        """
+        if not self.enabled:
+            return
+
+        if obj is None:
+            if self.negative_ttl <= 0:
+                return
+
+            item = (self.MISSING, time.monotonic() + self.negative_ttl)
+        elif obj.is_dir():
+            item = (copy.deepcopy(obj), time.monotonic() + self.ttl)
+        else:
+            return
+
+        key = (table_name, path)
+        with self._lock:
+            self._items[key] = item
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, table_name: str, path: str = None, notify: bool = True):
+        """
+        失效缓存
+
+        :param table_name: 桶数据库表名
+        :param path: 目录路径，None失效桶表所有缓存
+        :param notify: True(通知其他进程)
+        """
+        with self._lock:
+            if path is not None:
+                self._items.pop((table_name, path), None)
+            else:
+                for key in [k for k in self._items if k[0] == table_name]:
+                    self._items.pop(key, None)
+
+        if notify and self.enabled:
+            bump_shared_version(self.cache_alias, self.VERSION_KEY_PREFIX + table_name)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'size': len(self._items)
+        }
+
+    def _check_version(self, table_name: str):
+        """
+        其他进程修改了桶表中的目录，失效此桶表的缓存
+        """
+        ok, version = get_shared_version(self.cache_alias, self.VERSION_KEY_PREFIX + table_name)
+        if ok and version != self._versions.get(table_name):
+            self.invalidate(table_name, notify=False)
+            self._versions[table_name] = version
+
+
+def is_shared_cache(cache_alias: str):
+    """
+    django cache是否是多进程共享的缓存后端，进程内缓存后端不能用于通知其他进程
+
+    :return: bool
+    """
+    try:
+        backend = settings.CACHES[cache_alias]['BACKEND']
+    except (AttributeError, KeyError, TypeError):
+        return False
+
+    return backend not in LOCAL_CACHE_BACKENDS
+
+
+def get_shared_version(cache_alias: str, key: str):
+    """
+    :return:
+        (True, version)
+        (False, None)   # django cache不可用
+    """
+    try:
+        return True, caches[cache_alias].get(key)
+    except Exception:
+        return False, None
+
+
+def bump_shared_version(cache_alias: str, key: str):
+    cache = caches[cache_alias]
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:  # 版本戳不存在
+            cache.add(key, 1, timeout=None)
+    except Exception:
+        pass
+
+
+class SortKeyStateCache:
+    """
+    进程内桶表排序键sk是否已补全(manage.py fillsortkey)的缓存，避免每次列举都查询是否还有未补全的记录；
+
+    * 补全后新建和修改的记录都会写入sk，已补全的状态一直有效；
+    * 未补全的状态缓存check_ttl秒，补全完成后最多check_ttl秒才切换为按sk排序
+    """
+    def __init__(self, check_ttl: int = 60):
+        self.check_ttl = check_ttl
+        self._states = {}   # {table_name: (ready, expire_time)}
+        self._lock = threading.Lock()
+
+    def get(self, table_name: str):
+        """
+        :return:
+            True    # 已补全
+            False   # 未补全
+            None    # 未缓存
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._states.get(table_name)
+            if item is not None and (item[0] or item[1] > now):
+                return item[0]
+
+        return None
+
+    def set(self, table_name: str, ready: bool):
+        with self._lock:
+            self._states[table_name] = (ready, time.monotonic() + self.check_ttl)
+
+    def clear_state(self, table_name: str = None):
+        with self._lock:
+            if table_name is None:
+                self._states.clear()
+            else:
+                self._states.pop(table_name, None)
+
+
+bucket_cache = BucketCache(
+    max_size=getattr(settings, 'BUCKET_CACHE_MAX_SIZE', 1024),
+    ttl=getattr(settings, 'BUCKET_CACHE_TTL', 10),
+    cache_alias=getattr(settings, 'BUCKET_CACHE_ALIAS', 'default')
+)
+dir_cache = DirMetadataCache(
+    max_size=getattr(settings, 'DIR_CACHE_MAX_SIZE', 10000),
+    ttl=getattr(settings, 'DIR_CACHE_TTL', 10),
+    negative_ttl=getattr(settings, 'DIR_CACHE_NEGATIVE_TTL', 0),
+    cache_alias=getattr(settings, 'BUCKET_CACHE_ALIAS', 'default')
+)
+sort_key_state = SortKeyStateCache(check_ttl=getattr(settings, 'SORT_KEY_CHECK_TTL', 60))
+
+
+def on_bucket_changed(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    notify = not (update_fields and set(update_fields).issubset(BucketCache.STATS_FIELDS))
+    bucket_cache.invalidate(instance, notify=notify)
+
+
+def connect_signals(sender):
+    post_save.connect(on_bucket_changed, sender=sender, dispatch_uid='bucket_cache_post_save')
+    post_delete.connect(on_bucket_changed, sender=sender, dispatch_uid='bucket_cache_post_delete')
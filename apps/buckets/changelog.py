@@ -0,0 +1,265 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, router
+
+
+logger = logging.getLogger('django.request')
+
+
+class ChangeLogManager:
+    """
+    对象变更日志，开启了备份的桶的对象上传、修改、删除时追加日志记录，备份同步按桶和日志序号(id)顺序消费，
+    消费进度记录在检查点表，备份同步不再需要扫描整个桶表
+
+    * 变更日志表由manage.py create_changelog_table创建，表不存在时不记录；
+    * 桶是否开启了备份的检查结果在进程内缓存check_ttl秒；
+    * 同一对象的上传(修改)日志在dedup_seconds秒内只记录一次，消费时对象仍在修改中的重新追加日志
+    """
+    def __init__(self, check_ttl: int = 60, dedup_seconds: int = 60):
+        self.check_ttl = check_ttl
+        self.dedup_seconds = dedup_seconds
+        self._states = {}   # {table_name: (bucket_id or None, expire_time)}
+        self._recent = {}   # {(table_name, obj_id): expire_time}
+        self._lock = threading.Lock()
+
+    def get_bucket_id(self, table_name: str):
+        """
+        :return:
+            int     # 桶开启了备份时返回桶id
+            None    # 不需要记录变更日志
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._states.get(table_name)
+            if item is not None and item[1] > now:
+                return item[0]
+
+        bucket_id = self._load_state(table_name)
+        with self._lock:
+            self._states[table_name] = (bucket_id, now + self.check_ttl)
+
+        return bucket_id
+
+    def clear_state(self, table_name: str = None):
+        with self._lock:
+            if table_name is None:
+                self._states.clear()
+            else:
+                self._states.pop(table_name, None)
+
+    @staticmethod
+    def _load_state(table_name: str):
+        from .models import Bucket, BackupBucket, ObjectChangeLog
+
+        try:
+            connection = connections[router.db_for_read(ObjectChangeLog)]
+            with connection.cursor() as cursor:
+                cursor.execute('SHOW TABLES LIKE %s', [ObjectChangeLog._meta.db_table])
+                if cursor.fetchone() is None:
+                    return None
+
+            bucket_id = Bucket.objects.filter(collection_name=table_name).values_list('id', flat=True).first()
+            if bucket_id is None:
+                return None
+
+            if not BackupBucket.objects.filter(bucket_id=bucket_id, status=BackupBucket.Status.START).exists():
+                return None
+        except Exception as e:
+            logger.error(f'check change log of table {table_name} error, {str(e)}')
+            return None
+
+        return bucket_id
+
+    def _is_recent(self, table_name: str, obj_id: int):
+        """
+        对象的上传日志是否在dedup_seconds秒内记录过，没有时标记为已记录
+        """
+        now = time.monotonic()
+        key = (table_name, obj_id)
+        with self._lock:
+            expire = self._recent.get(key)
+            if expire is not None and expire > now:
+                return True
+
+            if len(self._recent) > 10000:
+                self._recent = {k: v for k, v in self._recent.items() if v > now}
+
+            self._recent[key] = now + self.dedup_seconds
+
+        return False
+
+    def log_put(self, obj, force: bool = False):
+        """
+        对象上传或修改后记录日志
+
+        :param obj: 对象
+        :param force: True(不去重)
+        """
+        from .models import ObjectChangeLog
+
+        table_name = obj._meta.db_table
+        bucket_id = self.get_bucket_id(table_name)
+        if bucket_id is None:
+            return
+
+        if not force and self._is_recent(table_name, obj.id):
+            return
+
+        self._create([ObjectChangeLog(bucket_id=bucket_id, obj_id=obj.id, obj_key=obj.na,
+                                      action=ObjectChangeLog.ACTION_PUT)])
+
+    def log_delete(self, table_name: str, obj_id: int, obj_key: str):
+        """
+        对象删除或重命名后记录原对象key的删除日志
+        """
+        self.log_changes(table_name=table_name, deleted=[(obj_id, obj_key)])
+
+    def log_changes(self, table_name: str, deleted: list = None, put: list = None):
+        """
+        批量记录日志
+
+        :param table_name: 桶的数据库表名
+        :param deleted: 删除的对象，[(obj_id, obj_key), ]
+        :param put: 上传或修改的对象，[(obj_id, obj_key), ]
+        """
+        from .models import ObjectChangeLog
+
+        if not deleted and not put:
+            return
+
+        bucket_id = self.get_bucket_id(table_name)
+        if bucket_id is None:
+            return
+
+        items = [ObjectChangeLog(bucket_id=bucket_id, obj_id=oid, obj_key=key, action=ObjectChangeLog.ACTION_DELETE)
+                 for oid, key in (deleted or [])]
+        items += [ObjectChangeLog(bucket_id=bucket_id, obj_id=oid, obj_key=key, action=ObjectChangeLog.ACTION_PUT)
+                  for oid, key in (put or [])]
+        self._create(items)
+
+    @staticmethod
+    def _create(items: list):
+        from .models import ObjectChangeLog
+
+        try:
+            ObjectChangeLog.objects.bulk_create(items, batch_size=500)
+        except Exception as e:
+            logger.error(f'append object change log error, {str(e)}')
+
+    @staticmethod
+    def get_changes(bucket_id: int, seq_gt: int, before_time, limit: int = 1000):
+        """
+        按序号顺序获取桶的变更日志
+
+        :param bucket_id: 桶id
+        :param seq_gt: 获取序号大于seq_gt的日志
+        :param before_time: 只获取此时间之前的日志，尽量确保对象已上传完成
+        :param limit: 获取数量
+        :return: list
+        """
+        from .models import ObjectChangeLog
+
+        return list(ObjectChangeLog.objects.filter(
+            bucket_id=bucket_id, id__gt=seq_gt, create_time__lt=before_time).order_by('id')[0:limit])
+
+    @staticmethod
+    def merge_changes(changes: list):
+        """
+        合并同一个对象key的多条日志，只保留最后一条
+
+        :return: list   # 按序号排序
+        """
+        last = {}
+        for c in changes:
+            last[c.obj_key] = c
+
+        return sorted(last.values(), key=lambda c: c.id)
+
+    @staticmethod
+    def get_checkpoint(consumer: str, bucket_id: int):
+        """
+        :return: int    # 消费者在桶上已消费的日志序号
+        """
+        from .models import ChangeLogCheckpoint
+
+        seq = ChangeLogCheckpoint.objects.filter(
+            consumer=consumer, bucket_id=bucket_id).values_list('seq', flat=True).first()
+        return seq if seq else 0
+
+    @staticmethod
+    def set_checkpoint(consumer: str, bucket_id: int, seq: int):
+        from .models import ChangeLogCheckpoint
+
+        ChangeLogCheckpoint.objects.update_or_create(consumer=consumer, bucket_id=bucket_id, defaults={'seq': seq})
+
+    @staticmethod
+    def get_prunable_seq(bucket_id: int):
+        """
+        桶的所有消费者都已消费的日志序号，不大于此序号的日志可以删除
+
+        * 消费者包括celery('celery')、按节点编号分配的工作节点(async_worker_*)和分片租约(async_shard_{id})，取所有检查点的最小值；
+        * 桶的每个开启的备份点至少要有一个消费者的检查点，按分片租约同步的备份点每个分片都要有检查点，否则日志还未被消费，返回0
+
+        :return: int
+        """
+        from .models import BackupBucket, ChangeLogCheckpoint, AsyncShardLease
+        from .utils import is_model_table_exists
+
+        checkpoints = dict(ChangeLogCheckpoint.objects.filter(bucket_id=bucket_id).values_list('consumer', 'seq'))
+        if not checkpoints:
+            return 0
+
+        shards = []
+        if is_model_table_exists(AsyncShardLease):
+            shards = list(AsyncShardLease.objects.filter(bucket_id=bucket_id).values_list('id', 'backup_num'))
+
+        for shard_id, _ in shards:
+            if f'async_shard_{shard_id}' not in checkpoints:
+                return 0
+
+        shard_backup_nums = {num for _, num in shards}
+        backup_nums = BackupBucket.objects.filter(
+            bucket_id=bucket_id, status=BackupBucket.Status.START).values_list('backup_num', flat=True)
+        for num in backup_nums:
+            if 'celery' in checkpoints or num in shard_backup_nums:
+                continue
+
+            if not any(c.startswith('async_worker_') and c.endswith(f'_{num}') for c in checkpoints):
+                return 0
+
+        return min(checkpoints.values())
+
+    @staticmethod
+    def prune(bucket_id: int, seq_lte: int, batch: int = 1000):
+        """
+        删除桶的已消费日志，每次删除batch条，避免长时间锁表
+
+        :param bucket_id: 桶id
+        :param seq_lte: 删除序号不大于此序号的日志
+        :param batch: 每次删除的数量
+        :return: int    # 删除的数量
+        """
+        from .models import ObjectChangeLog
+
+        if seq_lte <= 0:
+            return 0
+
+        deleted = 0
+        while True:
+            ids = list(ObjectChangeLog.objects.filter(
+                bucket_id=bucket_id, id__lte=seq_lte).order_by('id').values_list('id', flat=True)[0:batch])
+            if not ids:
+                break
+
+            count, _ = ObjectChangeLog.objects.filter(id__in=ids).delete()
+            deleted += count
+            if len(ids) < batch:
+                break
+
+        return deleted
+
+
+change_log = ChangeLogManager(check_ttl=getattr(settings, 'CHANGE_LOG_CHECK_TTL', 60))
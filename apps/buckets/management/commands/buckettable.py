@@ -19,6 +19,10 @@ class Command(BaseCommand):
            ** ALTER TABLE {table_name} ADD md5 CHAR(32) NOT NULL DEFAULT '' COMMENT 'MD5' **  
            ** ALTER TABLE {table_name} MODIFY COLUMN md5 VARCHAR(200) NOT NULL DEFAULT 'abcd' **
            ** ALTER TABLE {table_name} ADD COLUMN \`async1\` datetime(6) NULL; **
+           ** ALTER TABLE {table_name} ADD COLUMN \`layout\` smallint NOT NULL DEFAULT 0, ADD COLUMN \`stripe_unit\` integer NOT NULL DEFAULT 0; **
+           ** ALTER TABLE {table_name} ADD COLUMN \`manifest_part_size\` bigint NOT NULL DEFAULT 0, ADD COLUMN \`manifest_stride\` bigint NOT NULL DEFAULT 0, ADD COLUMN \`manifest_parts\` integer NOT NULL DEFAULT 0; **
+           ** ALTER TABLE {table_name} ADD COLUMN \`sk\` varchar(512) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL DEFAULT '', ADD INDEX \`sk_idx\` (\`sk\`); **
+           ** ALTER TABLE {table_name} ADD INDEX \`did_fod_id_idx\` (\`did\`, \`fod\`, \`id\`); **
            """
 
     def add_arguments(self, parser):
@@ -0,0 +1,122 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from buckets.utils import (BucketFileManagement, create_table_for_model_class, delete_table_for_model_class,
+                           is_model_table_exists)
+from buckets.models import Bucket
+from buckets.search import search_index, get_search_index_model_class, get_name_ngrams
+
+
+class Command(BaseCommand):
+    """
+    创建并补全存储桶的对象检索索引表，补全完成后对象检索才使用索引；
+    创建索引表后等待各进程感知到索引表(SEARCH_INDEX_CHECK_TTL秒)再开始补全，之后新建、重命名的对象由各进程增量维护
+    """
+    help = """
+            ** manage.py buildsearchindex --all [--id-gt=xxx] [--batch=2000] [--rebuild] [--no-wait] **
+            ** manage.py buildsearchindex --bucket-name=xxx [--batch=2000] [--rebuild] [--no-wait] **
+           """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default=None, dest='bucketname',
+            help='Name of bucket will',
+        )
+        parser.add_argument(
+            '--all', default=None, nargs='?', dest='all', const=True,  # 当命令行有此参数时取值const, 否则取值default
+            help='build search index for all buckets',
+        )
+        parser.add_argument(
+            '--id-gt', default=0, dest='id-gt', type=int,
+            help='All buckets with ID greater than "id-gt".',
+        )
+        parser.add_argument(
+            '--batch', default=2000, dest='batch', type=int,
+            help='Number of objects indexed in one batch.',
+        )
+        parser.add_argument(
+            '--rebuild', default=False, nargs='?', dest='rebuild', const=True,
+            help='Drop the existing search index table and build again.',
+        )
+        parser.add_argument(
+            '--no-wait', default=False, nargs='?', dest='no-wait', const=True,
+            help='Do not wait for other processes to find the new index table, use only when the service is stopped.',
+        )
+
+    def handle(self, *args, **options):
+        buckets = self.get_buckets(**options)
+        batch = max(options['batch'], 1)
+        count = 0
+        for bucket in buckets:
+            try:
+                count += self.build_bucket(bucket, batch=batch, rebuild=options['rebuild'],
+                                           wait=not options['no-wait'])
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'build search index of bucket({bucket.name}) error: {e}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} objects.'))
+
+    def get_buckets(self, **options):
+        """
+        获取给定的bucket或所有bucket
+        """
+        bucketname = options['bucketname']
+        all_ = options['all']
+        id_gt = options['id-gt']
+
+        if bucketname:
+            self.stdout.write(self.style.NOTICE('Buckets named {0}'.format(bucketname)))
+            qs = Bucket.objects.filter(name=bucketname)
+        elif all_ is not None:
+            self.stdout.write(self.style.NOTICE('All buckets.'))
+            qs = Bucket.objects.all()
+            if id_gt > 0:
+                qs = qs.filter(id__gt=id_gt)
+        else:
+            raise CommandError("Either '--bucket-name' or '--all' is required.")
+
+        return qs.order_by('id')
+
+    def build_bucket(self, bucket, batch: int, rebuild: bool, wait: bool):
+        """
+        :return: int    # 索引的对象数量
+        """
+        close_old_connections()
+        table_name = bucket.get_bucket_table_name()
+        obj_model = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        index_model = get_search_index_model_class(table_name)
+        if rebuild and not delete_table_for_model_class(index_model):
+            raise Exception('drop search index table failed')
+
+        if is_model_table_exists(index_model):
+            if index_model.objects.filter(gram=search_index.READY_GRAM, oid=0).exists():
+                self.stdout.write(f'bucket({bucket.name}) search index is ready, skip.')
+                return 0
+        else:
+            if not create_table_for_model_class(index_model):
+                raise Exception('create search index table failed')
+
+            if wait:
+                self.stdout.write(f'bucket({bucket.name}) waiting {search_index.check_ttl}s for other processes.')
+                time.sleep(search_index.check_ttl)
+
+        count = 0
+        id_gt = 0
+        while True:
+            close_old_connections()
+            objs = list(obj_model.objects.filter(id__gt=id_gt, fod=True).order_by('id').values_list(
+                'id', 'name')[0:batch])
+            if not objs:
+                break
+
+            items = [index_model(gram=g, oid=oid) for oid, name in objs for g in get_name_ngrams(name)]
+            index_model.objects.bulk_create(items, batch_size=1000, ignore_conflicts=True)
+            count += len(objs)
+            id_gt = objs[-1][0]
+
+        index_model.objects.bulk_create([index_model(gram=search_index.READY_GRAM, oid=0)], ignore_conflicts=True)
+        search_index.clear_state(table_name)
+        self.stdout.write(f'bucket({bucket.name}) indexed {count} objects.')
+        return count
@@ -3,11 +3,12 @@ from datetime import timedelta
 
 from django.utils import timezone
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, router
 from django.db.utils import ProgrammingError
 
 from buckets.utils import BucketFileManagement, delete_table_for_model_class
-from buckets.models import Archive
-from utils.oss.shortcuts import build_rados_harbor_object
+from buckets.search import get_search_index_model_class
+from buckets.models import Archive, GarbageObject
 
 
 class Command(BaseCommand):
@@ -105,7 +106,7 @@ class Command(BaseCommand):
         self.stdout.write(self.style.NOTICE('Will clear all buckets named {0}'.format(bucket_name)))
         return Archive.objects.filter(name=bucket_name, type=Archive.TYPE_COMMON).all()
 
-    def get_objs_and_dirs(self, model_class, num=100):
+    def get_objs_and_dirs(self, model_class, num=1000):
         """
         获取对象,默认最多返回1000条
 
@@ -176,24 +177,18 @@ class Command(BaseCommand):
                 if objs is None or len(objs) <= 0:
                     break
 
-                for obj in objs:
-                    if obj.is_file():
-                        obj_key = obj.get_obj_key(bucket.id)
-                        ho = build_rados_harbor_object(obj=obj, obj_rados_key=obj_key)
-                        ok, err = ho.delete(obj_size=obj.si)
-                        if ok:
-                            obj.delete()
-                        else:
-                            self.stdout.write(self.style.WARNING(
-                                f"Failed to deleted a object from ceph:" + err))
-                    else:
-                        obj.delete()
+                # 删除元数据，对象rados数据加入删除队列，由后台(manage.py gcobjects)删除
+                objs = list(objs)
+                with transaction.atomic(using=router.db_for_write(model_class)):
+                    GarbageObject.enqueue_objs(bucket_id=bucket.id, objs=objs)
+                    model_class.objects.filter(id__in=[o.id for o in objs]).delete()
 
                 self.stdout.write(self.style.WARNING(
-                    f"{times} Success deleted {objs.count()} objects from bucket {bucket.name}."))
+                    f"{times} Success deleted {len(objs)} objects from bucket {bucket.name}."))
 
             # 如果bucket对应表没有对象了，删除bucket和表
             if model_class.objects.filter(fod=True).count() == 0:
+                delete_table_for_model_class(get_search_index_model_class(table_name))
                 if delete_table_for_model_class(model_class):
                     bucket.delete()
                     self.stdout.write(self.style.WARNING(f"deleted bucket and it's table:{bucket.name}"))
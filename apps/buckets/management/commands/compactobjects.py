@@ -0,0 +1,158 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, close_old_connections
+
+from buckets.utils import BucketFileManagement
+from buckets.models import Bucket
+from s3.harbor import HarborManager
+from s3.models import MultipartUpload
+from s3 import exceptions
+from utils.md5 import FileMD5Handler
+
+
+class Command(BaseCommand):
+    """
+    整理有part清单的对象（多部分上传块之间有空隙存储），把对象数据重写为连续存储，
+    可作为后台定时任务执行，对象数据的读写不依赖整理
+    """
+    help = """
+            ** manage.py compactobjects --all [--id-gt=xxx] **
+            ** manage.py compactobjects --bucket-name=xxx **
+           """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default=None, dest='bucketname',
+            help='Name of bucket will',
+        )
+        parser.add_argument(
+            '--all', default=None, nargs='?', dest='all', const=True,  # 当命令行有此参数时取值const, 否则取值default
+            help='compact objects for all buckets',
+        )
+        parser.add_argument(
+            '--id-gt', default=0, dest='id-gt', type=int,
+            help='All buckets with ID greater than "id-gt".',
+        )
+
+    def handle(self, *args, **options):
+        buckets = self.get_buckets(**options)
+        count = 0
+        for bucket in buckets:
+            count += self.compact_bucket(bucket)
+
+        self.stdout.write(self.style.SUCCESS(f'Compacted {count} objects.'))
+
+    def get_buckets(self, **options):
+        """
+        获取给定的bucket或所有bucket
+        """
+        bucketname = options['bucketname']
+        all_ = options['all']
+        id_gt = options['id-gt']
+
+        if bucketname:
+            self.stdout.write(self.style.NOTICE('Buckets named {0}'.format(bucketname)))
+            qs = Bucket.objects.filter(name=bucketname)
+        elif all_ is not None:
+            self.stdout.write(self.style.NOTICE('All buckets.'))
+            qs = Bucket.objects.all()
+            if id_gt > 0:
+                qs = qs.filter(id__gt=id_gt)
+        else:
+            raise CommandError("Either '--bucket-name' or '--all' is required.")
+
+        return qs.order_by('id')
+
+    def compact_bucket(self, bucket):
+        """
+        :return: int    # 整理的对象数量
+        """
+        close_old_connections()
+        if not bucket.lock_writeable():
+            self.stdout.write(self.style.WARNING(f'Skip bucket(name={bucket.name}), bucket is locked'))
+            return 0
+
+        table_name = bucket.get_bucket_table_name()
+        model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        count = 0
+        id_gt = 0
+        while True:
+            objs = model_class.objects.filter(
+                id__gt=id_gt, fod=True, manifest_stride__gt=0).order_by('id')[0:100]
+            objs = list(objs)
+            if not objs:
+                break
+
+            for obj in objs:
+                id_gt = obj.id
+                if not obj.has_part_manifest():
+                    continue
+
+                if self.compact_object(bucket=bucket, obj=obj):
+                    count += 1
+
+        return count
+
+    def compact_object(self, bucket, obj):
+        """
+        对象数据复制到新的临时对象(连续存储)，然后临时对象替换原对象，删除原对象数据
+
+        :return:
+            True    # success
+            False   # failed
+        """
+        hm = HarborManager()
+        ts = int(time.time() * 1000)
+        temp_key = f'{obj.na}_{ts}_compact_temp'
+        try:
+            temp_obj, created = hm.get_or_create_obj(table_name=bucket.get_bucket_table_name(), obj_path_name=temp_key)
+        except exceptions.S3Error as e:
+            self.stdout.write(self.style.ERROR(f'Failed to create temp object for "{obj.na}", {str(e)}'))
+            return False
+
+        old_rados = hm.get_obj_rados(bucket=bucket, obj=obj)
+        temp_rados = hm.get_obj_rados(bucket=bucket, obj=temp_obj)
+        md5_handler = None if len(obj.md5) == 32 else FileMD5Handler()
+        ok, ret = temp_rados.copy_from(source=old_rados, md5_handler=md5_handler)
+        if not ok or ret != obj.si:
+            self.clear_temp_obj(temp_obj=temp_obj, temp_rados=temp_rados)
+            self.stdout.write(self.style.ERROR(f'Failed to copy data of object "{obj.na}", {ret}'))
+            return False
+
+        md5 = obj.md5 if md5_handler is None else md5_handler.hex_md5
+        model = obj._meta.model
+        try:
+            with transaction.atomic(using='metadata'):
+                # 整理过程中对象被修改了，放弃
+                locked = model.objects.select_for_update().filter(
+                    id=obj.id, ult=obj.ult, si=obj.si, manifest_stride=obj.manifest_stride).first()
+                if locked is None:
+                    raise Exception('object was modified')
+
+                locked.delete()
+                fields = ['na', 'name', 'na_md5', 'sk', 'ult', 'upt', 'dlc', 'shp', 'stl', 'sst', 'set', 'share',
+                          'async1', 'async2', 'sync_start1', 'sync_end1', 'sync_start2', 'sync_end2']
+                for f in fields:
+                    setattr(temp_obj, f, getattr(obj, f))
+
+                temp_obj.si = obj.si
+                temp_obj.md5 = md5
+                temp_obj.save(update_fields=fields + ['si', 'md5'])
+                MultipartUpload.objects.filter(bucket_id=bucket.id, obj_id=obj.id).update(obj_id=temp_obj.id)
+        except Exception as e:
+            self.clear_temp_obj(temp_obj=temp_obj, temp_rados=temp_rados)
+            self.stdout.write(self.style.ERROR(f'Failed to replace object "{obj.na}", {str(e)}'))
+            return False
+
+        ok, msg = old_rados.delete()
+        if not ok:
+            self.stdout.write(self.style.WARNING(f'Failed to delete old data of object "{obj.na}", {msg}'))
+
+        self.stdout.write(f'Compacted object "{obj.na}"')
+        return True
+
+    @staticmethod
+    def clear_temp_obj(temp_obj, temp_rados):
+        temp_obj.do_delete()
+        temp_rados.delete()
@@ -205,21 +205,11 @@ class Command(BaseCommand):
             else:
                 break
 
-        # 复制对象
+        # 复制对象，rados数据在服务端复制
         for i in range(6):
             try:
-                from_obj_generator = self.hm._get_obj_generator(bucket=self.from_bucket, obj=obj, per_size=32*1024**2)
-                to_obj_generator = self.hm.get_write_generator(bucket_name=self.to_bucket.name, obj_path=target_obj_path)
-                next(to_obj_generator)
-                offset = 0
-                for data in from_obj_generator:
-                    ok = to_obj_generator.send((offset, data))  # ok = True写入成功， ok=False写入失败
-                    if not ok:
-                        ok = to_obj_generator.send((offset, data))  # ok = True写入成功， ok=False写入失败
-                        if not ok:
-                            raise Exception('write object error')
-
-                    offset = offset + len(data)
+                self.hm.copy_object(bucket=self.from_bucket, obj=obj, to_bucket_name=self.to_bucket.name,
+                                    to_obj_path=target_obj_path)
                 return True
             except Exception as e:
                 continue
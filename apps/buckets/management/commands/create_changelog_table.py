@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.utils import (create_table_for_model_class, is_model_table_exists)
+from buckets.models import ObjectChangeLog, ChangeLogCheckpoint
+
+
+class Command(BaseCommand):
+    """
+    创建对象变更日志(ObjectChangeLog)和消费检查点(ChangeLogCheckpoint)数据库表
+    """
+
+    help = """** manage.py create_changelog_table **"""
+
+    def handle(self, *args, **options):
+        models = [model for model in [ObjectChangeLog, ChangeLogCheckpoint] if not is_model_table_exists(model)]
+        if not models:
+            self.stdout.write(self.style.SUCCESS('The tables already exist'))
+            return
+
+        tables = ', '.join([model._meta.db_table for model in models])
+        self.stdout.write(self.style.NOTICE(f'Tables {tables}:'))
+        if input('Are you sure to create the tables?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
+            raise CommandError("cancelled.")
+
+        for model in models:
+            if create_table_for_model_class(model):
+                self.stdout.write(self.style.SUCCESS(f'Create the table {model._meta.db_table} Successfully.'))
+            else:
+                self.stdout.write(self.style.ERROR(f'Failed to create the table {model._meta.db_table}'))
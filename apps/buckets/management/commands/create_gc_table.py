@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.utils import (create_table_for_model_class, is_model_table_exists)
+from buckets.models import GarbageObject
+
+
+class Command(BaseCommand):
+    """
+    创建待删除对象数据(GarbageObject)数据库表
+    """
+
+    help = """** manage.py create_gc_table **"""
+
+    def handle(self, *args, **options):
+        model = GarbageObject
+        self.stdout.write(self.style.NOTICE(f'Table {model._meta.db_table}:'))
+        if is_model_table_exists(model):
+            self.stdout.write(self.style.SUCCESS('The table already exists'))
+            return
+
+        if input('Are you sure to create the table?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
+            raise CommandError("cancelled.")
+
+        if create_table_for_model_class(model):
+            self.stdout.write(self.style.SUCCESS('Create the table Successfully.'))
+        else:
+            self.stdout.write(self.style.ERROR('Failed to create the table'))
@@ -0,0 +1,135 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.conf import settings
+
+from buckets.utils import BucketFileManagement
+from buckets.models import Bucket
+from s3.harbor import HarborManager
+from utils.md5 import FileMD5Handler
+
+
+class Command(BaseCommand):
+    """
+    补全延后计算的对象md5（多部分上传完成时不计算对象md5），读取对象数据计算md5，
+    可作为后台定时任务执行，通过--rate限制读取速率
+    """
+    help = """
+            ** manage.py fillobjectsmd5 --all [--id-gt=xxx] [--rate=50] **
+            ** manage.py fillobjectsmd5 --bucket-name=xxx [--rate=50] **
+           """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default=None, dest='bucketname',
+            help='Name of bucket will',
+        )
+        parser.add_argument(
+            '--all', default=None, nargs='?', dest='all', const=True,  # 当命令行有此参数时取值const, 否则取值default
+            help='fill md5 of objects for all buckets',
+        )
+        parser.add_argument(
+            '--id-gt', default=0, dest='id-gt', type=int,
+            help='All buckets with ID greater than "id-gt".',
+        )
+        parser.add_argument(
+            '--rate', default=getattr(settings, 'OBJECT_MD5_FILL_RATE', 50), dest='rate', type=int,
+            help='Max read rate (MB/s) of object data, 0 is unlimited.',
+        )
+
+    def handle(self, *args, **options):
+        buckets = self.get_buckets(**options)
+        self.rate = options['rate'] * 1024 ** 2
+        count = 0
+        for bucket in buckets:
+            count += self.fill_bucket(bucket)
+
+        self.stdout.write(self.style.SUCCESS(f'Filled md5 of {count} objects.'))
+
+    def get_buckets(self, **options):
+        """
+        获取给定的bucket或所有bucket
+        """
+        bucketname = options['bucketname']
+        all_ = options['all']
+        id_gt = options['id-gt']
+
+        if bucketname:
+            self.stdout.write(self.style.NOTICE('Buckets named {0}'.format(bucketname)))
+            qs = Bucket.objects.filter(name=bucketname)
+        elif all_ is not None:
+            self.stdout.write(self.style.NOTICE('All buckets.'))
+            qs = Bucket.objects.all()
+            if id_gt > 0:
+                qs = qs.filter(id__gt=id_gt)
+        else:
+            raise CommandError("Either '--bucket-name' or '--all' is required.")
+
+        return qs.order_by('id')
+
+    def fill_bucket(self, bucket):
+        """
+        :return: int    # 补全md5的对象数量
+        """
+        close_old_connections()
+        table_name = bucket.get_bucket_table_name()
+        model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        count = 0
+        id_gt = 0
+        while True:
+            objs = model_class.objects.filter(id__gt=id_gt, fod=True, si__gt=0, md5='').order_by('id')[0:100]
+            objs = list(objs)
+            if not objs:
+                break
+
+            for obj in objs:
+                id_gt = obj.id
+                if not obj.is_md5_deferred():
+                    continue
+
+                if self.fill_object_md5(bucket=bucket, obj=obj):
+                    count += 1
+
+        return count
+
+    def fill_object_md5(self, bucket, obj):
+        """
+        读取对象数据计算md5，对象在计算期间被修改时放弃
+
+        :return:
+            True    # success
+            False   # failed
+        """
+        rados = HarborManager.get_obj_rados(bucket=bucket, obj=obj)
+        md5_handler = FileMD5Handler()
+        start = time.time()
+        read_size = 0
+        for data in rados.read_obj_generator():
+            md5_handler.update(offset=read_size, data=data)
+            read_size += len(data)
+            self.throttle(start=start, read_size=read_size)
+
+        if read_size != obj.si:
+            self.stdout.write(self.style.ERROR(f'Failed to read data of object "{obj.na}"'))
+            return False
+
+        model = obj._meta.model
+        try:
+            r = model.objects.filter(id=obj.id, si=obj.si, upt=obj.upt, md5='').update(md5=md5_handler.hex_md5)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Failed to update md5 of object "{obj.na}", {str(e)}'))
+            return False
+
+        return r > 0
+
+    def throttle(self, start: float, read_size: int):
+        """
+        读取速率超过限制时等待
+        """
+        if self.rate <= 0:
+            return
+
+        delay = read_size / self.rate - (time.time() - start)
+        if delay > 0:
+            time.sleep(delay)
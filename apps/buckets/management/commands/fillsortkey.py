@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections, router
+
+from buckets.utils import BucketFileManagement
+from buckets.models import Bucket, BucketFileBase
+
+
+class Command(BaseCommand):
+    """
+    补全桶表中对象的排序键sk，桶表增加sk列后(manage.py buckettable)执行，
+    桶表所有记录的sk补全后，S3列举对象才按sk索引分页
+    """
+    help = """
+            ** manage.py fillsortkey --all [--id-gt=xxx] [--batch=10000] **
+            ** manage.py fillsortkey --bucket-name=xxx [--batch=10000] **
+           """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default=None, dest='bucketname',
+            help='Name of bucket will',
+        )
+        parser.add_argument(
+            '--all', default=None, nargs='?', dest='all', const=True,  # 当命令行有此参数时取值const, 否则取值default
+            help='fill sort key of objects for all buckets',
+        )
+        parser.add_argument(
+            '--id-gt', default=0, dest='id-gt', type=int,
+            help='All buckets with ID greater than "id-gt".',
+        )
+        parser.add_argument(
+            '--batch', default=10000, dest='batch', type=int,
+            help='Range of object ID updated in one sql.',
+        )
+
+    def handle(self, *args, **options):
+        buckets = self.get_buckets(**options)
+        batch = max(options['batch'], 1)
+        count = 0
+        for bucket in buckets:
+            try:
+                count += self.fill_bucket(bucket, batch=batch)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'fill sort key of bucket({bucket.name}) error: {e}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Filled sort key of {count} objects.'))
+
+    def get_buckets(self, **options):
+        """
+        获取给定的bucket或所有bucket
+        """
+        bucketname = options['bucketname']
+        all_ = options['all']
+        id_gt = options['id-gt']
+
+        if bucketname:
+            self.stdout.write(self.style.NOTICE('Buckets named {0}'.format(bucketname)))
+            qs = Bucket.objects.filter(name=bucketname)
+        elif all_ is not None:
+            self.stdout.write(self.style.NOTICE('All buckets.'))
+            qs = Bucket.objects.all()
+            if id_gt > 0:
+                qs = qs.filter(id__gt=id_gt)
+        else:
+            raise CommandError("Either '--bucket-name' or '--all' is required.")
+
+        return qs.order_by('id')
+
+    def fill_bucket(self, bucket, batch: int):
+        """
+        按id范围分批更新，每条sql只锁定一个id范围内的记录
+
+        :return: int    # 补全sk的对象数量
+        """
+        close_old_connections()
+        table_name = bucket.get_bucket_table_name()
+        model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        max_id = model_class.objects.order_by('-id').values_list('id', flat=True).first()
+        if not max_id:
+            return 0
+
+        connection = connections[router.db_for_write(model_class)]
+        sql = f"UPDATE `{table_name}` SET `sk` = LEFT(`na`, {BucketFileBase.SORT_KEY_LENGTH}) " \
+              f"WHERE `sk` = '' AND `id` > %s AND `id` <= %s"
+        count = 0
+        id_gt = 0
+        while id_gt < max_id:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [id_gt, id_gt + batch])
+                count += cursor.rowcount
+
+            id_gt += batch
+
+        self.stdout.write(f'bucket({bucket.name}) filled sort key of {count} objects.')
+        return count
@@ -0,0 +1,190 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from buckets.models import GarbageObject
+from utils.oss.shortcuts import build_rados_harbor_object
+
+
+class RateLimiter:
+    """
+    限制每秒删除的rados对象数量，平滑对ceph OSD的压力
+    """
+    def __init__(self, rate: int):
+        """
+        :param rate: 每秒最多删除的rados对象数量，小于等于0不限制
+        """
+        self.rate = rate
+        self._next_time = time.monotonic()
+
+    def acquire(self, n: int):
+        if self.rate <= 0:
+            return
+
+        now = time.monotonic()
+        if self._next_time > now:
+            time.sleep(self._next_time - now)
+            now = self._next_time
+
+        self._next_time = now + n / self.rate
+
+
+class Command(BaseCommand):
+    """
+    删除待删除队列(GarbageObject)中对象的rados数据
+
+    * 按存储池分组，每组通过aio_remove并行删除，每秒删除的rados对象数量受--rate限制；
+    * 删除成功的记录从队列移除，失败的记录增加失败次数，并按失败次数退避到下次删除时间；
+    * --daemon模式下循环执行，队列中没有到期的记录时等待--interval秒
+    """
+    help = """
+            ** manage.py gcobjects [--daemon] [--batch=500] [--rate=500] [--max-in-flight=64] [--interval=10] **
+           """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--daemon', default=False, nargs='?', dest='daemon', const=True,
+            help='Run forever, wait for new garbage objects when the queue is empty.',
+        )
+        parser.add_argument(
+            '--batch', default=500, dest='batch', type=int,
+            help='Number of garbage objects fetched from the queue in one round.',
+        )
+        parser.add_argument(
+            '--rate', default=getattr(settings, 'GC_RADOS_REMOVE_RATE', 500), dest='rate', type=int,
+            help='Max number of rados objects removed per second, 0 means no limit.',
+        )
+        parser.add_argument(
+            '--max-in-flight', default=64, dest='max-in-flight', type=int,
+            help='Max number of rados aio remove operations in flight.',
+        )
+        parser.add_argument(
+            '--interval', default=10, dest='interval', type=int,
+            help='Seconds to wait when there is no garbage object to delete in daemon mode.',
+        )
+
+    def handle(self, *args, **options):
+        batch = options['batch']
+        max_in_flight = options['max-in-flight']
+        if batch < 1 or max_in_flight < 1:
+            raise CommandError("The value of '--batch' and '--max-in-flight' must be greater than 0.")
+
+        self.max_in_flight = max_in_flight
+        self.limiter = RateLimiter(rate=options['rate'])
+        daemon = options['daemon']
+        interval = max(options['interval'], 1)
+        total_deleted = total_failed = 0
+        while True:
+            try:
+                count, deleted, failed = self.gc_once(batch=batch)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'gc objects error, {str(e)}'))
+                if not daemon:
+                    break
+
+                time.sleep(interval)
+                continue
+
+            total_deleted += deleted
+            total_failed += failed
+            if count > 0:
+                self.stdout.write(f'Deleted {deleted} objects, failed {failed}.')
+
+            if count < batch:
+                if not daemon:
+                    break
+
+                time.sleep(interval)
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {total_deleted} objects, failed {total_failed}.'))
+
+    def gc_once(self, batch: int):
+        """
+        删除队列中一批到期的对象
+
+        :return: (int, int, int)   # 取出的数量，删除成功数量，删除失败数量
+        """
+        close_old_connections()
+        now = timezone.now()
+        items = list(GarbageObject.objects.filter(next_time__lte=now).order_by('next_time')[0:batch])
+        if not items:
+            return 0, 0, 0
+
+        failed = {}
+        groups = {}
+        for item in items:
+            try:
+                ho = build_rados_harbor_object(obj=item, obj_rados_key=item.obj_key)
+            except Exception as e:
+                failed[item.id] = str(e)
+                continue
+
+            groups.setdefault(item.pool_id, []).append((item, ho))
+
+        for group in groups.values():
+            failed.update(self.delete_pool_objects(group))
+
+        deleted_ids = [item.id for item in items if item.id not in failed]
+        if deleted_ids:
+            GarbageObject.objects.filter(id__in=deleted_ids).delete()
+
+        if failed:
+            self.record_failed(items=[item for item in items if item.id in failed], failed=failed)
+
+        return len(items), len(deleted_ids), len(failed)
+
+    def delete_pool_objects(self, group: list):
+        """
+        删除同一个存储池中的一组对象的rados数据
+
+        :param group: [(GarbageObject(), HarborObject()), ]
+        :return:
+            dict    # 删除失败的对象，{id: 错误描述}
+        """
+        try:
+            rados = group[0][1].get_rados_api()
+        except Exception as e:
+            return {item.id: str(e) for item, _ in group}
+
+        budget = self.max_in_flight * 4     # 每次提交的rados对象数量
+        failed = {}
+        objs = {}
+        parts_count = 0
+        for item, ho in group:
+            parts_id = ho.get_parts_id()
+            objs[item.id] = parts_id
+            parts_count += len(parts_id)
+            if parts_count >= budget:
+                failed.update(self.aio_delete(rados=rados, objs=objs, parts_count=parts_count))
+                objs = {}
+                parts_count = 0
+
+        if objs:
+            failed.update(self.aio_delete(rados=rados, objs=objs, parts_count=parts_count))
+
+        return failed
+
+    def aio_delete(self, rados, objs: dict, parts_count: int):
+        self.limiter.acquire(parts_count)
+        try:
+            return rados.aio_delete_objects(objs=objs, max_in_flight=self.max_in_flight)
+        except Exception as e:
+            return {key: str(e) for key in objs}
+
+    def record_failed(self, items: list, failed: dict):
+        """
+        记录删除失败的次数和原因，按失败次数退避下次删除时间
+        """
+        now = timezone.now()
+        for item in items:
+            item.retry += 1
+            item.error = failed[item.id][:255]
+            item.next_time = now + timedelta(seconds=GarbageObject.get_retry_delay(item.retry))
+            self.stdout.write(self.style.ERROR(
+                f'Failed to delete rados data of {item.obj_key}, retry {item.retry}, {item.error}'))
+
+        GarbageObject.objects.bulk_update(items, fields=['retry', 'error', 'next_time'])
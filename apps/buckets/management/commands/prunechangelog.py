@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from buckets.changelog import change_log
+from buckets.models import ChangeLogCheckpoint
+
+
+class Command(BaseCommand):
+    """
+    删除所有消费者都已消费的对象变更日志(ObjectChangeLog)
+
+    * 每个桶删除序号不大于所有消费者检查点最小值的日志，桶的备份点还没有消费者检查点时不删除；
+    * 不再运行的消费者(如调整了节点数量后的旧async_worker_*)的检查点会阻止删除，需手动删除其检查点记录；
+    * --daemon模式下每--interval秒执行一次
+    """
+    help = """
+            ** manage.py prunechangelog [--bucket-id=xxx] [--batch=1000] [--dry-run] **
+            ** manage.py prunechangelog --daemon [--interval=600] [--batch=1000] **
+           """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-id', default=None, dest='bucket-id', type=int,
+            help='Only prune the change log of the bucket.',
+        )
+        parser.add_argument(
+            '--batch', default=1000, dest='batch', type=int,
+            help='Number of change log rows deleted in one statement.',
+        )
+        parser.add_argument(
+            '--daemon', default=False, nargs='?', dest='daemon', const=True,
+            help='Run forever, prune every "interval" seconds.',
+        )
+        parser.add_argument(
+            '--interval', default=600, dest='interval', type=int,
+            help='Seconds between two rounds in daemon mode.',
+        )
+        parser.add_argument(
+            '--dry-run', default=None, nargs='?', dest='dry-run', const=True,
+            help='only print the sequence each bucket would be pruned to, do not delete.',
+        )
+
+    def handle(self, *args, **options):
+        batch = options['batch']
+        if batch < 1:
+            raise CommandError("The value of '--batch' must be greater than 0.")
+
+        bucket_id = options['bucket-id']
+        dry_run = options['dry-run'] is not None
+        daemon = options['daemon'] and not dry_run
+        interval = max(options['interval'], 1)
+        while True:
+            try:
+                deleted = self.prune_once(bucket_id=bucket_id, batch=batch, dry_run=dry_run)
+                self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} change log rows.'))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'prune change log error, {str(e)}'))
+
+            if not daemon:
+                break
+
+            time.sleep(interval)
+
+    def prune_once(self, bucket_id: int = None, batch: int = 1000, dry_run: bool = False):
+        """
+        :return: int    # 删除的数量
+        """
+        close_old_connections()
+        if bucket_id is not None:
+            bucket_ids = [bucket_id]
+        else:
+            bucket_ids = ChangeLogCheckpoint.objects.order_by('bucket_id').values_list(
+                'bucket_id', flat=True).distinct()
+
+        deleted = 0
+        for bid in bucket_ids:
+            try:
+                seq = change_log.get_prunable_seq(bucket_id=bid)
+                if dry_run:
+                    self.stdout.write(f'bucket(id={bid}): prune change log to seq {seq}')
+                    continue
+
+                count = change_log.prune(bucket_id=bid, seq_lte=seq, batch=batch)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'prune change log of bucket(id={bid}) error, {str(e)}'))
+                continue
+
+            if count:
+                self.stdout.write(f'bucket(id={bid}): deleted {count} change log rows, seq <= {seq}')
+            deleted += count
+
+        return deleted
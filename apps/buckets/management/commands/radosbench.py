@@ -0,0 +1,88 @@
+import time
+
+import rados
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.oss.pyrados import RadosAPI, RadosError
+from utils.oss.shortcuts import build_harbor_object
+
+
+class Command(BaseCommand):
+    """
+    rados操作超时机制的单次操作开销对比：func_timeout装饰器(每次调用启动一个线程) 与 librados自身的操作超时
+    """
+    help = """
+    Compare per-op overhead of func_timeout decorator with librados native op timeout.
+    [manage.py radosbench --count 10000]
+    [manage.py radosbench --count 1000 --using 1 --pool-name obstest --size 4096]
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', default=10000, dest='count', type=int,
+            help='Number of ops for each case.',
+        )
+        parser.add_argument(
+            '--using', default=None, dest='using', type=str,
+            help='Ceph cluster alias, the ops will be performed on ceph rados when given.',
+        )
+        parser.add_argument(
+            '--pool-name', default=None, dest='pool_name', type=str,
+            help='Ceph pool name, default the first pool of the ceph cluster.',
+        )
+        parser.add_argument(
+            '--size', default=4096, dest='size', type=int,
+            help='Bytes of data per write op.',
+        )
+
+    def handle(self, *args, **options):
+        count = options['count']
+        if count < 1:
+            raise CommandError(f"invalid value of 'count', {count}")
+
+        try:
+            from func_timeout import func_set_timeout
+        except ImportError:
+            raise CommandError('func_timeout is not installed, nothing to compare')
+
+        def noop():
+            return 0
+
+        self.report('noop, direct call', count, self.bench(noop, count))
+        self.report('noop, func_set_timeout(10)', count, self.bench(func_set_timeout(10)(noop), count))
+
+        using = options['using']
+        if not using:
+            return
+
+        ho = build_harbor_object(using=using, pool_name=options['pool_name'], obj_id='iharbor_radosbench_object')
+        rados_ = ho.get_rados_api()
+        try:
+            ioctx = rados_._get_cached_ioctx()
+        except RadosError as e:
+            raise CommandError(str(e))
+
+        data = b'x' * options['size']
+
+        def write_op():
+            RadosAPI.ioctx_write(ioctx=ioctx, obj_key='iharbor_radosbench_object', data=data, offset=0)
+
+        try:
+            self.report('rados write, native op timeout', count, self.bench(write_op, count))
+            self.report('rados write, func_set_timeout(10)', count, self.bench(func_set_timeout(10)(write_op), count))
+        finally:
+            try:
+                ioctx.remove_object('iharbor_radosbench_object')
+            except rados.Error:
+                pass
+
+    @staticmethod
+    def bench(func, count):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+
+        return time.perf_counter() - start
+
+    def report(self, name, count, seconds):
+        self.stdout.write(f'{name:<40} total {seconds:.4f}s, per op {seconds / count * 1e6:.2f}us')
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from buckets.models import Bucket
+from buckets.usage import bucket_usage
+
+
+class Command(BaseCommand):
+    """
+    校正存储桶用量统计，桶的对象数量和大小平时由增量维护，定期全表统计校正偏差，
+    可作为后台定时任务执行
+    """
+    help = """
+            ** manage.py reconcilebucketstats [--hours=24] [--limit=100] **
+           """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', default=24, dest='hours', type=int,
+            help='Buckets whose stats are older than "hours" will be reconciled.',
+        )
+        parser.add_argument(
+            '--limit', default=0, dest='limit', type=int,
+            help='Max number of buckets to reconcile, 0 is unlimited.',
+        )
+
+    def handle(self, *args, **options):
+        bucket_usage.flush()
+        stats_before = timezone.now() - timedelta(hours=options['hours'])
+        qs = Bucket.objects.filter(stats_time__lt=stats_before).order_by('stats_time')
+        limit = options['limit']
+        if limit > 0:
+            qs = qs[0:limit]
+
+        num = 0
+        for bucket in qs:
+            close_old_connections()
+            old_count, old_size = bucket.objs_count, bucket.size
+            try:
+                bucket.update_stats()
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'reconcile bucket({bucket.name}) error: {e}'))
+                continue
+
+            num += 1
+            if old_count != bucket.objs_count or old_size != bucket.size:
+                self.stdout.write(self.style.WARNING(
+                    f'bucket({bucket.name}) drift: objects {bucket.objs_count - old_count}, '
+                    f'size {bucket.size - old_size}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully reconcile {num} buckets'))
@@ -0,0 +1,130 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections, router
+
+from buckets.utils import BucketFileManagement
+from buckets.models import Bucket
+
+
+# 新版本桶表增加的列，(列名, ADD COLUMN语句)，按版本顺序
+BUCKET_TABLE_COLUMNS = [
+    ('layout', "ADD COLUMN `layout` smallint NOT NULL DEFAULT 0"),
+    ('stripe_unit', "ADD COLUMN `stripe_unit` integer NOT NULL DEFAULT 0"),
+    ('manifest_part_size', "ADD COLUMN `manifest_part_size` bigint NOT NULL DEFAULT 0"),
+    ('manifest_stride', "ADD COLUMN `manifest_stride` bigint NOT NULL DEFAULT 0"),
+    ('manifest_parts', "ADD COLUMN `manifest_parts` integer NOT NULL DEFAULT 0"),
+    ('sk', "ADD COLUMN `sk` varchar(512) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL DEFAULT ''"),
+]
+# 新版本桶表增加的索引，(索引名, ADD INDEX语句)
+BUCKET_TABLE_INDEXES = [
+    ('sk_idx', "ADD INDEX `sk_idx` (`sk`)"),
+    ('did_fod_id_idx', "ADD INDEX `did_fod_id_idx` (`did`, `fod`, `id`)"),
+]
+
+
+class Command(BaseCommand):
+    """
+    升级旧版本创建的桶表，补齐新版本桶表的列和索引，已有的列和索引跳过，可重复执行；
+    代码升级后需先执行此命令，否则对未升级的桶表的查询会因缺少列而出错
+    """
+    help = """
+            ** manage.py upgradebuckettable --all [--id-gt=xxx] [--dry-run] **
+            ** manage.py upgradebuckettable --bucket-name=xxx [--dry-run] **
+           """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default=None, dest='bucketname',
+            help='Name of bucket will',
+        )
+        parser.add_argument(
+            '--all', default=None, nargs='?', dest='all', const=True,  # 当命令行有此参数时取值const, 否则取值default
+            help='upgrade tables of all buckets',
+        )
+        parser.add_argument(
+            '--id-gt', default=0, dest='id-gt', type=int,
+            help='All buckets with ID greater than "id-gt".',
+        )
+        parser.add_argument(
+            '--dry-run', default=None, nargs='?', dest='dry-run', const=True,
+            help='only print the sql, do not execute.',
+        )
+
+    def handle(self, *args, **options):
+        buckets = self.get_buckets(**options)
+        dry_run = options['dry-run'] is not None
+        upgraded = 0
+        errors = []
+        for bucket in buckets:
+            try:
+                if self.upgrade_bucket(bucket, dry_run=dry_run):
+                    upgraded += 1
+            except Exception as e:
+                errors.append(bucket.name)
+                self.stdout.write(self.style.ERROR(f'upgrade table of bucket({bucket.name}) error: {e}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Upgraded tables of {upgraded} buckets.'))
+        if errors:
+            self.stdout.write(self.style.ERROR(f'error when upgrade tables of buckets: {errors}'))
+        elif upgraded and not dry_run:
+            self.stdout.write(self.style.NOTICE("Run 'manage.py fillsortkey --all' to fill sort keys of old objects."))
+
+    def get_buckets(self, **options):
+        """
+        获取给定的bucket或所有bucket
+        """
+        bucketname = options['bucketname']
+        all_ = options['all']
+        id_gt = options['id-gt']
+
+        if bucketname:
+            self.stdout.write(self.style.NOTICE('Buckets named {0}'.format(bucketname)))
+            qs = Bucket.objects.filter(name=bucketname)
+        elif all_ is not None:
+            self.stdout.write(self.style.NOTICE('All buckets.'))
+            qs = Bucket.objects.all()
+            if id_gt > 0:
+                qs = qs.filter(id__gt=id_gt)
+        else:
+            raise CommandError("Either '--bucket-name' or '--all' is required.")
+
+        return qs.order_by('id')
+
+    @staticmethod
+    def get_missing_clauses(connection, table_name: str):
+        """
+        桶表缺少的列和索引的ALTER子句
+
+        :return: list
+        """
+        with connection.cursor() as cursor:
+            columns = {c.name for c in connection.introspection.get_table_description(cursor, table_name)}
+            indexes = set(connection.introspection.get_constraints(cursor, table_name).keys())
+
+        clauses = [sql for name, sql in BUCKET_TABLE_COLUMNS if name not in columns]
+        clauses += [sql for name, sql in BUCKET_TABLE_INDEXES if name not in indexes]
+        return clauses
+
+    def upgrade_bucket(self, bucket, dry_run: bool = False):
+        """
+        一条ALTER语句补齐一个桶表缺少的列和索引
+
+        :return: True(已升级); False(不需要升级)
+        """
+        close_old_connections()
+        table_name = bucket.get_bucket_table_name()
+        model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        connection = connections[router.db_for_write(model_class)]
+        clauses = self.get_missing_clauses(connection, table_name)
+        if not clauses:
+            return False
+
+        sql = f"ALTER TABLE `{table_name}` " + ', '.join(clauses)
+        if dry_run:
+            self.stdout.write(sql)
+            return True
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+
+        self.stdout.write(self.style.SUCCESS(f'upgraded table of bucket({bucket.name}): {len(clauses)} changes'))
+        return True
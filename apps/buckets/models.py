@@ -4,7 +4,7 @@ import os
 import hashlib
 from datetime import timedelta, datetime
 
-from django.db import models, transaction
+from django.db import models, transaction, router
 from django.db.models import F, Max
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -16,7 +16,12 @@ from ceph.models import CephCluster
 from utils.storagers import PathParser
 from utils.md5 import EMPTY_HEX_MD5
 from utils.crypto import Encryptor
+from utils.writebehind import write_behind
 from api import exceptions
+from buckets.caches import bucket_cache, dir_cache
+from buckets.usage import bucket_usage
+from buckets.search import search_index
+from buckets.changelog import change_log
 
 # debug_logger = logging.getLogger('debug')#这里的日志记录器要和setting中的loggers选项对应，不能随意给参
 
@@ -143,11 +148,22 @@ class Bucket(BucketBase):
     @classmethod
     def get_bucket_by_name(cls, bucket_name):
         """
-        获取存储通对象
+        获取存储通对象，优先从进程内缓存获取
         :param bucket_name: 存储通名称
         :return: Bucket对象; None(不存在)
         """
-        return Bucket.objects.select_related('user').filter(name=bucket_name).first()
+        return bucket_cache.get_by_name(
+            bucket_name, loader=lambda: Bucket.objects.select_related('user').filter(name=bucket_name).first())
+
+    @classmethod
+    def get_bucket_by_id(cls, bucket_id: int):
+        """
+        通过id获取存储通对象，优先从进程内缓存获取
+        :param bucket_id: 存储通id
+        :return: Bucket对象; None(不存在)
+        """
+        return bucket_cache.get_by_id(
+            bucket_id, loader=lambda: Bucket.objects.select_related('user').filter(id=bucket_id).first())
 
     def save(self, *args, **kwargs):
         if not self.ftp_password or len(self.ftp_password) < 6:
@@ -319,15 +335,9 @@ class Bucket(BucketBase):
                 'stats_time': xxxx-xx-xx xx:xx:xx
             }
         """
-        # 强制重新统计，或者旧的统计结果时间超过了50分钟， 满足其一条件重新统计
-        now_t = timezone.now() - timedelta(minutes=50)
-        ts_now = now_t.timestamp()
-        stats_t = self.stats_time
-        if stats_t:
-            ts_stats = stats_t.timestamp()
-        else:
-            ts_stats = 0
-        if now or (ts_now > ts_stats):
+        # 对象数量和大小由上传、删除对象时的增量维护，只有强制时才全表重新统计，
+        # stats_time是最近一次全表统计校正的时间
+        if now:
             self.update_stats()
 
         stats = {'space': self.size, 'count': self.objs_count}
@@ -634,7 +644,19 @@ class BucketFileBase(models.Model):
     @ sst: share_start_time，允许共享且有时间限制，则sst为该文件的共享起始时间，若该doc代表目录，则sst为空;
     @ set: share_end_time，  允许共享且有时间限制，则set为该文件的共享终止时间，若该doc代表目录，则set为空;
     @ sds: soft delete status,软删除,True->删除状态，get_sds_display()可获取可读值
+    @ layout: 对象数据在rados中的布局版本，0为旧布局(每个rados对象最大2GB)，1为条带布局(按stripe_unit切分)
+    @ stripe_unit: 条带布局时每个rados对象的大小(字节数)
+    @ manifest_part_size, manifest_stride: 多部分上传的对象part清单，part之间有空隙存储时，第N(从0开始)个part的数据在
+                rados数据偏移量N*manifest_stride处，part大小(最后一个除外)为manifest_part_size；都为0表示对象数据连续存储
+    @ manifest_parts: part清单的part数量，最后一个part可能大于manifest_part_size
     """
+    LAYOUT_LEGACY = 0
+    LAYOUT_STRIPE = 1
+    LAYOUT_CHOICES = (
+        (LAYOUT_LEGACY, '旧布局'),
+        (LAYOUT_STRIPE, '条带布局'),
+    )
+
     SOFT_DELETE_STATUS_CHOICES = (
         (True, '删除'),
         (False, '正常'),
@@ -673,12 +695,22 @@ class BucketFileBase(models.Model):
     sync_end1 = models.DateTimeField(blank=True, null=True, default=None, verbose_name='第一备份点结束时间')
     sync_start2 = models.DateTimeField(blank=True, null=True, default=None, verbose_name='第二备份点开始时间')
     sync_end2 = models.DateTimeField(blank=True, null=True, default=None, verbose_name='第二备份点结束时间')
+    layout = models.SmallIntegerField(verbose_name='数据布局版本', choices=LAYOUT_CHOICES, default=LAYOUT_LEGACY)
+    stripe_unit = models.IntegerField(verbose_name='条带单元大小', default=0)
+    manifest_part_size = models.BigIntegerField(verbose_name='part清单part大小', default=0)
+    manifest_stride = models.BigIntegerField(verbose_name='part清单存储间隔', default=0)
+    manifest_parts = models.IntegerField(verbose_name='part清单part数量', default=0)
+    # 全路径名的前SORT_KEY_LENGTH个字符，用于按key字典序列举对象
+    sk = models.CharField(verbose_name='排序键', max_length=512, default='', db_collation='utf8mb4_bin')
+
+    SORT_KEY_LENGTH = 512
 
     class Meta:
         abstract = True
         app_label = 'metadata'      # 用于db路由指定此模型对应的数据库
         ordering = ['fod', '-id']
-        indexes = [models.Index(fields=('na_md5',), name='na_md5_idx')]
+        indexes = [models.Index(fields=('na_md5',), name='na_md5_idx'), models.Index(fields=('sk',), name='sk_idx'),
+                   models.Index(fields=('did', 'fod', 'id'), name='did_fod_id_idx')]
         unique_together = ('did', 'name')
         verbose_name = '对象模型抽象基类'
         verbose_name_plural = verbose_name
@@ -890,15 +922,12 @@ class BucketFileBase(models.Model):
 
     def download_cound_increase(self):
         """
-        下载次数加1
+        下载次数加1，延后批量写入数据库，避免热点对象行锁竞争
 
         :return: True(success); False(error)
         """
-        self.dlc = F('dlc') + 1 # (self.dlc or 0) + 1  # 下载次数+1
-        try:
-            self.save(update_fields=['dlc'])
-        except:
-            return False
+        self.dlc = (self.dlc or 0) + 1  # 下载次数+1
+        write_behind.incr(model=self._meta.model, obj_id=self.id, field='dlc', n=1)
         return True
 
     def is_file(self):
@@ -942,6 +971,14 @@ class BucketFileBase(models.Model):
         """
         na = self.na if self.na else ''
         self.na_md5 = get_str_hexMD5(na)
+        self.sk = self.build_sort_key(na)
+
+    @classmethod
+    def build_sort_key(cls, key: str):
+        """
+        对象key的排序键
+        """
+        return key[:cls.SORT_KEY_LENGTH]
 
     def _get_default_pool(self):
         """
@@ -959,13 +996,132 @@ class BucketFileBase(models.Model):
         self.pool_id = pool_.id
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        if not self.na_md5:
+        if not self.na_md5 or not self.sk:
             self.reset_na_md5()
 
         if not self.pool_id:
             self._get_default_pool()
 
+        if self._state.adding and self.fod and self.layout == self.LAYOUT_LEGACY:
+            self._set_default_layout()
+
+        adding = self._state.adding or force_insert
         super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if self.is_dir():
+            self._invalidate_dir_cache(adding=adding)
+        else:
+            if adding or self.na != getattr(self, '_change_na', self.na):  # 新建或重命名的对象路径
+                self._invalidate_dir_cache(adding=True)
+            self._record_usage(adding=adding, update_fields=update_fields)
+            self._update_search_index(adding=adding, update_fields=update_fields)
+            self._record_change_log(adding=adding, update_fields=update_fields)
+
+    def delete(self, using=None, keep_parents=False):
+        obj_id = self.id    # 删除后id被置为None
+        r = super().delete(using=using, keep_parents=keep_parents)
+        if self.is_dir():
+            self._invalidate_dir_cache(adding=False)
+        else:
+            bucket_usage.add(table_name=self._meta.db_table, count=-1, size=-(self.si or 0))
+            self._usage_si = None
+            self.id = obj_id
+            search_index.unindex_object(self)
+            change_log.log_delete(table_name=self._meta.db_table, obj_id=obj_id, obj_key=self.na)
+            self.id = None
+
+        return r
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._usage_si = instance.__dict__.get('si')    # 记录桶用量增量时，对象大小的原值
+        instance._search_name = instance.__dict__.get('name')   # 更新检索索引时，对象名的原值
+        instance._change_na = instance.__dict__.get('na')   # 记录变更日志时，对象key的原值
+        return instance
+
+    # 修改这些字段时记录变更日志
+    CHANGE_LOG_FIELDS = {'na', 'si', 'upt', 'md5', 'layout', 'stripe_unit', 'manifest_part_size', 'manifest_stride',
+                         'manifest_parts'}
+
+    def _record_change_log(self, adding: bool, update_fields=None):
+        """
+        对象新建、修改或重命名后，记录变更日志；重命名记录原key的删除和新key的上传
+        """
+        old_na = getattr(self, '_change_na', None)
+        if not adding and old_na is not None and old_na != self.na:
+            change_log.log_changes(table_name=self._meta.db_table, deleted=[(self.id, old_na)],
+                                   put=[(self.id, self.na)])
+        elif adding or update_fields is None or self.CHANGE_LOG_FIELDS.intersection(update_fields):
+            change_log.log_put(self)
+
+        self._change_na = self.na
+
+    def record_change(self):
+        """
+        通过queryset.update()修改了对象数据时，记录变更日志
+        """
+        change_log.log_put(self)
+
+    def _update_search_index(self, adding: bool, update_fields=None):
+        """
+        对象新建或重命名后，更新检索索引
+        """
+        if adding:
+            search_index.index_object(self)
+        else:
+            old_name = getattr(self, '_search_name', None)
+            if old_name is None or old_name == self.name or (update_fields is not None and 'name' not in update_fields):
+                return
+
+            search_index.index_object(self, old_name=old_name)
+
+        self._search_name = self.name
+
+    def _record_usage(self, adding: bool, update_fields=None):
+        """
+        对象新建或大小修改后，记录桶用量增量
+        """
+        si = self.si or 0
+        if adding:
+            count, size = 1, si
+        else:
+            old_si = getattr(self, '_usage_si', None)
+            if old_si is None or (update_fields is not None and 'si' not in update_fields):
+                return
+
+            count, size = 0, si - old_si
+
+        self._usage_si = si
+        bucket_usage.add(table_name=self._meta.db_table, count=count, size=size)
+
+    def record_usage_size(self, size: int, old_size: int = None):
+        """
+        通过queryset.update()修改了对象大小时，记录桶用量增量
+
+        :param size: 对象修改后的大小
+        :param old_size: 修改前数据库中对象的大小，默认None使用实例上的大小；
+                        并发修改同一对象时应传入加锁读取的当前大小，否则实例上过期的大小会导致重复计数
+        """
+        old_si = old_size
+        if old_si is None:
+            old_si = getattr(self, '_usage_si', None)
+        if old_si is None:
+            old_si = self.si or 0
+
+        self._usage_si = size
+        bucket_usage.add(table_name=self._meta.db_table, size=size - old_si)
+
+    def _invalidate_dir_cache(self, adding: bool):
+        """
+        目录元数据修改后失效目录缓存；
+        新建目录或对象只需失效此路径的negative缓存(对象路径也可能缓存了不存在)，
+        修改（移动、重命名）或删除目录时，子孙路径也可能失效，失效整个桶表的缓存
+        """
+        table_name = self._meta.db_table
+        if adding:
+            dir_cache.invalidate(table_name=table_name, path=self.na, notify=dir_cache.negative_ttl > 0)
+        else:
+            dir_cache.invalidate(table_name=table_name)
 
     def do_save(self, **kwargs):
         """
@@ -1009,6 +1165,75 @@ class BucketFileBase(models.Model):
 
         return self.SHARE_ACCESS_NO
 
+    def _set_default_layout(self):
+        """
+        新对象按配置使用条带布局，OBJECT_STRIPE_UNIT为0时保持旧布局
+        """
+        stripe_unit = getattr(settings, 'OBJECT_STRIPE_UNIT', 0)
+        if stripe_unit and stripe_unit > 0:
+            self.layout = self.LAYOUT_STRIPE
+            self.stripe_unit = stripe_unit
+
+    def get_stripe_unit(self):
+        """
+        获取对象数据布局的条带单元大小
+
+        :return: int; 0(旧布局)
+        """
+        if self.layout == self.LAYOUT_STRIPE and self.stripe_unit > 0:
+            return self.stripe_unit
+
+        return 0
+
+    def get_part_manifest(self):
+        """
+        获取对象的part清单
+
+        :return:
+            (part_size, stride, parts)      # part之间有空隙存储
+            None                            # 对象数据连续存储
+        """
+        if 0 < self.manifest_part_size < self.manifest_stride:
+            return self.manifest_part_size, self.manifest_stride, self.manifest_parts
+
+        return None
+
+    def has_part_manifest(self):
+        return self.get_part_manifest() is not None
+
+    def clear_part_manifest(self):
+        """
+        清除对象的part清单，需要调用者保存到数据库
+
+        :return:
+            list    # 需要更新的字段
+        """
+        self.manifest_part_size = 0
+        self.manifest_stride = 0
+        self.manifest_parts = 0
+        return ['manifest_part_size', 'manifest_stride', 'manifest_parts']
+
+    def is_md5_deferred(self):
+        """
+        对象md5是否延后计算（多部分上传完成时不读取对象数据计算md5），
+        由后台任务(manage.py fillobjectsmd5)补全
+
+        :return:
+            True    # md5未计算
+            False
+        """
+        return self.is_file() and self.si > 0 and not self.md5
+
+    def defer_md5(self):
+        """
+        标记对象md5延后计算，需要调用者保存到数据库
+
+        :return:
+            list    # 需要更新的字段
+        """
+        self.md5 = ''
+        return ['md5']
+
     def get_pool_id(self):
         """
         获取 文件指定的pool_id
@@ -1036,6 +1261,226 @@ class BucketFileBase(models.Model):
         return ins
 
 
+class BucketSearchNgramBase(models.Model):
+    """
+    存储桶对象名n-gram检索索引抽象模型，每个桶一个索引表
+
+    @ gram: 对象名(小写)的n-gram，''是索引补全完成的标记
+    @ oid: 对象id
+    """
+    id = models.BigAutoField(auto_created=True, primary_key=True)
+    gram = models.CharField(verbose_name='n-gram', max_length=3, db_collation='utf8mb4_bin')
+    oid = models.BigIntegerField(verbose_name='对象id')
+
+    class Meta:
+        abstract = True
+        app_label = 'metadata'      # 用于db路由指定此模型对应的数据库
+        indexes = [models.Index(fields=('oid',), name='oid_idx')]
+        unique_together = ('gram', 'oid')
+        verbose_name = '对象检索索引抽象基类'
+        verbose_name_plural = verbose_name
+
+
+class GarbageObject(models.Model):
+    """
+    待删除的对象rados数据，对象元数据删除后，rados数据由后台(manage.py gcobjects)删除
+
+    @ obj_key: 对象在ceph存储池中对应的rados名称
+    @ size: 对象大小
+    @ retry: 删除失败的次数
+    @ next_time: 下次尝试删除的时间，删除失败后按失败次数退避
+    """
+    id = models.BigAutoField(primary_key=True)
+    bucket_id = models.BigIntegerField(verbose_name='存储桶id')
+    pool_id = models.IntegerField(verbose_name='存储池id')
+    obj_key = models.CharField(verbose_name='rados key', max_length=64)
+    size = models.BigIntegerField(verbose_name='对象大小', default=0)
+    stripe_unit = models.IntegerField(verbose_name='条带单元大小', default=0)
+    manifest_part_size = models.BigIntegerField(verbose_name='part清单part大小', default=0)
+    manifest_stride = models.BigIntegerField(verbose_name='part清单存储间隔', default=0)
+    manifest_parts = models.IntegerField(verbose_name='part清单part数量', default=0)
+    create_time = models.DateTimeField(verbose_name='创建时间', auto_now_add=True)
+    retry = models.IntegerField(verbose_name='失败次数', default=0)
+    next_time = models.DateTimeField(verbose_name='下次删除时间', default=timezone.now)
+    error = models.CharField(verbose_name='最后一次失败原因', max_length=255, blank=True, default='')
+
+    RETRY_MIN_DELAY = 60            # 失败后第一次重试的延迟(秒)，之后每次失败延迟加倍
+    RETRY_MAX_DELAY = 6 * 3600      # 重试延迟的上限(秒)
+
+    class Meta:
+        db_table = 'garbage_object'
+        ordering = ['id']
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        indexes = [
+            models.Index(fields=('next_time',), name='next_time_idx')
+        ]
+        verbose_name = '待删除对象数据'
+        verbose_name_plural = verbose_name
+
+    @classmethod
+    def build_from_obj(cls, bucket_id: int, obj):
+        """
+        :param bucket_id: 对象所在桶id
+        :param obj: 对象
+        """
+        part_manifest = obj.get_part_manifest()
+        part_size, stride, parts = part_manifest if part_manifest else (0, 0, 0)
+        return cls(bucket_id=bucket_id, pool_id=obj.get_pool_id(), obj_key=obj.get_obj_key(bucket_id),
+                   size=obj.si, stripe_unit=obj.get_stripe_unit(), manifest_part_size=part_size,
+                   manifest_stride=stride, manifest_parts=parts)
+
+    @classmethod
+    def enqueue_objs(cls, bucket_id: int, objs):
+        """
+        对象rados数据加入删除队列
+
+        :param bucket_id: 对象所在桶id
+        :param objs: 对象列表，目录忽略
+        """
+        items = [cls.build_from_obj(bucket_id=bucket_id, obj=o) for o in objs if o.is_file()]
+        if items:
+            cls.objects.bulk_create(items, batch_size=500)
+
+    @classmethod
+    def delete_obj(cls, bucket_id: int, obj):
+        """
+        删除对象元数据，对象的rados数据加入删除队列，在一个事务中完成
+
+        :param bucket_id: 对象所在桶id
+        :param obj: 对象
+        :raises: Exception
+        """
+        item = cls.build_from_obj(bucket_id=bucket_id, obj=obj)
+        with transaction.atomic(using=router.db_for_write(cls)):
+            obj.delete()
+            item.save(force_insert=True)
+
+    @classmethod
+    def get_retry_delay(cls, retry: int):
+        """
+        第retry次失败后重试的延迟(秒)
+        """
+        return min(cls.RETRY_MIN_DELAY * 2 ** min(max(retry - 1, 0), 20), cls.RETRY_MAX_DELAY)
+
+    # 以下方法用于build_rados_harbor_object()
+    @property
+    def obj_size(self):
+        return self.size
+
+    def get_pool_id(self):
+        return self.pool_id
+
+    def get_stripe_unit(self):
+        return self.stripe_unit
+
+    def get_part_manifest(self):
+        if 0 < self.manifest_part_size < self.manifest_stride:
+            return self.manifest_part_size, self.manifest_stride, self.manifest_parts
+
+        return None
+
+
+class ObjectChangeLog(models.Model):
+    """
+    开启了备份的桶的对象变更日志，备份同步按(bucket_id, id)顺序消费
+
+    @ id: 日志序号
+    @ obj_key: 对象全路径
+    @ action: 上传(修改)或删除
+    """
+    ACTION_PUT = 1
+    ACTION_DELETE = 2
+    CHOICES_ACTION = (
+        (ACTION_PUT, 'put'),
+        (ACTION_DELETE, 'delete')
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    bucket_id = models.BigIntegerField(verbose_name='存储桶id')
+    obj_id = models.BigIntegerField(verbose_name='对象id')
+    obj_key = models.TextField(verbose_name='对象全路径', db_collation='utf8mb4_bin')
+    action = models.SmallIntegerField(verbose_name='操作', choices=CHOICES_ACTION)
+    create_time = models.DateTimeField(verbose_name='创建时间', auto_now_add=True)
+
+    class Meta:
+        db_table = 'object_change_log'
+        ordering = ['id']
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        indexes = [
+            models.Index(fields=('bucket_id', 'id'), name='bucket_seq_idx')
+        ]
+        verbose_name = '对象变更日志'
+        verbose_name_plural = verbose_name
+
+    def is_delete(self):
+        return self.action == self.ACTION_DELETE
+
+
+class ChangeLogCheckpoint(models.Model):
+    """
+    对象变更日志消费者在每个桶上的消费进度
+
+    @ consumer: 消费者名称
+    @ seq: 已消费的日志序号
+    """
+    id = models.BigAutoField(primary_key=True)
+    consumer = models.CharField(verbose_name='消费者', max_length=64)
+    bucket_id = models.BigIntegerField(verbose_name='存储桶id')
+    seq = models.BigIntegerField(verbose_name='已消费的日志序号', default=0)
+    modified_time = models.DateTimeField(verbose_name='修改时间', auto_now=True)
+
+    class Meta:
+        db_table = 'change_log_checkpoint'
+        ordering = ['id']
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        unique_together = ('consumer', 'bucket_id')
+        verbose_name = '变更日志消费进度'
+        verbose_name_plural = verbose_name
+
+
+class AsyncWorkerNode(models.Model):
+    """
+    备份同步工作节点，节点定时更新心跳时间，心跳未过期的节点参与分片租约的均分
+
+    @ name: 节点名称，主机名和进程号
+    """
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(verbose_name='节点名称', max_length=128, unique=True)
+    heartbeat_time = models.DateTimeField(verbose_name='心跳时间')
+
+    class Meta:
+        db_table = 'async_worker_node'
+        ordering = ['id']
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        verbose_name = '备份同步工作节点'
+        verbose_name_plural = verbose_name
+
+
+class AsyncShardLease(models.Model):
+    """
+    备份同步分片租约，每个桶的每个备份点按对象id范围[id_start, id_end)分片，
+    工作节点领取租约后只同步分片id范围内的对象，并在租约过期前续约
+
+    @ owner: 持有租约的节点名称，空字符串为未被领取
+    @ lease_expire: 租约过期时间
+    """
+    id = models.BigAutoField(primary_key=True)
+    bucket_id = models.BigIntegerField(verbose_name='存储桶id')
+    backup_num = models.SmallIntegerField(verbose_name='备份点编号')
+    id_start = models.BigIntegerField(verbose_name='起始对象id(包含)')
+    id_end = models.BigIntegerField(verbose_name='结束对象id(不包含)')
+    owner = models.CharField(verbose_name='租约持有节点', max_length=128, blank=True, default='')
+    lease_expire = models.DateTimeField(verbose_name='租约过期时间', null=True, default=None)
+
+    class Meta:
+        db_table = 'async_shard_lease'
+        ordering = ['id']
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        unique_together = ('bucket_id', 'backup_num', 'id_start')
+        verbose_name = '备份同步分片租约'
+        verbose_name_plural = verbose_name
+
+
 class BucketToken(models.Model):
     PERMISSION_READWRITE = 'readwrite'
     PERMISSION_READONLY = 'readonly'
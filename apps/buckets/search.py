@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Count
+
+
+logger = logging.getLogger('django.request')
+
+NGRAM_SIZE = 3
+
+
+def get_name_ngrams(name: str) -> set:
+    """
+    对象名(小写)的所有n-gram，长度小于NGRAM_SIZE时返回空集合
+    """
+    if not name:
+        return set()
+
+    name = name.lower()
+    return {name[i:i + NGRAM_SIZE] for i in range(len(name) - NGRAM_SIZE + 1)}
+
+
+def get_search_ngrams(search: str) -> list:
+    """
+    检索关键字的查询n-gram，只取覆盖关键字的不重叠n-gram(和最后一个n-gram)，
+    减少要相交的倒排列表数量，其余的n-gram由候选对象回表验证保证
+
+    :return: list   # 空列表表示关键字太短，不能使用索引
+    """
+    search = search.lower()
+    n = len(search)
+    if n < NGRAM_SIZE:
+        return []
+
+    grams = [search[i:i + NGRAM_SIZE] for i in range(0, n - NGRAM_SIZE + 1, NGRAM_SIZE)]
+    last = search[n - NGRAM_SIZE:]
+    if last not in grams:
+        grams.append(last)
+
+    return list(dict.fromkeys(grams))
+
+
+def get_search_index_table_name(table_name: str):
+    return f'{table_name}_ngram'
+
+
+def get_search_index_model_class(table_name: str):
+    """
+    动态创建存储桶对象检索索引表的模型类
+
+    :param table_name: 桶的数据库表名
+    :return: Model class
+    """
+    from .models import BucketSearchNgramBase
+
+    index_table_name = get_search_index_table_name(table_name)
+    model_name = 'NgramModel' + index_table_name
+    app_label = BucketSearchNgramBase.Meta.app_label
+    try:
+        return apps.get_registered_model(app_label=app_label, model_name=model_name)
+    except LookupError:
+        pass
+
+    meta = BucketSearchNgramBase.Meta()
+    meta.abstract = False
+    meta.db_table = index_table_name
+    return type(model_name, (BucketSearchNgramBase,), {'Meta': meta, '__module__': BucketSearchNgramBase.__module__})
+
+
+class SearchIndexManager:
+    """
+    存储桶对象名n-gram检索索引，每个桶一个索引表(桶表名_ngram)，记录(gram, 对象id)；
+
+    * 索引表存在时，对象新建、重命名、删除时增量维护索引(只索引对象，不含目录)；
+    * 索引表由manage.py buildsearchindex创建并补全，补全完成后写入标记行，之后检索才使用索引；
+    * 通过queryset.delete()等批量删除的对象，索引中残留的记录在检索时回表过滤；
+    * 索引表是否存在、是否补全完成的检查结果在进程内缓存check_ttl秒
+    """
+    READY_GRAM = ''     # 索引补全完成的标记行，(gram='', oid=0)
+
+    def __init__(self, check_ttl: int = 60):
+        self.check_ttl = check_ttl
+        self._states = {}   # {table_name: ((enabled, ready), expire_time)}
+        self._lock = threading.Lock()
+
+    def get_state(self, table_name: str):
+        """
+        :return:
+            (enabled, ready)    # enabled: 索引表存在；ready: 索引补全完成
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._states.get(table_name)
+            if item is not None and item[1] > now:
+                return item[0]
+
+        state = self._load_state(table_name)
+        with self._lock:
+            self._states[table_name] = (state, now + self.check_ttl)
+
+        return state
+
+    def is_enabled(self, table_name: str):
+        return self.get_state(table_name)[0]
+
+    def is_ready(self, table_name: str):
+        return self.get_state(table_name)[1]
+
+    def clear_state(self, table_name: str = None):
+        with self._lock:
+            if table_name is None:
+                self._states.clear()
+            else:
+                self._states.pop(table_name, None)
+
+    @staticmethod
+    def _load_state(table_name: str):
+        model = get_search_index_model_class(table_name)
+        try:
+            connection = connections[router.db_for_read(model)]
+            with connection.cursor() as cursor:
+                cursor.execute('SHOW TABLES LIKE %s', [model._meta.db_table])
+                if cursor.fetchone() is None:
+                    return False, False
+
+            ready = model.objects.filter(gram=SearchIndexManager.READY_GRAM, oid=0).exists()
+        except Exception as e:
+            logger.error(f'check search index of table {table_name} error, {str(e)}')
+            return False, False
+
+        return True, ready
+
+    def index_object(self, obj, old_name: str = None):
+        """
+        对象新建或重命名后更新索引
+
+        :param obj: 对象
+        :param old_name: 重命名前的对象名，None为新建对象
+        """
+        table_name = obj._meta.db_table
+        if not self.is_enabled(table_name):
+            return
+
+        new_grams = get_name_ngrams(obj.name)
+        old_grams = get_name_ngrams(old_name) if old_name else set()
+        removed = old_grams - new_grams
+        added = new_grams - old_grams
+        model = get_search_index_model_class(table_name)
+        try:
+            if removed:
+                model.objects.filter(oid=obj.id, gram__in=removed).delete()
+            if added:
+                model.objects.bulk_create([model(gram=g, oid=obj.id) for g in added], ignore_conflicts=True)
+        except Exception as e:
+            logger.error(f'update search index of object({obj.id}) in table {table_name} error, {str(e)}')
+
+    def unindex_object(self, obj):
+        """
+        对象删除后删除索引
+        """
+        table_name = obj._meta.db_table
+        if not self.is_enabled(table_name):
+            return
+
+        model = get_search_index_model_class(table_name)
+        try:
+            model.objects.filter(oid=obj.id).delete()
+        except Exception as e:
+            logger.error(f'delete search index of object({obj.id}) in table {table_name} error, {str(e)}')
+
+    def unindex_ids(self, table_name: str, ids: list):
+        """
+        批量删除对象的索引
+
+        :param table_name: 桶的数据库表名
+        :param ids: 对象id列表
+        """
+        if not ids or not self.is_enabled(table_name):
+            return
+
+        model = get_search_index_model_class(table_name)
+        try:
+            model.objects.filter(oid__in=ids).delete()
+        except Exception as e:
+            logger.error(f'delete search index of objects in table {table_name} error, {str(e)}')
+
+    def search_queryset(self, obj_model, search: str):
+        """
+        通过索引检索对象，n-gram倒排列表相交得到候选对象id，候选对象回表验证对象名
+
+        :param obj_model: 桶对象模型类
+        :param search: 检索关键字
+        :return:
+            QuerySet()
+            None        # 不能使用索引检索
+        """
+        table_name = obj_model._meta.db_table
+        grams = get_search_ngrams(search)
+        if not grams or not self.is_ready(table_name):
+            return None
+
+        model = get_search_index_model_class(table_name)
+        candidates = model.objects.filter(gram__in=grams).values('oid').annotate(
+            n=Count('gram')).filter(n=len(grams)).values('oid')
+        return obj_model.objects.filter(id__in=candidates, fod=True, name__icontains=search)
+
+
+search_index = SearchIndexManager(check_ttl=getattr(settings, 'SEARCH_INDEX_CHECK_TTL', 60))
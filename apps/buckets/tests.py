@@ -1,6 +1,7 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase
 
 from buckets.models import get_next_bucket_max_id, Bucket, Archive
+from buckets.search import get_name_ngrams, get_search_ngrams
 
 
 class SomeTests(TestCase):
@@ -45,3 +46,17 @@ class SomeTests(TestCase):
         Archive.objects.get(original_id=bucket3_id).delete()
         next_id = get_next_bucket_max_id()
         self.assertEqual(next_id, bucket3_id)
+
+
+class SearchNgramTests(SimpleTestCase):
+    def test_ngrams(self):
+        self.assertEqual(get_name_ngrams('ab'), set())
+        self.assertEqual(get_name_ngrams('AbcD'), {'abc', 'bcd'})
+        self.assertEqual(get_name_ngrams('测试文件'), {'测试文', '试文件'})
+
+        self.assertEqual(get_search_ngrams('ab'), [])
+        self.assertEqual(get_search_ngrams('abc'), ['abc'])
+        self.assertEqual(get_search_ngrams('Abcdefg'), ['abc', 'def', 'efg'])
+        self.assertEqual(get_search_ngrams('abcdef'), ['abc', 'def'])
+        # 查询n-gram是对象名n-gram的子集
+        self.assertTrue(set(get_search_ngrams('abcdefg')).issubset(get_name_ngrams('xabcdefgx')))
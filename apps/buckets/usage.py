@@ -0,0 +1,93 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+
+from utils.flusher import flusher
+from .caches import bucket_cache
+
+
+logger = logging.getLogger('django.request')
+
+
+class BucketUsageAggregator:
+    """
+    存储桶用量(对象数量、总大小)增量汇总，延后批量更新到Bucket.objs_count、size；
+
+    * 上传、删除对象等修改对象大小时，记录桶的增量；
+    * 距离上次写入超过flush_interval秒，或者待写入的桶数量超过max_pending时，批量写入数据库；
+    * 进程空闲时由后台线程(utils.flusher)每flush_interval秒写入；
+    * 进程异常退出时未写入的增量会丢失，由定时任务(manage.py reconcilebucketstats)全表统计校正；
+    """
+
+    def __init__(self, flush_interval: int = 5, max_pending: int = 1000):
+        """
+        :param flush_interval: 写入间隔(秒)，<=0时每次记录增量立即写入
+        :param max_pending: 待写入桶数量上限
+        """
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}  # {table_name: [count, size]}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, table_name: str, count: int = 0, size: int = 0):
+        """
+        记录桶用量增量
+
+        :param table_name: 桶的数据库表名
+        :param count: 对象数量增量
+        :param size: 对象大小增量
+        """
+        if not count and not size:
+            return
+
+        flusher.ensure_started()
+        with self._lock:
+            item = self._pending.setdefault(table_name, [0, 0])
+            item[0] += count
+            item[1] += size
+            need_flush = (len(self._pending) >= self.max_pending or
+                          time.monotonic() - self._last_flush >= self.flush_interval)
+
+        if need_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        待写入的增量写入数据库，写入失败的增量保留到下次写入
+        """
+        from .models import Bucket
+
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._last_flush = time.monotonic()
+
+        for table_name, (count, size) in pending.items():
+            if not count and not size:
+                continue
+
+            try:
+                Bucket.objects.filter(collection_name=table_name).update(
+                    objs_count=F('objs_count') + count, size=F('size') + size)
+            except Exception as e:
+                logger.error(f'update bucket usage of table {table_name} error, {str(e)}')
+                with self._lock:
+                    item = self._pending.setdefault(table_name, [0, 0])
+                    item[0] += count
+                    item[1] += size
+
+        if pending:
+            bucket_cache.invalidate_by_table(pending.keys())
+
+
+bucket_usage = BucketUsageAggregator(
+    flush_interval=getattr(settings, 'BUCKET_USAGE_FLUSH_INTERVAL', 5),
+    max_pending=getattr(settings, 'BUCKET_USAGE_MAX_PENDING', 1000)
+)
+flusher.register(bucket_usage.flush, interval=bucket_usage.flush_interval)
+atexit.register(bucket_usage.flush)
@@ -3,16 +3,22 @@ import traceback
 import random
 
 from django.db.backends.mysql.schema import DatabaseSchemaEditor
-from django.db import connections, router
-from django.db.models import Sum, Count
+from django.db import connections, router, transaction, IntegrityError
+from django.db.models import Sum, Count, Value, TextField
+from django.db.models.functions import Concat, Substr, MD5, Left
 # from django.db.models.functions import Lower
 from django.db.models.query import Q
 from django.core.exceptions import MultipleObjectsReturned
 from django.apps import apps
 from django.conf import settings
 
-from .models import BucketFileBase, get_str_hexMD5, Bucket, get_next_bucket_max_id
+from .models import BucketFileBase, get_str_hexMD5, Bucket, get_next_bucket_max_id, GarbageObject
+from .search import search_index
+from .changelog import change_log
+from .caches import dir_cache, sort_key_state
+from .usage import bucket_usage
 from api import exceptions
+from utils.storagers import PathParser
 
 
 logger = logging.getLogger('django.request')    # 这里的日志记录器要和setting中的loggers选项对应，不能随意给参
@@ -448,11 +454,17 @@ class BucketFileManagement:
 
         :raises: Error
         """
+        table_name = self.get_collection_name()
+        hit, obj = dir_cache.get(table_name=table_name, path=path)
+        if hit:
+            return obj
+
         na_md5 = get_str_hexMD5(path)
         model_class = self.get_obj_model_class()
         try:
             obj = model_class.objects.get(Q(na_md5=na_md5) | Q(na_md5__isnull=True), na=path)
         except model_class.DoesNotExist as e:
+            dir_cache.set(table_name=table_name, path=path, obj=None)
             return None
         except MultipleObjectsReturned as e:
             msg = f'数据库表{self.get_collection_name()}中存在多个相同的目录：{path}'
@@ -463,8 +475,123 @@ class BucketFileManagement:
             logger.error(msg)
             raise exceptions.Error(msg)
 
+        dir_cache.set(table_name=table_name, path=path, obj=obj)
         return obj
 
+    def get_objs_by_paths(self, paths: list):
+        """
+        一次查询多个路径的目录或对象，优先从目录缓存获取
+
+        :param paths: 目录或对象路径列表
+        :return:
+            dict    # {path: obj}，不包含不存在的路径
+
+        :raises: Error
+        """
+        table_name = self.get_collection_name()
+        objs = {}
+        miss_paths = []
+        for path in paths:
+            hit, obj = dir_cache.get(table_name=table_name, path=path)
+            if not hit:
+                miss_paths.append(path)
+            elif obj is not None:
+                objs[path] = obj
+
+        if not miss_paths:
+            return objs
+
+        na_md5s = [get_str_hexMD5(p) for p in miss_paths]
+        model_class = self.get_obj_model_class()
+        try:
+            qs = model_class.objects.filter(Q(na_md5__in=na_md5s) | Q(na_md5__isnull=True), na__in=miss_paths)
+            found = list(qs)
+        except Exception as e:
+            msg = f'select {self.get_collection_name()},paths={miss_paths},err={str(e)}'
+            logger.error(msg)
+            raise exceptions.Error(msg)
+
+        for obj in found:
+            if obj.na not in miss_paths:
+                continue
+
+            if obj.na in objs:
+                msg = f'数据库表{self.get_collection_name()}中存在多个相同的目录：{obj.na}'
+                logger.error(msg)
+                raise exceptions.Error(message=msg)
+
+            objs[obj.na] = obj
+
+        for path in miss_paths:
+            dir_cache.set(table_name=table_name, path=path, obj=objs.get(path))
+
+        return objs
+
+    def create_dir_path(self, path: str, max_retries: int = 3):
+        """
+        创建整个目录路径
+
+        一次查询路径上所有的目录，在一个事务中创建路径上不存在的目录；
+        并发创建同一目录时唯一约束冲突，回滚事务，重新查询路径后再创建
+
+        :param path: 要创建的目录路径字符串
+        :param max_retries: 并发冲突时最多尝试次数
+        :return:
+            [dir,]      # 创建的目录路径上的目录(只包含新建的目录和路径上最后一个目录)的列表
+
+        :raises: Error, InvalidKey, SameKeyAlreadyExists
+        """
+        paths = PathParser(path).get_path_breadcrumb()
+        if len(paths) == 0:
+            return [self.root_dir()]
+
+        for dir_name, _ in paths:
+            if len(dir_name) > 255:
+                raise exceptions.InvalidKey(message='目录名称长度最大为255字符')
+
+        table_name = self.get_collection_name()
+        model_class = self.get_obj_model_class()
+        for _ in range(max_retries):
+            objs = self.get_objs_by_paths([p for _, p in paths])
+            last_exist_dir = self.root_dir()
+            create_paths = paths
+            # 从最深的路径开始，找到路径中已存在的最后的目录
+            for index in range(len(paths) - 1, -1, -1):
+                obj = objs.get(paths[index][1])
+                if obj is None:
+                    continue
+
+                if obj.is_file():
+                    raise exceptions.SameKeyAlreadyExists(
+                        message="The path of the object's key conflicts with the existing object's key")
+
+                last_exist_dir = obj
+                create_paths = paths[index + 1:]
+                break
+
+            if not create_paths:    # 整个路径已存在
+                return [last_exist_dir]
+
+            try:
+                dirs = []
+                with transaction.atomic(using=router.db_for_write(model_class)):
+                    now_last_dir = last_exist_dir
+                    for dir_name, dir_path_name in create_paths:
+                        dir1 = model_class(na=dir_path_name, name=dir_name, fod=False, did=now_last_dir.id)
+                        dir1.save(force_insert=True)  # 仅尝试创建，不修改已存在的
+                        dirs.append(dir1)
+                        now_last_dir = dir1
+
+                return dirs
+            except IntegrityError:
+                # 其他请求同时创建了路径上的目录，重新查询
+                for _, dir_path_name in create_paths:
+                    dir_cache.invalidate(table_name=table_name, path=dir_path_name, notify=False)
+            except Exception as e:
+                raise exceptions.Error(message=f'创建目录元数据错误, {str(e)}')
+
+        raise exceptions.Error(message='创建目录元数据错误, 同时创建同一路径的请求冲突')
+
     def get_search_object_queryset(self, search: str, contain_dir: bool = False):
         """
         检索对象
@@ -477,11 +604,16 @@ class BucketFileManagement:
         # model_class = self.get_obj_model_class()
         # return model_class.objects.annotate(lower_name=Lower('name')).filter(**lookup)
 
+        model_class = self.get_obj_model_class()
+        if not contain_dir:     # 检索索引只索引对象
+            qs = search_index.search_queryset(obj_model=model_class, search=search)
+            if qs is not None:
+                return qs
+
         if contain_dir:
             lookup = {'name__icontains': search}
         else:
             lookup = {'fod': True, 'name__icontains': search}
-        model_class = self.get_obj_model_class()
         return model_class.objects.filter(**lookup)
 
     def get_objects_dirs_queryset(self):
@@ -501,4 +633,150 @@ class BucketFileManagement:
         :return: QuerySet()
         """
         model_class = self.get_obj_model_class()
+        if self.is_sort_key_ready():   # 通过排序键sk的索引范围查询
+            return model_class.objects.filter(
+                sk__startswith=model_class.build_sort_key(prefix), na__startswith=prefix).all()
+
         return model_class.objects.filter(na__startswith=prefix).all()
+
+    def move_dir_tree(self, dir_obj, did: int, na: str, name: str, batch_size: int = 1000):
+        """
+        移动或重命名目录，批量改写目录下所有子孙对象和目录的全路径
+
+        按批改写子孙的na、na_md5、sk，每批一个事务，限制锁定时间；最后修改目录本身，
+        中途失败时目录还在原路径下，重试可以继续完成；子孙的did不变
+
+        :param dir_obj: 目录
+        :param did: 目标父目录id
+        :param na: 目录新的全路径
+        :param name: 目录新的名称
+        :param batch_size: 每批改写的数量
+        :return:
+            int     # 改写的子孙数量
+
+        :raises: Error
+        """
+        old_prefix = dir_obj.na + '/'
+        new_prefix = na + '/'
+        if new_prefix.startswith(old_prefix):
+            raise exceptions.BadRequest(message='不能移动目录到自身或子目录下')
+
+        table_name = self.get_collection_name()
+        model_class = self.get_obj_model_class()
+        new_na = Concat(Value(new_prefix), Substr('na', len(old_prefix) + 1), output_field=TextField())
+        count = 0
+        try:
+            while True:
+                items = list(self.get_prefix_objects_dirs_queryset(prefix=old_prefix).order_by().values_list(
+                    'id', 'na', 'fod')[0:batch_size])
+                if not items:
+                    break
+
+                with transaction.atomic(using=router.db_for_write(model_class)):
+                    # mysql单表UPDATE按顺序赋值，na要最后赋值，na_md5和sk使用na的原值计算
+                    rows = model_class.objects.filter(id__in=[i[0] for i in items], na__startswith=old_prefix).update(
+                        na_md5=MD5(new_na), sk=Left(new_na, model_class.SORT_KEY_LENGTH), na=new_na)
+
+                if rows == 0:
+                    break
+
+                count += rows
+                files = [(oid, oa) for oid, oa, fod in items if fod]
+                change_log.log_changes(table_name=table_name, deleted=files,
+                                       put=[(oid, new_prefix + oa[len(old_prefix):]) for oid, oa in files])
+
+            dir_obj.did = did
+            dir_obj.na = na
+            dir_obj.name = name
+            dir_obj.reset_na_md5()
+            dir_obj.save()
+        except Exception as e:
+            raise exceptions.Error(message=f'移动目录元数据错误, {str(e)}')
+        finally:
+            dir_cache.invalidate(table_name=table_name)
+
+        return count
+
+    def delete_dir_tree(self, dir_obj, bucket_id: int, batch_size: int = 1000, before_delete=None):
+        """
+        递归删除目录，批量删除目录下所有子孙对象和目录的元数据，对象的rados数据加入删除队列(GarbageObject)，由后台删除
+
+        每批一个事务，限制锁定时间；最后删除目录本身，中途失败时重试可以继续完成
+
+        :param dir_obj: 目录
+        :param bucket_id: 桶id
+        :param batch_size: 每批删除的数量
+        :param before_delete: 每批元数据删除前调用，before_delete(objs)，出错时停止删除，这批对象的元数据保留
+        :return:
+            int     # 删除的对象数量(不含目录)
+
+        :raises: Error
+        """
+        table_name = self.get_collection_name()
+        prefix = dir_obj.na + '/'
+        count = 0
+        try:
+            while True:
+                objs = list(self.get_prefix_objects_dirs_queryset(prefix=prefix).order_by()[0:batch_size])
+                if not objs:
+                    break
+
+                if before_delete is not None:
+                    before_delete(objs)
+
+                count += self.delete_objs_metadata(objs=objs, bucket_id=bucket_id)
+
+            dir_obj.delete()
+        except Exception as e:
+            raise exceptions.Error(message=f'删除目录元数据错误, {str(e)}')
+        finally:
+            dir_cache.invalidate(table_name=table_name)
+
+        return count
+
+    def delete_objs_metadata(self, objs: list, bucket_id: int):
+        """
+        批量删除对象和目录的元数据，对象的rados数据加入删除队列(GarbageObject)，在一个事务中完成；
+        之后更新桶用量和检索索引
+
+        :param objs: 对象和目录列表
+        :param bucket_id: 桶id
+        :return:
+            int     # 删除的对象数量(不含目录)
+
+        :raises: Exception
+        """
+        if not objs:
+            return 0
+
+        table_name = self.get_collection_name()
+        model_class = self.get_obj_model_class()
+        with transaction.atomic(using=router.db_for_write(model_class)):
+            GarbageObject.enqueue_objs(bucket_id=bucket_id, objs=objs)
+            model_class.objects.filter(id__in=[o.id for o in objs]).delete()
+
+        files = [o for o in objs if o.is_file()]
+        bucket_usage.add(table_name=table_name, count=-len(files), size=-sum(o.si for o in files))
+        search_index.unindex_ids(table_name=table_name, ids=[o.id for o in files])
+        change_log.log_changes(table_name=table_name, deleted=[(o.id, o.na) for o in files])
+        return len(files)
+
+    def is_sort_key_ready(self):
+        """
+        桶表所有记录的排序键sk是否已补全(manage.py fillsortkey)，检查结果在进程内缓存
+
+        :return: bool
+        """
+        table_name = self.get_collection_name()
+        ready = sort_key_state.get(table_name)
+        if ready is not None:
+            return ready
+
+        model_class = self.get_obj_model_class()
+        try:
+            ready = not model_class.objects.filter(sk='').exists()
+        except Exception as e:
+            return False
+
+        sort_key_state.set(table_name, ready)
+        return ready
@@ -171,7 +171,8 @@ class CopyObjectHandler:
 
         source_rados = s3object.build_object_rados(bucket=source_bucket, obj=source_object)
         try:
-            write_size, md5 = self.copy_object_rados(obj_rados=obj_rados, source_rados=source_rados)
+            write_size, md5 = self.copy_object_rados(
+                obj_rados=obj_rados, source_rados=source_rados, source_md5=source_object.hex_md5)
             if write_size != source_object.obj_size:
                 raise exceptions.S3InternalError(message='raods data copy is interrupted or incomplete')
         except exceptions.S3Error as e:
@@ -201,29 +202,20 @@ class CopyObjectHandler:
         return Response(data=data, status=200)
 
     @staticmethod
-    def copy_object_rados(obj_rados, source_rados):
+    def copy_object_rados(obj_rados, source_rados, source_md5: str = ''):
         """
+        复制源对象rados数据，源对象md5已知时不再计算md5
+
         :return: (
             len: int         # length of copy bytes
             md5: str         # md5 of copy bytes
         )
         :raises: S3Error
         """
-        md5_handler = FileMD5Handler()
-        offset = 0
-        source_generator = source_rados.read_obj_generator()
-        for data in source_generator:
-            if not data:
-                break
-
-            ok, msg = obj_rados.write(offset=offset, data_block=data)
-            if not ok:
-                ok, msg = obj_rados.write(offset=offset, data_block=data)
-
-            if not ok:
-                raise exceptions.S3InternalError(extend_msg=msg)
-
-            md5_handler.update(offset=offset, data=data)
-            offset = offset + len(data)
+        md5_handler = None if len(source_md5) == 32 else FileMD5Handler()
+        ok, ret = obj_rados.copy_from(source=source_rados, md5_handler=md5_handler)
+        if not ok:
+            raise exceptions.S3InternalError(extend_msg=ret)
 
-        return offset, md5_handler.hex_md5
+        md5 = source_md5 if md5_handler is None else md5_handler.hex_md5
+        return ret, md5
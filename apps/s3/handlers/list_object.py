@@ -48,7 +48,7 @@ class ListObjectsHandler:
                                                  bucket_name=bucket_name)
 
         # 添加prefix目录到返回结果中，目录在s3中是一个空对象，根目录是个虚拟的对象，不返回
-        paginator = paginations.ListObjectsV1CursorPagination(prefix_obj=obj)
+        paginator = paginations.ListObjectsV1CursorPagination(prefix_obj=obj, dir_path=path)
         max_keys = paginator.get_page_size(request=request)
         ret_data = {
             'IsTruncated': 'false',  # can not use bool
@@ -171,7 +171,7 @@ class ListObjectsHandler:
                 bucket=bucket, encoding_type=encoding_type)
 
         # 添加prefix目录到返回结果中，目录在s3中是一个空对象
-        paginator = paginations.ListObjectsV2CursorPagination(context={'bucket': bucket}, prefix_obj=obj)
+        paginator = paginations.ListObjectsV2CursorPagination(context={'bucket': bucket}, prefix_obj=obj, dir_path=path)
         max_keys = paginator.get_page_size(request=request)
 
         res_prefix = prefix
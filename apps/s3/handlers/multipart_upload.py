@@ -1,4 +1,3 @@
-import time
 from datetime import datetime
 from pytz import utc
 
@@ -10,15 +9,13 @@ from rest_framework import status
 from rest_framework.response import Response
 
 from s3.harbor import HarborManager, MultipartUploadManager, S3_MULTIPART_UPLOAD_MAX_SIZE
-from s3.responses import IterResponse
 from s3.viewsets import S3CustomGenericViewSet
 from s3 import exceptions, renders, paginations, serializers
 from s3.models import MultipartUpload
 from s3.handlers.s3object import create_object_metadata
 from utils import storagers
-from utils.oss.pyrados import RadosError, HarborObject
+from utils.oss.pyrados import RadosError
 from utils.storagers import try_close_file
-from utils.md5 import FileMD5Handler
 
 
 GMT_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
@@ -133,7 +130,8 @@ class MultipartUploadHandler:
         pool_id = obj.get_pool_id()
         # pool_name = obj.get_pool_name()
         uploader = storagers.PartUploadToCephHandler(request=request, using=str(pool_id),
-                                                     pool_name=None, obj_key=ceph_obj_key, offset=offset)
+                                                     pool_name=None, obj_key=ceph_obj_key, offset=offset,
+                                                     stripe_unit=obj.get_stripe_unit())
         request.upload_handlers = [uploader]
 
         try:
@@ -186,8 +184,7 @@ class MultipartUploadHandler:
         )
         try:
             with transaction.atomic(using='metadata'):
-                upload = MultipartUpload.objects.select_for_update().get(id=upload.id)
-                # 不更新 chunk_size
+                # part一行记录，插入或替换一条sql完成，不需要锁多部分上传记录
                 upload.insert_part(part)
                 # 写入part后，对象大小增大了才需更新
                 new_obj_size = offset + part_size
@@ -248,60 +245,52 @@ class MultipartUploadHandler:
             upload.set_uploading()
             return view.exception_response(request, exc=e)
 
-        # 分块大小正确，块的存储偏移量是正确的
-        if upload.is_chunk_size_equal_part1_size():
-            try:
-                upload.set_completed(obj_etag=obj_etag)
-            except exceptions.S3Error as e:
-                upload.set_uploading()
-                return view.exception_response(request, exc=e)
-
-            location = request.build_absolute_uri()
-            data = {'Location': location, 'Bucket': bucket.name, 'Key': obj.na, 'ETag': obj_etag}
-            view.set_renderer(request, renders.CommonXMLRenderer(root_tag_name='ListMultipartUploadsResult'))
-            return Response(data=data, status=status.HTTP_200_OK)
-        # 块离散存储（先上传的最后一个块，且大于分块大小），需要移动块
-        elif upload.is_chunk_size_gt_part1_size():
-            return self.complete_multipart_upload_handle(
-                view=view, upload=upload, hm=hm, bucket=bucket,
-                old_obj=obj, obj_etag=obj_etag, request=request
-            )
+        # 分块大小正确，块的存储偏移量是正确的；
+        # 块离散存储（先上传的最后一个块，且大于分块大小），块之间有空隙，对象记录part清单，不移动块数据
+        is_discrete = upload.is_chunk_size_gt_part1_size()
+        if not (is_discrete or upload.is_chunk_size_equal_part1_size()):
+            upload.set_uploading()
+            return view.exception_response(request, exc=exceptions.S3InvalidPart(
+                message=gettext('The last block is uploaded first, and the merge cannot '
+                                'be completed. Please upload again.')))
 
-        return view.exception_response(request, exc=exceptions.S3InvalidPart(
-            message=gettext('The last block is uploaded first, and the merge cannot '
-                            'be completed. Please upload again.')))
+        try:
+            # ETag由各part的md5组合计算，对象md5延后由后台任务计算，完成时不读取对象数据
+            self._set_obj_completed(obj=obj, upload=upload, is_discrete=is_discrete)
+            upload.set_completed(obj_etag=obj_etag)
+        except exceptions.S3Error as e:
+            upload.set_uploading()
+            return view.exception_response(request, exc=e)
 
-    def complete_multipart_upload_handle(
-            self, view: S3CustomGenericViewSet, request, upload, hm, bucket, old_obj, obj_etag):
-        """
-        处理 s3fs 最后一块先上传
-
-        :param view:
-        :param request:
-        :param upload: 上传实例
-        :param hm: HarborManager()
-        :param bucket: 桶实例
-        :param old_obj: 当前上传的对象
-        :param obj_etag: 当前对象的etag
-        :return: Response
+        location = request.build_absolute_uri()
+        data = {'Location': location, 'Bucket': bucket.name, 'Key': obj.na, 'ETag': obj_etag}
+        view.set_renderer(request, renders.CommonXMLRenderer(root_tag_name='ListMultipartUploadsResult'))
+        return Response(data=data, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def _set_obj_completed(obj, upload: MultipartUpload, is_discrete: bool):
         """
+        更新完成多部分上传的对象元数据，对象md5标记为延后计算，由后台任务(manage.py fillobjectsmd5)补全；
+        块之间有空隙存储时，对象记录part清单，读写对象时通过清单映射数据偏移量，不需要重写对象数据；
+        空隙可以由后台任务(manage.py compactobjects)整理
 
-        part1 = upload.get_part_by_index(0)  # 通过索引查询到块编号 1 的块信息
-        new_chunk_size = part1['Size']
+        :raises: S3Error
+        """
+        update_fields = obj.defer_md5()
+        if is_discrete:
+            part1 = upload.get_part_by_index(0)  # 通过索引查询到块编号 1 的块信息
+            part_size = part1['Size']
+            obj.manifest_part_size = part_size
+            obj.manifest_stride = upload.chunk_size
+            obj.manifest_parts = upload.get_last_part_number()
+            obj.si = upload.calculate_obj_size_by_chunk_size(chunk_size=part_size)
+            update_fields += ['manifest_part_size', 'manifest_stride', 'manifest_parts', 'si']
 
-        # 创建新的文件对象
+        obj.upt = timezone.now()
         try:
-            bucket, obj, created, obj_rados = self._create_temp_obj(
-                hm=hm, bucket=bucket, old_obj_key=old_obj.na)
-        except exceptions.S3Error as exc:
-            return view.exception_response(request=request, exc=exc)
-
-        return IterResponse(iter_content=self.handler_complete_iter(
-            bucket=bucket, obj=obj, old_obj=old_obj,
-            new_chunk_size=new_chunk_size,
-            old_chunk_size=upload.chunk_size,
-            upload=upload, hm=hm, new_obj_rados=obj_rados,
-            obj_etag=obj_etag, request=request))
+            obj.save(update_fields=update_fields + ['upt'])
+        except Exception as e:
+            raise exceptions.S3Error(message=f'更新对象元数据失败，{str(e)}')
 
     def abort_multipart_upload(self, request, view: S3CustomGenericViewSet, upload_id):
         bucket_name = view.get_bucket_name(request)
@@ -580,229 +569,3 @@ class MultipartUploadHandler:
                 return now_upload
         except Exception as e:
             raise exceptions.S3Error(message=str(e))
-
-    @staticmethod
-    def _create_temp_obj(hm: HarborManager, bucket, old_obj_key: str):
-        """
-        合并有空洞的文件时，创建新的临时文件
-
-        :param hm: HarborManager()
-        :param bucket: 桶实例
-        :param old_obj_key: 上的对象视为旧的
-        :return:
-            bucket, obj, created, obj_rados
-
-        :raises: S3Error
-        """
-        ts = int(time.time() * 1000)
-        new_key = old_obj_key + '_' + str(ts) + '_temp'
-        obj, created = hm.get_or_create_obj(table_name=bucket.get_bucket_table_name(), obj_path_name=new_key)
-        obj_rados = hm.get_obj_rados(bucket=bucket, obj=obj)
-        return bucket, obj, created, obj_rados
-
-    def handler_complete_iter(
-            self, bucket, obj, old_obj, new_chunk_size,
-            upload: MultipartUpload, old_chunk_size, hm: HarborManager,
-            new_obj_rados: HarborObject, obj_etag, request
-    ):
-        """
-        合并过程大文件耗时很长，合并过程中，先发送xml文件声明内容，
-        之后再不断向客户端发送“空格” 防止与客户端连接超时中断，
-        最后根据合并结果发送"成功"或者“错误”的xml内容
-
-        :param new_obj_rados:
-        :param bucket: 桶
-        :param obj: 新对象
-        :param old_obj: 旧对象
-        :param new_chunk_size: 新的分块大小
-        :param upload:
-        :param old_chunk_size: 旧的分块大小
-        :param hm:
-        :param obj_etag:
-        :param request:
-        :return:
-        """
-        white_space_bytes = b' '
-        xml_declaration_bytes = b'<?xml version="1.0" encoding="UTF-8"?>\n'
-        start_time = time.time()
-        yielded_doctype = False
-
-        md5_handler = FileMD5Handler()
-        try:
-            old_obj_rados = hm.get_obj_rados(bucket=bucket, obj=old_obj)
-            parts = upload.get_parts()
-            for part in parts:
-                for yield_bool in self.save_part_to_object_iter(
-                        part=part, chunk_size=new_chunk_size, old_chunk_size=old_chunk_size,
-                        old_obj_rados=old_obj_rados, new_obj_rados=new_obj_rados, md5_handler=md5_handler
-                ):
-                    if yield_bool is None:
-                        if not yielded_doctype:
-                            yielded_doctype = True
-                            yield xml_declaration_bytes
-                        else:
-                            yield white_space_bytes
-                    elif yield_bool is True:
-                        break
-                    elif isinstance(yield_bool, exceptions.S3Error):
-                        raise yield_bool
-
-                    # 间隔不断发送空字符防止客户端连接超时
-                    now_time = time.time()
-                    if now_time - start_time < 10:
-                        start_time = now_time
-                        continue
-                    if not yielded_doctype:
-                        yielded_doctype = True
-                        yield xml_declaration_bytes
-                    else:
-                        yield white_space_bytes
-
-            # ----块数据写入新的对象完成，删除旧的缓存的对象元数据和ceph rados数据，重命名新的对象 ----
-            if not yielded_doctype:
-                yielded_doctype = True
-                yield xml_declaration_bytes
-            else:
-                yield white_space_bytes
-
-            # 删除旧的元数据
-            old_obj_id = old_obj.id
-            try:
-                old_obj.delete()
-            except Exception as e:
-                # 清除新的临时对象
-                self._try_clear_temp_obj_and_rados(obj=obj, rados=new_obj_rados)
-                raise exceptions.S3Error(message=f'删除旧对象和多部分上传元数据失败，{str(e)}')
-
-            # 对象重命名
-            try:
-                new_obj_size = upload.calculate_obj_size_by_chunk_size(chunk_size=new_chunk_size)
-                self._update_obj_key_size(
-                    obj=obj, new_key=old_obj.na, name=old_obj.name,
-                    new_obj_size=new_obj_size, obj_md5=md5_handler.hex_md5
-                )
-            except Exception as e:
-                old_obj.id = old_obj_id
-                old_obj.do_save()  # 恢复旧对象元数据
-                # 清除新的临时对象
-                self._try_clear_temp_obj_and_rados(obj=obj, rados=new_obj_rados)
-                raise exceptions.S3Error(message=f'重命名对象失败，{str(e)}')
-
-            # s3多部数据修改
-            try:
-                upload.set_completed(obj_etag=obj_etag, obj=obj, chunk_size=new_chunk_size)
-            except exceptions.S3Error as e:
-                raise exceptions.S3Error(message=str(e))
-
-            if not yielded_doctype:
-                yielded_doctype = True
-                yield xml_declaration_bytes
-            else:
-                yield white_space_bytes
-
-            # 删除旧对象的ceph数据
-            old_obj_rados.delete()
-
-            location = request.build_absolute_uri()
-            data = {'Location': location, 'Bucket': bucket.name, 'Key': obj.na, 'ETag': obj_etag}
-            content = renders.CommonXMLRenderer(root_tag_name='CompleteMultipartUploadResult',
-                                                with_xml_declaration=not yielded_doctype).render(data)
-            yield content.encode(encoding='utf-8')
-        except exceptions.S3Error as e:
-            upload.set_uploading()  # 上传状态改变
-            content = renders.CommonXMLRenderer(root_tag_name='Error',
-                                                with_xml_declaration=not yielded_doctype).render(e)
-            yield content.encode(encoding='utf-8')
-
-        except Exception as e:
-            upload.set_uploading()
-            content = renders.CommonXMLRenderer(root_tag_name='Error', with_xml_declaration=not yielded_doctype
-                                                ).render(exceptions.S3InternalError(message=str(e)).err_data())
-            yield content.encode(encoding='utf-8')
-
-    @staticmethod
-    def save_part_to_object_iter(
-            part, chunk_size, old_chunk_size,
-            new_obj_rados: HarborObject, old_obj_rados: HarborObject, md5_handler):
-        """
-        把一个part数据写入新对象
-
-        :param old_chunk_size: 旧对象设置的块大小
-        :param md5_handler: 计算md5
-        :param new_obj_rados: 新对象 rados
-        :param old_obj_rados: 旧对象 rados
-        :param part: 旧数据块信息
-        :param chunk_size: 要写入块数据的大小
-        :return:
-            yield True          # success
-            yield None          # continue
-            yield S3Error       # error
-        """
-        # 旧块数据偏移量
-        old_offset = (part['PartNumber'] - 1) * old_chunk_size
-        old_end = old_offset + part['Size'] - 1
-        # 新块的偏移量
-        offset = (part['PartNumber'] - 1) * chunk_size
-
-        start_time = time.time()
-        generator = old_obj_rados.read_obj_generator(offset=old_offset, end=old_end)
-
-        for data in generator:
-            if not data:
-                break
-
-            ok, msg = new_obj_rados.write(offset=offset, data_block=data)
-            if not ok:
-                ok, msg = new_obj_rados.write(offset=offset, data_block=data)
-
-            if not ok:
-                yield exceptions.S3InternalError(extend_msg=msg)
-
-            md5_handler.update(offset=offset, data=data)
-            offset = offset + len(data)
-
-            now_time = time.time()
-            if now_time - start_time < 10:
-                start_time = now_time
-                continue
-
-            yield None
-
-        yield True
-
-    @staticmethod
-    def _try_clear_temp_obj_and_rados(obj, rados: HarborObject):
-        """
-        尽可能清除临时创建的对象和ceph rados数据
-
-        :return:
-            True    # success
-            False   # failed
-        """
-        ret = True
-        # 删除元数据
-        try:
-            obj.do_delete()
-        except Exception:
-            ret = False
-
-        try:
-            rados.delete()
-        except Exception:
-            ret = False
-
-        return ret
-
-    @staticmethod
-    def _update_obj_key_size(obj, new_obj_size: int, new_key: str, name: str, obj_md5: str):
-        """
-        更新对象元数据，key，size，md5
-        """
-        obj.na = new_key
-        obj.na_md5 = ''
-        obj.name = name
-        obj.si = new_obj_size
-        obj.md5 = obj_md5
-        obj.upt = timezone.now()
-        obj.save(update_fields=['na', 'name', 'na_md5', 'si', 'md5', 'upt'])
-        return obj
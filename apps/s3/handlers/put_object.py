@@ -85,7 +85,7 @@ class PutObjectHandler:
         pool_id = obj.get_pool_id()
         # pool_name = obj.get_pool_name()
         uploader = FileUploadToCephHandler(using=str(pool_id), request=request,
-                                           pool_name=None, obj_key=obj_key)
+                                           pool_name=None, obj_key=obj_key, stripe_unit=obj.get_stripe_unit())
         request.upload_handlers = [uploader]
 
         def clean_put(_uploader, _obj, _created):
@@ -3,10 +3,11 @@ from collections import OrderedDict
 from django.utils import timezone
 from django.db.models import Case, Value, When, F
 from django.db.models import BigIntegerField
+from django.db import router, transaction
 from django.utils.translation import gettext
 from django.conf import settings
 
-from buckets.models import Bucket, get_str_hexMD5
+from buckets.models import Bucket, GarbageObject, get_str_hexMD5
 from buckets.utils import BucketFileManagement
 from utils.md5 import S3ObjectMultipartETagHandler
 from utils.oss.pyrados import HarborObject
@@ -14,7 +15,7 @@ from utils.oss.shortcuts import build_rados_harbor_object
 from utils.storagers import PathParser
 from api import exceptions as iharbor_errors
 from . import exceptions
-from .models import MultipartUpload
+from .models import MultipartUpload, MultipartUploadPart
 
 
 S3_MULTIPART_UPLOAD_MAX_SIZE = getattr(settings, 'S3_MULTIPART_UPLOAD_MAX_SIZE', 5 * 1024 ** 3)     # default 5GB
@@ -324,49 +325,15 @@ class HarborManager:
         :raises: S3Error
         """
         bfm = BucketFileManagement(collection_name=table_name)
-        paths = PathParser(path).get_path_breadcrumb()
-        if len(paths) == 0:
+        if not PathParser(path).get_path_breadcrumb():
             return bfm.root_dir()  # 根目录对象
 
-        index_paths = list(enumerate(paths))
-        index = 0
-        last_exist_dir = None  # 路径中已存在的最后的目录
-        for index, item in reversed(index_paths):
-            dir_name, dir_path_name = item
-            try:
-                obj = bfm.get_obj(path=dir_path_name)
-            except Exception as e:
-                raise exceptions.S3InternalError(str(e))
-            if not obj:
-                continue
-
-            if obj.is_file():
-                raise exceptions.S3InvalidSuchKey(
-                    message="The path of the object's key conflicts with the existing object's key")
-
-            last_exist_dir = obj
-            break
-
-        if index == (len(index_paths) - 1) and last_exist_dir:  # 整个路径已存在
-            return [last_exist_dir]
-
-        # 从整个路径上已存在的目录处开始向后创建路径
-        if last_exist_dir:
-            now_last_dir = last_exist_dir  # 记录现在已创建的路径上的最后的目录
-            create_paths = index_paths[index + 1:]  # index目录存在不需创建
-        else:
-            now_last_dir = bfm.root_dir()  # 根目录对象
-            create_paths = index_paths[index:]  # index目录不存在需创建
-
-        dirs = []
-        for i, p in create_paths:
-            p_id = now_last_dir.id
-            dir_name, dir_path_name = p
-            dir1 = self.mkdir_metadata(table_name=table_name, p_id=p_id, dir_path_name=dir_path_name)
-            dirs.append(dir1)
-            now_last_dir = dir1
-
-        return dirs
+        try:
+            return bfm.create_dir_path(path=path)
+        except (iharbor_errors.InvalidKey, iharbor_errors.SameKeyAlreadyExists) as exc:
+            raise exceptions.S3InvalidSuchKey(message=exc.message)
+        except iharbor_errors.Error as exc:
+            raise exceptions.S3InternalError(message=exc.message)
 
     def rmdir(self, bucket_name: str, dirpath: str, user=None):
         """
@@ -700,11 +667,13 @@ class HarborManager:
         old_ult = obj.ult
         old_size = obj.si
         old_md5 = obj.md5
+        old_manifest = (obj.manifest_part_size, obj.manifest_stride, obj.manifest_parts)
 
         obj.ult = timezone.now()
         obj.si = 0
         obj.md5 = ''
-        if not obj.do_save(update_fields=['ult', 'si', 'md5']):
+        update_fields = ['ult', 'si', 'md5'] + obj.clear_part_manifest()
+        if not obj.do_save(update_fields=update_fields):
             raise exceptions.S3InternalError('修改对象元数据失败')
 
         # multipart delete need
@@ -718,9 +687,11 @@ class HarborManager:
             obj.ult = old_ult
             obj.si = old_size
             obj.md5 = old_md5
-            obj.do_save(update_fields=['ult', 'si', 'md5'])
+            obj.manifest_part_size, obj.manifest_stride, obj.manifest_parts = old_manifest
+            obj.do_save(update_fields=update_fields)
             raise exc
 
+        rados.reset_manifest()
         return True
 
     def _save_one_chunk(self, obj, rados, offset: int, chunk: bytes):
@@ -775,14 +746,21 @@ class HarborManager:
         old_size = obj.si if obj.si else 0
         new_size = max(size, old_size)  # 更新文件大小（只增不减）
         try:
-            # r = model.objects.filter(id=obj.id, si=obj.si).update(si=new_size, upt=timezone.now())  # 乐观锁方式
-            r = model.objects.filter(id=obj.id).update(
-                si=Case(When(si__lt=new_size, then=Value(new_size)),
-                        default=F('si'), output_field=BigIntegerField()),
-                upt=upt)
+            # 并发写同一对象时(如多个分片并发上传)，加锁读取当前大小，用量增量以数据库中的当前大小计算
+            with transaction.atomic(using=router.db_for_write(model)):
+                cur_size = model.objects.select_for_update().filter(id=obj.id).values_list('si', flat=True).first()
+                if cur_size is None:
+                    return False
+
+                r = model.objects.filter(id=obj.id).update(
+                    si=Case(When(si__lt=new_size, then=Value(new_size)),
+                            default=F('si'), output_field=BigIntegerField()),
+                    upt=upt)
         except Exception as e:
             return False
         if r > 0:  # 更新行数
+            obj.record_usage_size(max(new_size, cur_size), old_size=cur_size)
+            obj.record_change()
             return True
 
         return False
@@ -1207,7 +1185,9 @@ class HarborManager:
         """
         删除多个对象
 
-        不存在的对象将包含在已删除的结果中
+        不存在的对象将包含在已删除的结果中；
+        对象元数据一次查询，多部分上传元数据一次删除，对象元数据在一个事务中批量删除，rados数据加入删除队列由后台删除；
+        目录在对象之后逐个删除
         :param bucket_name: 桶名
         :param obj_keys: 对象全路径列表；[{"Key": "xxx"}, ]
         :param user: 用户，默认为None，如果给定用户只删除属于此用户的对象（只查找此用户的存储桶）
@@ -1224,44 +1204,68 @@ class HarborManager:
         if not bucket.lock_writeable():
             raise exceptions.S3BucketLockWrite()
 
-        table_name = bucket.get_bucket_table_name()
+        bfm = BucketFileManagement(collection_name=bucket.get_bucket_table_name())
 
         deleted_objects = []
         not_delete_objects = []
+
+        def add_error(k, error: exceptions.S3Error):
+            err = error.err_data()
+            err['Key'] = k
+            not_delete_objects.append(err)
+
+        keys = []   # [(key, path, key_is_dir), ]
         for item in obj_keys:
-            obj_key = key = item.get('Key', '')
+            key = item.get('Key', '')
             if key.endswith('/'):  # 目录
-                key_is_dir = True
-                obj_key = key.rstrip('/')
+                keys.append((key, key.rstrip('/'), True))
             else:
-                key_is_dir = False
+                keys.append((key, key, False))
 
-            try:
-                try:
-                    obj = self.get_metadata_obj(table_name=table_name, path=obj_key)  # 不检查父路径
-                except Exception as e:
-                    if not isinstance(e, exceptions.S3Error):
-                        raise exceptions.S3InternalError(f'查询对象元数据错误，{str(e)}')
-                    raise e
+        try:
+            objs_map = bfm.get_objs_by_paths([path for _, path, _ in keys if path])     # 不检查父路径
+        except Exception as e:
+            error = exceptions.S3InternalError(f'查询对象元数据错误，{str(e)}')
+            for key, _, _ in keys:
+                add_error(key, error)
+
+            return deleted_objects, not_delete_objects
+
+        files = {}
+        file_keys = []
+        dir_keys = []
+        for key, path, key_is_dir in keys:
+            obj = objs_map.get(path) if path else None
+            if obj is None or key_is_dir != obj.is_dir():   # 不存在
+                deleted_objects.append({"Key": key})
+            elif key_is_dir:
+                dir_keys.append((key, obj))
+            else:
+                file_keys.append(key)
+                files[obj.id] = obj
 
-                if not obj:
-                    raise exceptions.S3NoSuchKey()
+        if files:
+            objs = list(files.values())
+            try:
+                MultipartUploadManager.delete_multipart_uploads_by_bucket_objs(bucket=bucket, objs=objs)
+                bfm.delete_objs_metadata(objs=objs, bucket_id=bucket.id)
+            except Exception as e:
+                if not isinstance(e, exceptions.S3Error):
+                    e = exceptions.S3InternalError(f'删除对象元数据时错误，{str(e)}')
 
-                if (key_is_dir and obj.is_dir()) or (not key_is_dir and obj.is_file()):
-                    try:
-                        self.do_delete_obj_or_dir(bucket=bucket, obj=obj)
-                    except exceptions.S3Error as e:
-                        raise e
+                for key in file_keys:
+                    add_error(key, e)
+            else:
+                deleted_objects += [{"Key": key} for key in file_keys]
 
-                    deleted_objects.append({"Key": key})
-                else:
-                    raise exceptions.S3NoSuchKey()
-            except exceptions.S3NoSuchKey as e:
-                deleted_objects.append({"Key": key})
+        for key, obj in dir_keys:
+            try:
+                self.do_delete_obj_or_dir(bucket=bucket, obj=obj)
             except exceptions.S3Error as e:
-                err = e.err_data()
-                err['Key'] = key
-                not_delete_objects.append(err)
+                add_error(key, e)
+                continue
+
+            deleted_objects.append({"Key": key})
 
         return deleted_objects, not_delete_objects
 
@@ -1276,8 +1280,6 @@ class HarborManager:
 
         :raises: S3Error
         """
-        old_id = obj.id
-
         if obj.is_dir():
             if not BucketFileManagement(collection_name=bucket.get_bucket_table_name()).dir_is_empty(obj):
                 raise exceptions.S3InvalidRequest('无法删除非空目录')
@@ -1291,21 +1293,17 @@ class HarborManager:
                 except exceptions.S3Error as e:
                     raise exceptions.S3InternalError('删除对象多部分上传元数据时错误')
 
-        # 先删除元数据，后删除rados对象（删除失败恢复元数据）
-        if not obj.do_delete():
-            raise exceptions.S3InternalError('删除对象原数据时错误')
-
         if obj.is_dir():
+            if not obj.do_delete():
+                raise exceptions.S3InternalError('删除对象原数据时错误')
+
             return True
 
-        obj.id = old_id  # obj为None的情况
-        rados = HarborManager.get_obj_rados(bucket=bucket, obj=obj)
-        ok, _ = rados.delete()
-        if not ok:
-            # 恢复元数据
-            obj.id = old_id
-            obj.do_save(force_insert=True)  # 仅尝试创建文档，不修改已存在文档
-            raise exceptions.S3InternalError('删除对象rados数据时错误')
+        # 删除元数据，rados数据加入删除队列，由后台删除
+        try:
+            GarbageObject.delete_obj(bucket_id=bucket.id, obj=obj)
+        except Exception as e:
+            raise exceptions.S3InternalError('删除对象原数据时错误')
 
         return True
 
@@ -1389,10 +1387,44 @@ class MultipartUploadManager:
             int     # 删除的数量
         """
         try:
-            count, d = MultipartUpload.objects.filter(
+            qs = MultipartUpload.objects.filter(
                 key_md5=obj.na_md5, bucket_name=bucket.name, bucket_id=bucket.id,
                 obj_id=obj.id, obj_key=obj.na
-            ).delete()
+            )
+            upload_ids = list(qs.values_list('id', flat=True))
+            if not upload_ids:
+                return 0
+
+            MultipartUploadPart.delete_upload_parts(upload_ids=upload_ids)
+            count, d = MultipartUpload.objects.filter(id__in=upload_ids).delete()
+        except Exception as e:
+            raise exceptions.S3InternalError(message=f'删除对象多部分上传元数据错误，{str(e)}')
+
+        return count
+
+    @staticmethod
+    def delete_multipart_uploads_by_bucket_objs(bucket, objs: list):
+        """
+        批量删除多个对象可能存在的多部分上传记录
+
+        :param bucket: 桶实例
+        :param objs: 对象列表，目录忽略
+        :return:
+            int     # 删除的数量
+        """
+        objs = [o for o in objs if o.is_file()]
+        if not objs:
+            return 0
+
+        try:
+            qs = MultipartUpload.objects.filter(
+                key_md5__in={o.na_md5 for o in objs}, bucket_id=bucket.id, obj_id__in=[o.id for o in objs])
+            upload_ids = list(qs.values_list('id', flat=True))
+            if not upload_ids:
+                return 0
+
+            MultipartUploadPart.delete_upload_parts(upload_ids=upload_ids)
+            count, d = MultipartUpload.objects.filter(id__in=upload_ids).delete()
         except Exception as e:
             raise exceptions.S3InternalError(message=f'删除对象多部分上传元数据错误，{str(e)}')
 
@@ -1,12 +1,12 @@
 from django.core.management.base import BaseCommand, CommandError
 
 from buckets.utils import (create_table_for_model_class, is_model_table_exists, delete_table_for_model_class)
-from s3.models import MultipartUpload
+from s3.models import MultipartUpload, MultipartUploadPart
 
 
 class Command(BaseCommand):
     """
-    创建或删除多部分上传数据库表
+    创建或删除多部分上传数据库表（多部分上传表和part表）
     """
 
     help = """** manage.py create_multipart_upload_table" **    
@@ -21,8 +21,13 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         delete = options['delete']
-        MultipartUpload._meta.managed = True
-        exists = is_model_table_exists(MultipartUpload)
+        for model in [MultipartUpload, MultipartUploadPart]:
+            self.stdout.write(self.style.NOTICE(f'Table {model._meta.db_table}:'))
+            self.handle_model_table(model=model, delete=delete)
+
+    def handle_model_table(self, model, delete: bool):
+        model._meta.managed = True
+        exists = is_model_table_exists(model)
         if delete:
             if exists:
                 if input('Are you sure to delete the table?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
@@ -31,7 +36,7 @@ class Command(BaseCommand):
                 if input("The last chance to go back. It's best to back up your data anyway. Will delete the table.\n\n" + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
                     raise CommandError("cancelled.")
 
-                if delete_table_for_model_class(MultipartUpload):
+                if delete_table_for_model_class(model):
                     self.stdout.write(self.style.SUCCESS('Delete table Successfully.'))
                 else:
                     self.stdout.write(self.style.ERROR('Failed to delete the table.'))
@@ -44,7 +49,7 @@ class Command(BaseCommand):
                 if input('Are you sure to create the table?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
                     raise CommandError("cancelled.")
 
-                if create_table_for_model_class(MultipartUpload):
+                if create_table_for_model_class(model):
                     self.stdout.write(self.style.SUCCESS('Create the table Successfully.'))
                 else:
                     self.stdout.write(self.style.ERROR('Failed to create the table'))
@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from s3.models import MultipartUpload, MultipartUploadPart
+
+
+class Command(BaseCommand):
+    """
+    把旧版本存储在多部分上传part_json['Parts']中的part信息迁移到MultipartUploadPart表，每个part一行;
+    可重复执行，已迁移的多部分上传不再有part_json['Parts']
+    """
+
+    help = """** manage.py migrate_multipart_parts **"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--id-gt', default='', dest='id-gt', type=str,
+            help='All multipart uploads with ID greater than "id-gt".',
+        )
+
+    def handle(self, *args, **options):
+        id_gt = options['id-gt']
+        count = 0
+        part_count = 0
+        while True:
+            qs = MultipartUpload.objects.order_by('id')
+            if id_gt:
+                qs = qs.filter(id__gt=id_gt)
+
+            uploads = list(qs[0:200])
+            if not uploads:
+                break
+
+            for upload in uploads:
+                id_gt = upload.id
+                if 'Parts' not in upload.part_json:
+                    continue
+
+                try:
+                    num = self.migrate_upload_parts(upload)
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Failed to migrate parts of upload(id={upload.id}), {str(e)}'))
+                    continue
+
+                count += 1
+                part_count += num
+
+        self.stdout.write(self.style.SUCCESS(f'Migrated {part_count} parts of {count} multipart uploads.'))
+
+    @staticmethod
+    def migrate_upload_parts(upload):
+        """
+        :return: int    # 迁移的part数量
+        """
+        with transaction.atomic(using='metadata'):
+            upload = MultipartUpload.objects.select_for_update().get(id=upload.id)
+            parts = upload.part_json.get('Parts', [])
+            objs = [
+                MultipartUploadPart(
+                    upload_id=upload.id, part_number=p['PartNumber'], size=p['Size'],
+                    etag=p['ETag'], last_modified=parse_last_modified(p.get('lastModified'))
+                ) for p in parts
+            ]
+            # 新版本已上传的同编号part以表中的为准
+            MultipartUploadPart.objects.bulk_create(objs, batch_size=500, ignore_conflicts=True)
+            upload.part_json.pop('Parts', None)
+            upload.save(update_fields=['part_json'])
+
+        return len(parts)
+
+
+def parse_last_modified(value):
+    """
+    part_json中的时间是DateEncoder编码的utc时间字符串
+    """
+    if isinstance(value, datetime):
+        return value
+
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return datetime.now(tz=timezone.utc)
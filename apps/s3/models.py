@@ -2,15 +2,13 @@ import base64
 import hashlib
 import json
 import uuid
-import copy
 from _datetime import datetime
 
-from django.db import models
+from django.db import models, connections, router
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 
 from . import exceptions
-from .multiparts import MultipartPartsManager
 
 
 def uuid1_time_hex_string(t):
@@ -63,12 +61,9 @@ class MultipartUpload(models.Model):
     part_json：
     {
     ObjectCreateTime:"",
-    Parts:[
-            {"ETag": "", "Size": 5242880, "PartNumber": 1, "lastModified": "2022-11-10 07:52:09"},
-            {"ETag": "", "Size": 5242880, "PartNumber": 2, "lastModified": "2022-11-10 07:53“}
-            。。。
-        ]
     }
+    part信息每个part一行记录在MultipartUploadPart表；
+    旧版本的part信息在part_json的Parts中，需要执行命令 manage.py migrate_multipart_parts 迁移到MultipartUploadPart表
     """
 
     class UploadStatus(models.TextChoices):
@@ -116,6 +111,10 @@ class MultipartUpload(models.Model):
 
         super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
 
+    def delete(self, using=None, keep_parents=False):
+        MultipartUploadPart.delete_upload_parts(upload_ids=[self.id])
+        return super().delete(using=using, keep_parents=keep_parents)
+
     def belong_to_bucket(self, bucket):
         """
         此多部分上传是否属于bucket, 因为这条记录可能属于已删除的桶名相同的桶
@@ -130,15 +129,21 @@ class MultipartUpload(models.Model):
 
         return False
 
+    def get_parts_queryset(self):
+        return MultipartUploadPart.objects.filter(upload_id=self.id).order_by('part_number')
+
     def get_parts(self) -> list:
-        return self.part_json['Parts']
+        """
+        所有part信息，按编号升序
+        """
+        return [p.to_item() for p in self.get_parts_queryset()]
 
     def get_part_by_index(self, index):
-        parts = self.get_parts()     # list
-        if index >= len(parts):
+        parts = list(self.get_parts_queryset()[index:index + 1])
+        if not parts:
             return None
 
-        return parts[index]
+        return parts[0].to_item()
 
     def get_part_by_number(self, number: int):
         """
@@ -149,21 +154,25 @@ class MultipartUpload(models.Model):
             int         # part在列表的索引; None(不存在)
         )
         """
-        part, index = MultipartPartsManager().query_part_info(num=number, parts=self.get_parts())
-        return part, index
+        part = MultipartUploadPart.objects.filter(upload_id=self.id, part_number=number).first()
+        if part is None:
+            return None, None
+
+        index = MultipartUploadPart.objects.filter(upload_id=self.id, part_number__lt=number).count()
+        return part.to_item(), index
 
     def insert_part(self, part_info: dict):
         """
-        增加块信息
+        增加块信息，编号已存在时替换
 
         :param part_info: 块信息
         :return:
             bool       # True(插入)；False(替换)
         """
-        parts_arr = self.get_parts()
-        is_insert, arr = MultipartPartsManager().insert_part_into_list(part=part_info, parts_arr=parts_arr)
-        self.save(update_fields=['part_json'])
-        return is_insert
+        return MultipartUploadPart.upsert(
+            upload_id=self.id, part_number=part_info['PartNumber'], size=part_info['Size'],
+            etag=part_info['ETag'], last_modified=part_info['lastModified']
+        )
 
     @property
     def is_part1_uploaded(self):
@@ -174,19 +183,11 @@ class MultipartUpload(models.Model):
             True    # 已上传
             False   # 未上传
         """
-        parts = self.get_parts()
-        if not parts:
-            return False
-
-        if parts[0]['PartNumber'] == 1:
-            return True
-
-        return False
+        return MultipartUploadPart.objects.filter(upload_id=self.id, part_number=1).exists()
 
     # 获取块的数量
     def get_parts_length(self):
-        parts = self.get_parts()
-        return len(parts)
+        return MultipartUploadPart.objects.filter(upload_id=self.id).count()
 
     @staticmethod
     def generate_key_hex_md5(key: str):
@@ -214,7 +215,7 @@ class MultipartUpload(models.Model):
             obj_id: int, obj_key: str, obj_upload_time: datetime, obj_perms_code: int
     ):
         key_md5 = cls.generate_key_hex_md5(obj_key)
-        part_json = {'Parts': [], 'ObjectCreateTime': int(obj_upload_time.timestamp())}
+        part_json = {'ObjectCreateTime': int(obj_upload_time.timestamp())}
         upload = MultipartUpload(bucket_id=bucket_id, bucket_name=bucket_name, obj_id=obj_id,
                                  obj_key=obj_key, key_md5=key_md5, obj_perms_code=obj_perms_code, part_json=part_json)
         upload.save(force_insert=True)
@@ -265,29 +266,18 @@ class MultipartUpload(models.Model):
 
     def get_range_parts(self, part_number_marker: int, max_parts: int):
         """
-        前提条件：part列表编号从1开始，并且连续
-
         编号大于part_number_marker开始往后最多max_parts个part
         :return: (
                 list,
                 bool
             )
         """
-        parts = self.get_parts()
-        if part_number_marker < len(parts):
-            marker_parts = parts[part_number_marker:]
-        else:
-            marker_parts = []
+        qs = self.get_parts_queryset().filter(part_number__gt=part_number_marker)
+        parts = [p.to_item() for p in qs[0:max_parts + 1]]
+        if len(parts) > max_parts:
+            return parts[0:max_parts], True
 
-        if max_parts < len(marker_parts):
-            ret_parts = marker_parts[0:max_parts]
-            is_truncated = True
-        else:
-            ret_parts = marker_parts
-            is_truncated = False
-
-        # 深拷贝，防止外部修改返回的列表时修改多部分上传对象
-        return copy.deepcopy(ret_parts), is_truncated
+        return parts, False
 
     def get_part_offset(self, part_number: int):
         """
@@ -339,13 +329,78 @@ class MultipartUpload(models.Model):
         first_part = self.get_part_by_index(0)  # 获取第一块信息
         return self.chunk_size > first_part['Size']
 
+    def get_last_part_number(self):
+        """
+        最大的part编号，part按编号存储在(编号-1)*分块大小处，即对象数据的part数量
+
+        :return: int; 0(没有part)
+        """
+        last_part = MultipartUploadPart.objects.filter(upload_id=self.id).order_by('-part_number').first()
+        if last_part is None:
+            return 0
+
+        return last_part.part_number
+
     def calculate_obj_size_by_chunk_size(self, chunk_size: int):
         """
         通过最后一个块和给定的分块大小计算对象大小
         """
-        parts = self.get_parts()
-        if not parts:
+        last_part = MultipartUploadPart.objects.filter(upload_id=self.id).order_by('-part_number').first()
+        if last_part is None:
+            return 0
+
+        return (last_part.part_number - 1) * chunk_size + last_part.size
+
+
+class MultipartUploadPart(models.Model):
+    """
+    多部分上传的part，每个part一行
+    """
+    id = models.BigAutoField(primary_key=True)
+    upload_id = models.CharField(verbose_name='多部分上传ID', max_length=64)
+    part_number = models.IntegerField(verbose_name='块编号')
+    size = models.BigIntegerField(verbose_name='块大小', default=0)
+    etag = models.CharField(verbose_name='块MD5 Etag', max_length=64, default='')
+    last_modified = models.DateTimeField(verbose_name='修改时间')
+
+    class Meta:
+        db_table = 'multipart_upload_part'
+        unique_together = ('upload_id', 'part_number')
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        verbose_name = '对象多部分上传块'
+        verbose_name_plural = verbose_name
+
+    def to_item(self) -> dict:
+        return MultipartUpload.build_part_item(
+            part_number=self.part_number, last_modified=self.last_modified, etag=self.etag, size=self.size)
+
+    @classmethod
+    def upsert(cls, upload_id: str, part_number: int, size: int, etag: str, last_modified: datetime):
+        """
+        插入一个part，编号已存在时更新，一条sql完成，并发上传同一part时不会丢失
+
+        :return:
+            bool       # True(插入)；False(替换)
+        """
+        table_name = cls._meta.db_table
+        sql = f'INSERT INTO `{table_name}` (`upload_id`, `part_number`, `size`, `etag`, `last_modified`) ' \
+              f'VALUES (%s, %s, %s, %s, %s) ' \
+              f'ON DUPLICATE KEY UPDATE `size`=VALUES(`size`), `etag`=VALUES(`etag`), ' \
+              f'`last_modified`=VALUES(`last_modified`)'
+        using = router.db_for_write(cls)
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, [upload_id, part_number, size, etag, last_modified])
+            rows = cursor.rowcount
+
+        return rows == 1    # mysql: 1(插入)；2(更新)
+
+    @classmethod
+    def delete_upload_parts(cls, upload_ids: list):
+        """
+        删除多部分上传的所有part
+        """
+        if not upload_ids:
             return 0
 
-        last_part = parts[-1]
-        return (last_part['PartNumber'] - 1) * chunk_size + last_part['Size']
+        count, d = cls.objects.filter(upload_id__in=upload_ids).delete()
+        return count
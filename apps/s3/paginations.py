@@ -1,10 +1,14 @@
+from base64 import b64decode, b64encode
 from urllib import parse
 
 from django.utils.encoding import force_str
 from django.utils.translation import gettext as _
 from rest_framework.pagination import CursorPagination, Cursor
 from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
 
+from buckets.models import BucketFileBase
+from buckets.utils import BucketFileManagement
 from . import exceptions
 from .harbor import HarborManager, MultipartUploadManager
 from .models import get_datetime_from_upload_id
@@ -24,7 +28,92 @@ def get_query_param(url, key):
     return query_dict.get(key, None)
 
 
-class ListObjectsV2CursorPagination(CursorPagination):
+class ObjectKeyOrderingMixin:
+    """
+    按对象key的字典序分页，S3要求列举结果按key的UTF-8二进制序
+
+    * 列举目录时(dir_path不是None)，目录下的对象和子目录按name排序，使用唯一索引(did, name)；
+    * 按前缀列举时，按排序键sk排序，使用索引sk；桶表还有未补全sk的记录时(manage.py fillsortkey)，按id倒序；
+    * 游标(continuation-token、marker)中记录排序方式(k)，排序方式改变前(如sk补全前)的游标位置在新的排序方式下无效，
+      不能继续列举，返回无效参数错误；sk已补全时其他进程签发的按sk排序的游标，本进程sk状态未更新时也按sk排序
+    """
+    legacy_ordering = '-id'
+    dir_path = None
+    key_ordering = None     # 'name', 'sk'; None(按id倒序)
+
+    def set_key_ordering(self, queryset):
+        if self.dir_path is not None:
+            self.key_ordering = 'name'
+        elif BucketFileManagement(collection_name=queryset.model._meta.db_table).is_sort_key_ready():
+            self.key_ordering = 'sk'
+        else:
+            self.key_ordering = None
+
+        self.ordering = self.key_ordering if self.key_ordering else self.legacy_ordering
+
+    def decode_cursor(self, request):
+        """
+        检查游标的排序方式，和当前排序方式不一致时 raise NotFound
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return super().decode_cursor(request)
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        key_ordering = tokens.get('k', [None])[0]
+        if key_ordering == 'sk' and self.key_ordering is None and self.dir_path is None:
+            self.key_ordering = 'sk'    # sk补全状态是单调的，其他进程已按sk排序
+            self.ordering = ('sk',)
+
+        if key_ordering != self.key_ordering:
+            raise NotFound(self.invalid_cursor_message)
+
+        return super().decode_cursor(request)
+
+    def encode_cursor(self, cursor):
+        """
+        游标中记录排序方式
+        """
+        tokens = {}
+        if cursor.offset != 0:
+            tokens['o'] = str(cursor.offset)
+        if cursor.reverse:
+            tokens['r'] = '1'
+        if cursor.position is not None:
+            tokens['p'] = cursor.position
+        if self.key_ordering:
+            tokens['k'] = self.key_ordering
+
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_key_position(self, start_after: str):
+        """
+        分页起始key对应的游标位置，列举结果不包含start_after
+
+        :return: str
+        """
+        if self.key_ordering == 'sk':
+            return BucketFileBase.build_sort_key(start_after)
+
+        # 按目录下的name排序
+        dir_prefix = f'{self.dir_path}/' if self.dir_path else ''
+        if start_after.startswith(dir_prefix):
+            return start_after[len(dir_prefix):].split('/', 1)[0]
+
+        if start_after < dir_prefix:
+            return None
+
+        return chr(0x10ffff)     # start_after在目录所有key之后
+
+
+class ListObjectsV2CursorPagination(ObjectKeyOrderingMixin, CursorPagination):
     """
     存储通文件对象分页器
     """
@@ -42,7 +131,7 @@ class ListObjectsV2CursorPagination(CursorPagination):
 
     start_after_query_param = 'start-after'  # used if no cursor_query_param
 
-    def __init__(self, context, prefix_obj=None):
+    def __init__(self, context, prefix_obj=None, dir_path=None):
         """
         :param context:
             {
@@ -50,6 +139,8 @@ class ListObjectsV2CursorPagination(CursorPagination):
                 'bucket_name': bucket_name,
                 ...
             }
+        :param prefix_obj: prefix目录
+        :param dir_path: 列举的目录路径，''是根目录；None不是列举目录
         """
         if 'bucket' not in context and 'bucket_name' not in context:
             raise ValueError('Invalid param "context", one of "bucket" and "bucket_name" needs to be in it.')
@@ -61,9 +152,11 @@ class ListObjectsV2CursorPagination(CursorPagination):
             _obj = None
 
         self.prefix_obj = _obj  # 目录在s3中是一个空对象, 是否第一页添加prefix目录
+        self.dir_path = dir_path
 
     def paginate_queryset(self, queryset, request, view=None):
         self.request = request
+        self.set_key_ordering(queryset)
         data = super().paginate_queryset(queryset=queryset, request=request, view=view)
         if data is None:
             data = []
@@ -186,6 +279,13 @@ class ListObjectsV2CursorPagination(CursorPagination):
 
         :raises: S3Error
         """
+        if self.key_ordering:
+            position = self.get_key_position(start_after=start_after)
+            if position is None:
+                return None
+
+            return Cursor(offset=0, reverse=False, position=position)
+
         hm = HarborManager()
         bucket = self._context.get('bucket', None)
         if not bucket:
@@ -217,7 +317,7 @@ class ListObjectsV2CursorPagination(CursorPagination):
         return Cursor(offset=0, reverse=reverse, position=position)
 
 
-class ListObjectsV1CursorPagination(CursorPagination):
+class ListObjectsV1CursorPagination(ObjectKeyOrderingMixin, CursorPagination):
     """
     存储通文件对象分页器
     """
@@ -233,9 +333,11 @@ class ListObjectsV1CursorPagination(CursorPagination):
     max_page_size = 1000
     offset_cutoff = 0
 
-    def __init__(self, context=None, prefix_obj=None):
+    def __init__(self, context=None, prefix_obj=None, dir_path=None):
         """
         :param context: {}
+        :param prefix_obj: prefix目录
+        :param dir_path: 列举的目录路径，''是根目录；None不是列举目录
         """
         self._context = context if context else {}
         if prefix_obj is not None and prefix_obj.id > 0:    # id=0是虚拟的根目录
@@ -244,9 +346,11 @@ class ListObjectsV1CursorPagination(CursorPagination):
             _obj = None
 
         self.prefix_obj = _obj      # 目录在s3中是一个空对象, 是否第一页添加prefix目录
+        self.dir_path = dir_path
 
     def paginate_queryset(self, queryset, request, view=None):
         self.request = request
+        self.set_key_ordering(queryset)
         data = super().paginate_queryset(queryset=queryset, request=request, view=view)
         if data is None:
             data = []
@@ -11,6 +11,7 @@ from rest_framework.exceptions import (APIException, NotAuthenticated, Authentic
 from . import exceptions
 from .renders import CommonXMLRenderer
 from .auth import S3V4Authentication
+from utils.writebehind import write_behind
 
 
 def exception_handler(exc, context):
@@ -74,7 +75,7 @@ class S3CustomGenericViewSet(GenericViewSet):
                 date = timezone.now().date()
                 if user.last_active < date:
                     user.last_active = date
-                    user.save(update_fields=['last_active'])
+                    write_behind.touch(model=user._meta.model, obj_id=user.id, field='last_active', value=date)
             except:
                 pass
 
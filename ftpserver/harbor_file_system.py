@@ -198,7 +198,7 @@ class HarborFileSystem(AbstractedFS):
         try:
             self.client.ftp_move_rename(self.bucket_name, src[1:], new_name, new_dir)
         except HarborError as error:
-            raise FilesystemError(f'rename dir is not supported, {str(error)}')
+            raise FilesystemError(f'rename failed, {str(error)}')
         except Exception as error:
             raise FilesystemError(str(error))
 
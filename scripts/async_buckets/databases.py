@@ -1,5 +1,7 @@
+import time
 import threading
 from functools import wraps
+from contextlib import contextmanager
 import MySQLdb as Database
 from MySQLdb.constants import CLIENT
 from MySQLdb.cursors import DictCursor
@@ -8,6 +10,8 @@ from webserver import settings as django_settings
 
 backup_setting = getattr(django_settings, 'BACKUP_BUCKET_SETTINGS', {})
 meet_async_timedelta_minutes = backup_setting.get('meet_async_timedelta_minutes', 60)
+db_pool_max_size = backup_setting.get('db_pool_max_size', 20)
+db_pool_timeout = backup_setting.get('db_pool_timeout', 60)
 
 
 class ConnectionDoesNotExist(Exception):
@@ -18,55 +22,165 @@ class CanNotConnection(Exception):
     pass
 
 
+class ConnectionPool:
+    """
+    一个数据库别名的连接池，最多max_size个连接；
+    线程从池中取出连接独占使用，用完归还，池中没有空闲连接且连接数已达上限时等待其他线程归还
+    """
+    def __init__(self, settings_dict, alias, max_size: int = 20, timeout: int = 60):
+        """
+        :param max_size: 连接数上限
+        :param timeout: 等待空闲连接的超时时间(秒)
+        """
+        self.settings_dict = settings_dict
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []     # 空闲连接，后进先出，尽量复用最近使用的连接
+        self._size = 0      # 已创建的连接数
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        从池中取出一个连接，取出前检查连接是否可用，不可用的连接关闭，使用时重新连接
+
+        :return: DatabaseWrapper()
+        :raises: CanNotConnection
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CanNotConnection(f"Timeout waiting for an idle connection '{self.alias}' from pool.")
+
+                self._cond.wait(remaining)
+
+        if conn is not None:
+            conn.close_if_unusable_or_obsolete()
+            return conn
+
+        try:
+            return DatabaseWrapper(self.settings_dict, self.alias)
+        except Exception as e:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+
+            raise e
+
+    def set_max_size(self, max_size: int):
+        with self._cond:
+            self.max_size = max_size
+            self._cond.notify_all()
+
+    def release(self, conn):
+        """
+        连接归还到池中
+        """
+        conn.close_if_unusable_or_obsolete()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        """
+        关闭空闲的连接，连接对象保留在池中，使用时重新连接
+        """
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+
+
 class ConnectionHandler:
+    """
+    每个数据库别名一个连接池，线程通过checkout()从池中取出连接，同一线程嵌套checkout()时复用已取出的连接
+    """
     settings_name = 'DATABASES'
     exception_class = ConnectionDoesNotExist
 
-    def __init__(self, settings: dict = None):
+    def __init__(self, settings: dict = None, pool_max_size: int = 20, pool_timeout: int = 60):
         if settings is None:
             settings = getattr(django_settings, self.settings_name)
 
         self._settings = settings
-        self._connections = {}
+        self.pool_max_size = pool_max_size
+        self.pool_timeout = pool_timeout
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        self._local = threading.local()
 
     @property
     def settings(self) -> dict:
         return self._settings
 
-    def __getitem__(self, alias):
-        try:
-            return self._connections[alias]
-        except KeyError:
-            if alias not in self.settings:
-                raise self.exception_class(f"The connection '{alias}' doesn't exist.")
-        conn = self.create_connection(alias)
-        self._connections[alias] = conn
-        return conn
-
-    def __setitem__(self, key, value):
-        self._connections[key] = value
-
-    def __delitem__(self, key):
-        self._connections.pop(key, None)
-
     def __iter__(self):
         return iter(self.settings.keys())
 
     def __del__(self):
         self.close_all()
 
-    def all(self):
-        return [self[alias] for alias in self]
+    def set_pool_max_size(self, max_size: int):
+        """
+        设置连接池连接数上限，应不小于同时查询数据库的线程数
+        """
+        with self._pools_lock:
+            self.pool_max_size = max_size
+            for pool in self._pools.values():
+                pool.set_max_size(max_size)
+
+    def get_pool(self, alias) -> ConnectionPool:
+        pool = self._pools.get(alias)
+        if pool is not None:
+            return pool
+
+        with self._pools_lock:
+            pool = self._pools.get(alias)
+            if pool is None:
+                self.ensure_defaults(alias)
+                pool = ConnectionPool(self.settings[alias], alias, max_size=self.pool_max_size,
+                                      timeout=self.pool_timeout)
+                self._pools[alias] = pool
+
+        return pool
+
+    @contextmanager
+    def checkout(self, alias):
+        """
+        with语句中当前线程独占一个连接，退出最外层with语句时归还连接
 
-    def create_connection(self, alias):
-        self.ensure_defaults(alias)
-        db = self.settings[alias]
-        return DatabaseWrapper(db, alias)
+        :raises: ConnectionDoesNotExist, CanNotConnection
+        """
+        held = getattr(self._local, 'connections', None)
+        if held is None:
+            held = self._local.connections = {}
+
+        conn = held.get(alias)
+        if conn is not None:
+            yield conn
+            return
+
+        pool = self.get_pool(alias)
+        conn = pool.acquire()
+        held[alias] = conn
+        try:
+            yield conn
+        finally:
+            held.pop(alias, None)
+            pool.release(conn)
 
     def close_all(self):
-        for alias in self._connections.keys():
-            connection = self._connections[alias]
-            connection.close()
+        for pool in list(self._pools.values()):
+            pool.close_all()
 
     def ensure_defaults(self, alias):
         """
@@ -254,50 +368,36 @@ class DatabaseWrapper:
         return self.connection
 
 
-connections = ConnectionHandler()
-
-
-def close_old_connections(**kwargs):
-    for conn in connections.all():
-        conn.close_if_unusable_or_obsolete()
+connections = ConnectionHandler(pool_max_size=db_pool_max_size, pool_timeout=db_pool_timeout)
 
 
 def get_connection(using: str):
-    close_old_connections()
-    return connections[using]
+    """
+    当前线程从连接池取出的连接，必须在db_connection装饰的函数中调用
+    """
+    conn = getattr(connections._local, 'connections', {}).get(using)
+    if conn is None:
+        raise Exception(f'No connection "{using}" checked out in current thread, use decorator db_connection')
+
+    return conn
 
 
 METADATA = 'metadata'
 DEFAULT = 'default'
-_default_db_lock = threading.Lock()
-_metadata_db_lock = threading.Lock()
 
 
-def _acquire_lock(using):
-    if using == METADATA:
-        _metadata_db_lock.acquire()
-        return _metadata_db_lock
-    elif using == DEFAULT:
-        _default_db_lock.acquire()
-        return _default_db_lock
-    else:
-        raise Exception(f'Invalid database alias using "{using}"')
-
-
-def db_readwrite_lock(func):
+def db_connection(func):
     """
+    被装饰的函数执行期间，当前线程从连接池取出一个连接独占使用，函数中通过get_connection(using)获取；
     调用被装饰的函数必须使用using关键字参数
     """
     @wraps(func)
     def wrapper(*arge, **kwargs):
         using = kwargs['using']
-        _lock = _acquire_lock(using)
+        if using not in (METADATA, DEFAULT):
+            raise Exception(f'Invalid database alias using "{using}"')
 
-        try:
+        with connections.checkout(using):
             return func(*arge, **kwargs)
-        except Exception as e:
-            raise e
-        finally:
-            _lock.release()
 
     return wrapper
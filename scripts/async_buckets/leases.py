@@ -0,0 +1,214 @@
+import os
+import math
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .databases import backup_setting
+from .querys import QueryHandler
+
+
+shard_size = backup_setting.get('shard_size', 1000000)
+lease_seconds = backup_setting.get('lease_seconds', 600)
+
+
+class ShardLeaseManager:
+    """
+    备份同步分片租约，替代按节点编号对对象id求余的分配方式
+
+    * 每个桶的每个备份点按对象id范围分片，分片记录在async_shard_lease表，随桶内对象id增长追加分片；
+    * 工作节点定时在async_worker_node表更新心跳，每个节点在一个桶上最多领取 分片数/存活节点数 个分片，
+      节点加入或退出后，下次领取时按新的存活节点数重新均分；
+    * 领取的分片在租约过期前续约，同步完成后释放；节点异常退出时租约过期后可被其他节点领取；
+    * 持有分片期间后台线程每lease_seconds/3秒续约一次，单个对象同步时间超过租约时长时租约也不会过期
+    """
+    def __init__(self, name: str = None, shard_size: int = shard_size, lease_seconds: int = lease_seconds):
+        """
+        :param name: 节点名称，默认 主机名_进程号
+        :param shard_size: 每个分片的对象id范围大小
+        :param lease_seconds: 租约时长(秒)
+        """
+        if name is None:
+            name = f'{socket.gethostname()}_{os.getpid()}'
+
+        self.name = name
+        self.shard_size = max(shard_size, 1)
+        self.lease_seconds = max(lease_seconds, 10)
+        self._renew_times = {}  # {shard_id: 上次续约的时间}
+        self._lost = set()      # 续约失败(已被其他节点领取)的分片id
+        self._lock = threading.Lock()
+        self._renewer = None
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def now():
+        return datetime.utcnow()
+
+    def get_lease_expire(self):
+        return self.now() + timedelta(seconds=self.lease_seconds)
+
+    def heartbeat(self):
+        """
+        更新心跳
+
+        :return: int    # 存活的节点数
+        """
+        query_hand = QueryHandler()
+        now = self.now()
+        query_hand.heartbeat_async_worker(name=self.name, heartbeat_time=now)
+        count = query_hand.get_live_async_worker_count(alive_after=now - timedelta(seconds=self.lease_seconds))
+        return max(count, 1)
+
+    def leave(self):
+        """
+        节点退出，停止后台续约，删除心跳记录，其他节点下次领取时按新的存活节点数均分
+        """
+        self._stopped.set()
+        QueryHandler().remove_async_worker(name=self.name)
+
+    def _start_renewer(self):
+        """
+        启动后台续约线程
+        """
+        with self._lock:
+            if self._renewer is not None and self._renewer.is_alive():
+                return
+
+            self._stopped.clear()
+            self._renewer = threading.Thread(target=self._run_renewer, name='shard-lease-renewer', daemon=True)
+            self._renewer.start()
+
+    def _run_renewer(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            self.renew_held_shards()
+
+    def renew_held_shards(self):
+        """
+        续约所有持有的分片，续约失败的分片标记为已失去，keep_alive()返回False
+        """
+        with self._lock:
+            shard_ids = list(self._renew_times.keys())
+
+        if not shard_ids:
+            return
+
+        try:
+            self.heartbeat()
+        except Exception:
+            pass    # 心跳下次重试，不影响续约
+
+        query_hand = QueryHandler()
+        for shard_id in shard_ids:
+            try:
+                rows = query_hand.renew_shards(shard_ids=[shard_id], owner=self.name,
+                                               lease_expire=self.get_lease_expire())
+            except Exception:
+                continue    # 下次重试，或在keep_alive()中续约
+
+            with self._lock:
+                if shard_id not in self._renew_times:   # 已释放
+                    continue
+
+                if rows < 1:
+                    self._lost.add(shard_id)
+                else:
+                    self._renew_times[shard_id] = time.monotonic()
+
+    def ensure_bucket_shards(self, bucket_id, backup_num: int):
+        """
+        按桶内最大对象id补齐分片
+
+        :return: list   # 桶的备份点的所有分片
+        """
+        query_hand = QueryHandler()
+        shards = query_hand.get_bucket_shards(bucket_id=bucket_id, backup_num=backup_num)
+        covered = shards[-1]['id_end'] if shards else 1     # 对象id从1开始
+        max_id = query_hand.get_bucket_max_object_id(bucket_id=bucket_id)
+        if max_id < covered:
+            return shards
+
+        ranges = []
+        start = covered
+        while start <= max_id:
+            ranges.append((start, start + self.shard_size))
+            start += self.shard_size
+
+        query_hand.create_bucket_shards(bucket_id=bucket_id, backup_num=backup_num, ranges=ranges)
+        return query_hand.get_bucket_shards(bucket_id=bucket_id, backup_num=backup_num)
+
+    def acquire_shards(self, bucket_id, backup_num: int):
+        """
+        领取桶的备份点的分片，最多领取均分给每个节点的数量
+
+        :return: list   # 领取到的分片，需要在同步完成后release_shards()
+        """
+        worker_count = self.heartbeat()
+        shards = self.ensure_bucket_shards(bucket_id=bucket_id, backup_num=backup_num)
+        if not shards:
+            return []
+
+        quota = math.ceil(len(shards) / worker_count)
+        now = self.now()
+        query_hand = QueryHandler()
+        acquired = []
+        for shard in shards:
+            if len(acquired) >= quota:
+                break
+
+            owner = shard['owner']
+            expire = shard['lease_expire']
+            if owner and owner != self.name and expire is not None and expire >= now:
+                continue
+
+            if query_hand.claim_shard(shard_id=shard['id'], owner=self.name,
+                                      lease_expire=self.get_lease_expire(), now=now):
+                acquired.append(shard)
+                with self._lock:
+                    self._renew_times[shard['id']] = time.monotonic()
+                    self._lost.discard(shard['id'])
+
+        if acquired:
+            self._start_renewer()
+
+        return acquired
+
+    def keep_alive(self, shard: dict):
+        """
+        检查是否仍持有分片；后台线程未及时续约时(租约时长过去三分之一后)在此续约，同时更新心跳
+
+        :return:
+            True    # 仍持有分片
+            False   # 租约已被其他节点领取
+        """
+        shard_id = shard['id']
+        now = time.monotonic()
+        with self._lock:
+            if shard_id in self._lost:
+                return False
+
+            last = self._renew_times.get(shard_id, 0)
+            if now - last < self.lease_seconds / 3:
+                return True
+
+        self.heartbeat()
+        rows = QueryHandler().renew_shards(shard_ids=[shard_id], owner=self.name, lease_expire=self.get_lease_expire())
+        if rows < 1:
+            with self._lock:
+                self._lost.add(shard_id)
+
+            return False
+
+        with self._lock:
+            self._renew_times[shard_id] = now
+
+        return True
+
+    def release_shards(self, shards: list):
+        ids = [s['id'] for s in shards]
+        with self._lock:
+            for i in ids:
+                self._renew_times.pop(i, None)
+                self._lost.discard(i)
+
+        return QueryHandler().release_shards(shard_ids=ids, owner=self.name)
@@ -3,10 +3,11 @@ from urllib import parse
 from datetime import datetime
 import requests
 
-from utils.oss.pyrados import FileWrapper, HarborObject
-from utils.md5 import FileMD5Handler, EMPTY_HEX_MD5
+from utils.oss.pyrados import FileWrapper, HarborObject, PartManifest
+from utils.md5 import EMPTY_HEX_MD5
+from utils.transfer import sessions, ChunkUploader, ChunkUploadError
 
-from .databases import django_settings
+from .databases import django_settings, backup_setting
 from .querys import QueryHandler, BackupNum
 
 
@@ -29,15 +30,20 @@ def get_ceph_conf():
 
 
 django_settings.CEPH_RADOS = get_ceph_conf()
+chunk_max_in_flight = backup_setting.get('chunk_max_in_flight', 4)
+chunk_retries = backup_setting.get('chunk_retries', 3)
 
 
-def build_harbor_object(using: str, obj_id: str, obj_size: int = 0):
+def build_harbor_object(using: str, obj_id: str, obj_size: int = 0, stripe_unit: int = 0,
+                        manifest: PartManifest = None):
     """
     构建iharbor对象对应的ceph读写接口
 
     :param using: ceph集群配置别名，对应对象数据所在ceph集群
     :param obj_id: 对象在ceph存储池中对应的rados名称
     :param obj_size: 对象的大小
+    :param stripe_unit: 对象数据布局的条带单元大小；0表示旧布局
+    :param manifest: 对象的part清单；None表示对象数据连续存储
     """
     cephs = django_settings.CEPH_RADOS
     if using not in cephs:
@@ -51,7 +57,8 @@ def build_harbor_object(using: str, obj_id: str, obj_size: int = 0):
     keyring_file = ceph['KEYRING_FILE_PATH']
     pool_name = ceph['POOL_NAME'][0]
     return HarborObject(pool_name=pool_name, obj_id=obj_id, obj_size=obj_size, cluster_name=cluster_name,
-                        user_name=user_name, conf_file=conf_file, keyring_file=keyring_file, alise_cluster=using)
+                        user_name=user_name, conf_file=conf_file, keyring_file=keyring_file, alise_cluster=using,
+                        stripe_unit=stripe_unit, manifest=manifest)
 
 
 def get_utcnow():
@@ -123,14 +130,11 @@ class IharborBucketClient:
     @staticmethod
     def _do_request(method: str, url: str, data, headders):
         """
-        :raises: Exception, requests.exceptions.RequestException
-        """
-        method = method.lower()
-        func = getattr(requests, method, None)
-        if func is None:
-            raise Exception(f'package requests no method {method}')
+        通过按endpoint复用的长连接会话请求
 
-        return func(url=url, data=data, headers=headders)
+        :raises: requests.exceptions.RequestException
+        """
+        return sessions.request(method=method, url=url, data=data, headers=headders)
 
     def create_object_metadata(self, endpoint_url: str, bucket_name: str, object_key: str, bucket_token: str):
         """
@@ -224,61 +228,58 @@ class IharborBucketClient:
     def post_object_by_chunk(self, ho, endpoint_url: str, bucket_name: str, object_key: str,
                              bucket_token: str, per_size: int = 32 * 1024 ** 2, breakpoint_resume=None):
         """
-        分片上传一个对象
+        分片上传一个对象，多个分片并发上传，每个分片失败时单独重试
         :raises: AsyncError
         """
         backup_str = f"endpoint_url={endpoint_url}, bucket name={bucket_name}, token={bucket_token}"
-        file = FileWrapper(ho=ho).open()
+        uploader = ChunkUploader(
+            chunk_url=lambda offset, reset: self._build_post_chunk_url(
+                endpoint_url=endpoint_url, bucket_name=bucket_name, object_key=object_key,
+                offset=offset, reset=reset),
+            headers={'Authorization': f'BucketToken {bucket_token}'},
+            per_size=per_size, max_in_flight=chunk_max_in_flight, retries=chunk_retries
+        )
+        offset = 0
         if breakpoint_resume:
-            # 续传 获取 已同步文件的大小
+            # 续传 获取 已同步文件的大小，并发上传时之前的分片可能未写入，从可能的空洞之前开始
             incomplete_obj_size = self.get_backup_address_object_size(endpoint_url=endpoint_url, object_key=object_key,
                                                                       bucket_name=bucket_name, bucket_token=bucket_token)
-            file.seek(incomplete_obj_size)
-
-        while True:
-            offset = file.offset
-            reset = None
-            if offset == 0:
-                reset = True
-
-            api = self._build_post_chunk_url(endpoint_url=endpoint_url, bucket_name=bucket_name,
-                                             object_key=object_key, offset=offset, reset=reset)
-            data = file.read(per_size)
-            if not data:
-                if offset >= file.size:
-                    break
-                raise AsyncError(f'Failed async object({object_key}), to backup({backup_str}), post by chunk, '
-                                 f'read empty bytes from ceph, 对象同步可能不完整', code='FailedAsyncObject')
-
-            md5_handler = FileMD5Handler()
-            md5_handler.update(offset=0, data=data)
-            hex_md5 = md5_handler.hex_md5
-            headers = {
-                'Authorization': f'BucketToken {bucket_token}',
-                'Content-MD5': hex_md5
-            }
-            try:
-                r = self._do_request(method='post', url=api, data=data, headders=headers)
-                if r.status_code == 200:
-                    continue
-            except requests.exceptions.RequestException as e:
-                pass
-
-            try:
-                r = self._do_request(method='post', url=api, data=data, headders=headers)
-            except requests.exceptions.RequestException as e:
-                raise AsyncError(f'Failed async object({object_key}), to backup({backup_str}), post by chunk, {str(e)}',
-                                 code='FailedAsyncObject')
-
-            if r.status_code == 200:
-                continue
+            offset = uploader.get_resume_offset(incomplete_obj_size)
 
-            raise AsyncError(f'Failed async object({object_key}), to backup({backup_str}), post by chunk, {r.text}',
+        try:
+            uploader.upload(ho=ho, offset=offset)
+        except ChunkUploadError as e:
+            raise AsyncError(f'Failed async object({object_key}), to backup({backup_str}), post by chunk, {str(e)}',
                              code='FailedAsyncObject')
 
-        file.close()
         return True
 
+    def delete_object(self, endpoint_url: str, bucket_name: str, object_key: str, bucket_token: str):
+        """
+        删除一个对象，对象不存在视为成功
+
+        :return:
+            True:               success
+        :raises: AsyncError
+        """
+        backup_str = f"endpoint_url={endpoint_url}, bucket name={bucket_name}, token={bucket_token}"
+        url = self._build_object_base_url(endpoint_url=endpoint_url, bucket_name=bucket_name,
+                                          object_key=object_key, api_version='v1')
+        headers = {
+            'Authorization': f'BucketToken {bucket_token}'
+        }
+        try:
+            r = self._do_request(method='delete', url=url, data=None, headders=headers)
+        except requests.exceptions.RequestException as e:
+            raise AsyncError(message=f'Failed async delete object({object_key}), to backup({backup_str}), {str(e)}',
+                             code='FailedAsyncDeleteObject')
+
+        if r.status_code in [204, 404]:
+            return True
+
+        raise AsyncError(message=f'Failed async delete object({object_key}), to backup({backup_str}), {r.text}',
+                         code='FailedAsyncDeleteObject')
+
 
 class AsyncBucketManager:
     AsyncError = AsyncError
@@ -294,7 +295,14 @@ class AsyncBucketManager:
             HarborObject()
         """
         obj_key = f"{str(bucket['id'])}_{str(obj['id'])}"
-        return build_harbor_object(using=str(obj['pool_id']), obj_id=obj_key, obj_size=obj['si'])
+        stripe_unit = obj['stripe_unit'] if obj.get('layout') == 1 else 0
+        manifest = None
+        if 0 < obj.get('manifest_part_size', 0) < obj.get('manifest_stride', 0):
+            manifest = PartManifest(part_size=obj['manifest_part_size'], stride=obj['manifest_stride'],
+                                    parts=obj.get('manifest_parts', 0))
+
+        return build_harbor_object(using=str(obj['pool_id']), obj_id=obj_key, obj_size=obj['si'],
+                                   stripe_unit=stripe_unit, manifest=manifest)
 
     def async_object_to_backup_bucket(self, bucket: dict, obj: dict, backup: dict, breakpoint_resume=None):
         """
@@ -374,6 +382,18 @@ class AsyncBucketManager:
 
         return backup
 
+    @staticmethod
+    def async_delete_object(bucket: dict, object_key: str, backup: dict):
+        """
+        同步删除一个对象到备份点
+
+        :raises: AsyncError
+        """
+        IharborBucketClient().delete_object(
+            endpoint_url=backup['endpoint_url'], bucket_name=backup['bucket_name'],
+            object_key=object_key, bucket_token=backup['bucket_token'])
+        return True
+
     def async_bucket_object_breakpoint_resume(self, obj, backup_num):
         """
         判断是否是对象是否断点续传
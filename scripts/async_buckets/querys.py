@@ -1,12 +1,21 @@
+import hashlib
 from datetime import timedelta, datetime
 from pytz import utc
 
 from .databases import (
     get_connection, meet_async_timedelta_minutes,
-    METADATA, DEFAULT, db_readwrite_lock
+    METADATA, DEFAULT, db_connection
 )
 
 
+class ChangeAction:
+    """
+    对象变更日志的操作类型，和buckets.models.ObjectChangeLog一致
+    """
+    PUT = 1
+    DELETE = 2
+
+
 class BackupNum:
     ONE = 1
     TWO = 2
@@ -69,10 +78,11 @@ def table_columns(table_name: str):
 class QueryHandler:
     MEET_ASYNC_TIMEDELTA_MINUTES = meet_async_timedelta_minutes
 
-    @db_readwrite_lock
-    def select(self, using: str, sql: str, result_type: str = 'all'):
+    @db_connection
+    def select(self, using: str, sql: str, result_type: str = 'all', params=None):
         """
         :param result_type: one, all
+        :param params: sql参数，sql中使用%s占位
         :return:
             (dict, )            # when result_type == all
             dict or None        # when result_type == one
@@ -84,7 +94,7 @@ class QueryHandler:
         conn = get_connection(using)
         try:
             with conn.cursor() as cursor:
-                cursor.execute(sql)
+                cursor.execute(sql, params)
                 if result_type == 'one':
                     ret = cursor.fetchone()
                 elif result_type == 'all':
@@ -95,22 +105,22 @@ class QueryHandler:
             conn.errors_occurred = True
             raise e
 
-    def select_one(self, using: str, sql: str):
+    def select_one(self, using: str, sql: str, params=None):
         """
         :return:
             dict or None
         """
-        return self.select(using=using, sql=sql, result_type='one')
+        return self.select(using=using, sql=sql, result_type='one', params=params)
 
-    def select_all(self, using: str, sql: str):
-        return self.select(using=using, sql=sql, result_type='all')
+    def select_all(self, using: str, sql: str, params=None):
+        return self.select(using=using, sql=sql, result_type='all', params=params)
 
-    @db_readwrite_lock
-    def update(self, using: str, sql: str):
+    @db_connection
+    def update(self, using: str, sql: str, params=None):
         conn = get_connection(using)
         try:
             with conn.cursor() as cursor:
-                rows = cursor.execute(sql)
+                rows = cursor.execute(sql, params)
                 conn.commit()
                 return rows
         except Exception as e:
@@ -121,6 +131,40 @@ class QueryHandler:
     def _bucket_table_name(bucket_id):
         return f'bucket_{bucket_id}'
 
+    @staticmethod
+    def _object_fields_sql(table_name: str):
+        tc = table_columns(table_name=table_name)
+        fields = [
+            tc('id'),
+            tc('na'),
+            tc('na_md5'),
+            tc('name'),
+            tc('fod'),
+            tc('did'),
+            tc('si'),
+            tc('ult'),
+            tc('upt'),
+            tc('dlc'),
+            tc('shp'),
+            tc('stl'),
+            tc('sst'),
+            tc('set'),
+            tc('sds'),
+            tc('md5'),
+            tc('share'),
+            tc('sync_start1'),
+            tc('sync_start2'),
+            tc('sync_end1'),
+            tc('sync_end2'),
+            tc('pool_id'),
+            tc('layout'),
+            tc('stripe_unit'),
+            tc('manifest_part_size'),
+            tc('manifest_stride'),
+            tc('manifest_parts')
+        ]
+        return ', '.join(fields)
+
     @staticmethod
     def get_need_async_bucket_query_sql(id_gt: int = 0, limit: int = 1000, names: list = None):
         """
@@ -187,7 +231,7 @@ class QueryHandler:
 
     def get_need_async_objects_query_sql(
             self, bucket_id: int, id_gt: int, limit: int, backup_nums: list,
-            meet_time=None, id_mod_div: int = None, id_mod_equal: int = None,
+            meet_time=None, id_gte: int = None, id_lt: int = None,
             size_gte: int = None
     ):
         """
@@ -201,8 +245,8 @@ class QueryHandler:
         :param id_gt: 查询id大于id_gt的数据，实现分页续读
         :param limit: 获取数据的数量
         :param meet_time: 查询upt大于此时间的对象
-        :param id_mod_div: object id求余的除数，和参数id_mod_equal一起使用
-        :param id_mod_equal: object id求余的余数相等的筛选条件，仅在参数id_mod有效时有效
+        :param id_gte: 查询id大于等于id_gte的数据，和id_lt一起限定分片的id范围
+        :param id_lt: 查询id小于id_lt的数据
         :param backup_nums: 筛选条件，只查询指定备份点编号需要同步的对象，[int, ]
         :param size_gte: 查询object size大于等于size_gte的数据
         :return:
@@ -217,31 +261,7 @@ class QueryHandler:
         table_name = self._bucket_table_name(bucket_id)
         tc = table_columns(table_name=table_name)
         qn = quote_name
-        fields = [
-            tc('id'),
-            tc('na'),
-            tc('na_md5'),
-            tc('name'),
-            tc('fod'),
-            tc('did'),
-            tc('si'),
-            tc('ult'),
-            tc('upt'),
-            tc('dlc'),
-            tc('shp'),
-            tc('stl'),
-            tc('sst'),
-            tc('set'),
-            tc('sds'),
-            tc('md5'),
-            tc('share'),
-            tc('sync_start1'),
-            tc('sync_start2'),
-            tc('sync_end1'),
-            tc('sync_end2'),
-            tc('pool_id')
-        ]
-        fields_sql = ', '.join(fields)
+        fields_sql = self._object_fields_sql(table_name=table_name)
 
         if size_gte is not None:
             where_list = [f"{tc('fod')} AND {tc('si')} >= {size_gte}"]
@@ -269,9 +289,11 @@ class QueryHandler:
             num_where = ' OR '.join(num_where_items)
             where_list.append(f"({num_where})")
 
-        if id_mod_div is not None and id_mod_equal is not None:
-            if id_mod_div >= 1 and (0 <= id_mod_equal < id_mod_div):
-                where_list.append(f"MOD({tc('id')}, {id_mod_div}) = {id_mod_equal}")
+        if id_gte is not None:
+            where_list.append(f"{tc('id')} >= {int(id_gte)}")
+
+        if id_lt is not None:
+            where_list.append(f"{tc('id')} < {int(id_lt)}")
 
         where = " AND ".join(where_list)
         order_by = ', '.join(order_by_list)
@@ -281,7 +303,7 @@ class QueryHandler:
 
     def get_need_async_objects(
             self, bucket_id, id_gt: int = None, limit: int = 100, meet_time=None,
-            id_mod_div: int = None, id_mod_equal: int = None, backup_nums: list = None,
+            id_gte: int = None, id_lt: int = None, backup_nums: list = None,
             size_gte: int = None
     ):
         """
@@ -295,8 +317,8 @@ class QueryHandler:
         :param id_gt: 查询id大于id_gt的数据，实现分页续读
         :param limit: 获取数据的数量
         :param meet_time: 查询upt大于此时间的对象
-        :param id_mod_div: object id求余的除数，和参数id_mod_equal一起使用
-        :param id_mod_equal: object id求余的余数相等的筛选条件，仅在参数id_mod有效时有效
+        :param id_gte: 查询id大于等于id_gte的数据，和id_lt一起限定分片的id范围
+        :param id_lt: 查询id小于id_lt的数据
         :param backup_nums: 筛选条件，只查询指定备份点编号需要同步的对象，
         :param size_gte: 查询object size大于等于size_gte的数据
         :return: list
@@ -311,14 +333,176 @@ class QueryHandler:
 
         query_hand = QueryHandler()
         sql = query_hand.get_need_async_objects_query_sql(
-            bucket_id=bucket_id, id_gt=id_gt, limit=limit, meet_time=meet_time, id_mod_div=id_mod_div,
-            id_mod_equal=id_mod_equal, backup_nums=backup_nums, size_gte=size_gte
+            bucket_id=bucket_id, id_gt=id_gt, limit=limit, meet_time=meet_time, id_gte=id_gte,
+            id_lt=id_lt, backup_nums=backup_nums, size_gte=size_gte
         )
         return self.select_all(using=METADATA, sql=sql)
 
     def get_meet_time(self):
         return datetime.utcnow() - timedelta(minutes=self.MEET_ASYNC_TIMEDELTA_MINUTES)
 
+    def get_objects_by_ids(self, bucket_id, ids: list):
+        """
+        批量获取对象
+
+        :return: list
+        """
+        if not ids:
+            return []
+
+        table_name = self._bucket_table_name(bucket_id)
+        tc = table_columns(table_name=table_name)
+        fields_sql = self._object_fields_sql(table_name=table_name)
+        in_ids = ', '.join([str(int(i)) for i in ids])
+        sql = f"SELECT {fields_sql} FROM {quote_name(table_name)} WHERE {tc('fod')} AND {tc('id')} IN ({in_ids})"
+        return self.select_all(using=METADATA, sql=sql)
+
+    def get_object_by_key(self, bucket_id, object_key: str):
+        """
+        :return:
+            dict or None
+        """
+        table_name = self._bucket_table_name(bucket_id)
+        tc = table_columns(table_name=table_name)
+        sql = f"SELECT {tc('id')}, {tc('fod')} FROM {quote_name(table_name)} " \
+              f"WHERE {tc('na_md5')} = %s AND {tc('na')} = %s LIMIT 1"
+        na_md5 = hashlib.md5(object_key.encode(encoding='utf-8')).hexdigest()
+        return self.select_one(using=METADATA, sql=sql, params=[na_md5, object_key])
+
+    def get_bucket_changes(self, bucket_id, seq_gt: int, before_time, limit: int = 1000,
+                           obj_id_gte: int = None, obj_id_lt: int = None):
+        """
+        按序号顺序获取桶的对象变更日志
+
+        :param seq_gt: 获取序号大于seq_gt的日志
+        :param before_time: 只获取此时间之前的日志
+        :param obj_id_gte: 只获取对象id大于等于obj_id_gte的日志，和obj_id_lt一起限定分片的id范围
+        :param obj_id_lt: 只获取对象id小于obj_id_lt的日志
+        :return: list
+        """
+        where = "`bucket_id` = %s AND `id` > %s AND `create_time` < %s"
+        params = [bucket_id, seq_gt, db_datetime_str(before_time)]
+        if obj_id_gte is not None:
+            where += " AND `obj_id` >= %s"
+            params.append(obj_id_gte)
+        if obj_id_lt is not None:
+            where += " AND `obj_id` < %s"
+            params.append(obj_id_lt)
+
+        sql = f"SELECT `id`, `obj_id`, `obj_key`, `action` FROM `object_change_log` " \
+              f"WHERE {where} ORDER BY `id` ASC LIMIT %s"
+        params.append(limit)
+        return self.select_all(using=METADATA, sql=sql, params=params)
+
+    def append_change_log(self, bucket_id, obj_id, object_key: str, action: int = ChangeAction.PUT):
+        sql = "INSERT INTO `object_change_log` (`bucket_id`, `obj_id`, `obj_key`, `action`, `create_time`) " \
+              "VALUES (%s, %s, %s, %s, %s)"
+        return self.update(using=METADATA, sql=sql,
+                           params=[bucket_id, obj_id, object_key, action, db_datetime_str(timezone_now())])
+
+    def get_changelog_checkpoint(self, consumer: str, bucket_id):
+        """
+        :return: int    # 消费者在桶上已消费的日志序号
+        """
+        sql = "SELECT `seq` FROM `change_log_checkpoint` WHERE `consumer` = %s AND `bucket_id` = %s"
+        r = self.select_one(using=METADATA, sql=sql, params=[consumer, bucket_id])
+        return r['seq'] if r else 0
+
+    def update_changelog_checkpoint(self, consumer: str, bucket_id, seq: int):
+        now_str = db_datetime_str(timezone_now())
+        sql = "INSERT INTO `change_log_checkpoint` (`consumer`, `bucket_id`, `seq`, `modified_time`) " \
+              "VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE `seq` = VALUES(`seq`), " \
+              "`modified_time` = VALUES(`modified_time`)"
+        return self.update(using=METADATA, sql=sql, params=[consumer, bucket_id, seq, now_str])
+
+    def get_bucket_max_object_id(self, bucket_id):
+        """
+        :return: int    # 桶内最大的对象id，空桶返回0
+        """
+        table_name = self._bucket_table_name(bucket_id)
+        tc = table_columns(table_name=table_name)
+        sql = f"SELECT MAX({tc('id')}) AS `max_id` FROM {quote_name(table_name)}"
+        r = self.select_one(using=METADATA, sql=sql)
+        return (r['max_id'] or 0) if r else 0
+
+    def heartbeat_async_worker(self, name: str, heartbeat_time):
+        sql = "INSERT INTO `async_worker_node` (`name`, `heartbeat_time`) VALUES (%s, %s) " \
+              "ON DUPLICATE KEY UPDATE `heartbeat_time` = VALUES(`heartbeat_time`)"
+        return self.update(using=METADATA, sql=sql, params=[name, db_datetime_str(heartbeat_time)])
+
+    def remove_async_worker(self, name: str):
+        sql = "DELETE FROM `async_worker_node` WHERE `name` = %s"
+        return self.update(using=METADATA, sql=sql, params=[name])
+
+    def get_live_async_worker_count(self, alive_after):
+        """
+        :return: int    # 心跳时间晚于alive_after的工作节点数
+        """
+        sql = "SELECT COUNT(*) AS `count` FROM `async_worker_node` WHERE `heartbeat_time` >= %s"
+        r = self.select_one(using=METADATA, sql=sql, params=[db_datetime_str(alive_after)])
+        return r['count'] if r else 0
+
+    def get_bucket_shards(self, bucket_id, backup_num: int):
+        """
+        桶的备份点的所有分片租约，按id范围排序
+
+        :return: list
+        """
+        sql = "SELECT `id`, `bucket_id`, `backup_num`, `id_start`, `id_end`, `owner`, `lease_expire` " \
+              "FROM `async_shard_lease` WHERE `bucket_id` = %s AND `backup_num` = %s ORDER BY `id_start` ASC"
+        return self.select_all(using=METADATA, sql=sql, params=[bucket_id, backup_num])
+
+    def create_bucket_shards(self, bucket_id, backup_num: int, ranges: list):
+        """
+        创建分片，已存在的忽略
+
+        :param ranges: [(id_start, id_end), ]
+        """
+        if not ranges:
+            return 0
+
+        values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(ranges))
+        params = []
+        for id_start, id_end in ranges:
+            params += [bucket_id, backup_num, id_start, id_end, '']
+
+        sql = f"INSERT IGNORE INTO `async_shard_lease` (`bucket_id`, `backup_num`, `id_start`, `id_end`, `owner`) " \
+              f"VALUES {values}"
+        return self.update(using=METADATA, sql=sql, params=params)
+
+    def claim_shard(self, shard_id, owner: str, lease_expire, now):
+        """
+        领取未被领取、租约已过期或自己持有的分片
+
+        :return: int    # 1(领取成功)，0(被其他节点持有)
+        """
+        sql = "UPDATE `async_shard_lease` SET `owner` = %s, `lease_expire` = %s WHERE `id` = %s AND " \
+              "(`owner` = %s OR `owner` = '' OR `lease_expire` IS NULL OR `lease_expire` < %s)"
+        return self.update(using=METADATA, sql=sql, params=[
+            owner, db_datetime_str(lease_expire), shard_id, owner, db_datetime_str(now)])
+
+    def renew_shards(self, shard_ids: list, owner: str, lease_expire):
+        """
+        续约自己持有的分片
+
+        :return: int    # 续约成功的分片数
+        """
+        if not shard_ids:
+            return 0
+
+        in_ids = ', '.join([str(int(i)) for i in shard_ids])
+        sql = f"UPDATE `async_shard_lease` SET `lease_expire` = %s WHERE `owner` = %s AND `id` IN ({in_ids})"
+        return self.update(using=METADATA, sql=sql, params=[db_datetime_str(lease_expire), owner])
+
+    def release_shards(self, shard_ids: list, owner: str):
+        if not shard_ids:
+            return 0
+
+        in_ids = ', '.join([str(int(i)) for i in shard_ids])
+        sql = f"UPDATE `async_shard_lease` SET `owner` = '', `lease_expire` = NULL " \
+              f"WHERE `owner` = %s AND `id` IN ({in_ids})"
+        return self.update(using=METADATA, sql=sql, params=[owner])
+
     def update_object_sync_end_time(self, bucket_id, obj_id, async_time, backup_num):
         """
         备份完成后 sync_end 字段更新
@@ -4,8 +4,9 @@ import threading
 import random
 
 from .managers import AsyncBucketManager
-from .querys import QueryHandler, BackupNum
-from .databases import CanNotConnection
+from .querys import QueryHandler, BackupNum, ChangeAction
+from .databases import CanNotConnection, connections
+from .leases import ShardLeaseManager
 
 
 def get_hostname():
@@ -22,17 +23,19 @@ class AsyncTask:
     def __init__(self, node_num: int = None, node_count: int = 100,
                  in_multi_thread: bool = False, max_threads: int = 10,
                  test: bool = False, logger=None, buckets: list = None,
-                 small_size_first: bool = False
+                 small_size_first: bool = False, changelog: bool = False, lease: bool = False
                  ):
         """
         :param node_num: 当前工作节点编号，不指定尝试从hostname获取
-        :param node_count: 一共多少个节点，用于id求余，只同步 余数 == node_num的对象
+        :param node_count: 一共多少个节点，用于id求余，只同步 余数 == node_num的对象；lease模式不使用
         :param in_multi_thread: True(开启多线程模式)， False(单线程)
         :param max_threads: 多线程工作模式时，最大线程数
         :param test: 不同步对象，打印一些参数
         :param logger:
         :param buckets: 只同步指定桶
         :param small_size_first: True(对象小的先同步)
+        :param changelog: True(按对象变更日志同步，不扫描桶表)
+        :param lease: True(领取分片租约，只同步租约id范围内的对象，节点数量不固定)
         """
         if logger is None:
             raise ValueError(f"No logger config")
@@ -45,6 +48,8 @@ class AsyncTask:
         self.node_num = node_num
         self.buckets = buckets
         self.small_size_first = small_size_first
+        self.changelog = changelog
+        self.lease = lease
 
         try:
             self.validate_params()
@@ -52,7 +57,11 @@ class AsyncTask:
             self.logger.error(str(e))
             exit(1)     # exit error
 
+        self.lease_manager = ShardLeaseManager() if self.lease else None
         self.pool_sem = threading.Semaphore(self.max_threads)  # 定义最多同时启用多少个线程
+        if self.in_multi_thread:    # 每个线程同时最多使用一个连接，加上主线程
+            connections.set_pool_max_size(max(connections.pool_max_size, self.max_threads + 1))
+
         self.in_exiting = False         # 多线程时标记是否正在退出
         self.hostname = get_hostname()
 
@@ -61,7 +70,13 @@ class AsyncTask:
         :raises: ValueError
         """
         if self.node_num is None:
-            self.node_num = self.get_current_node_num_from_hostname()
+            try:
+                self.node_num = self.get_current_node_num_from_hostname()
+            except ValueError as e:
+                if not self.lease:      # lease模式节点编号只用于记录同步错误
+                    raise e
+
+                self.node_num = 1
 
         if not isinstance(self.node_num, int):
             raise ValueError(f"Invalid node_num {self.node_num}")
@@ -72,7 +87,7 @@ class AsyncTask:
         if self.node_count <= 0:
             raise ValueError(f'node_count({self.node_count}) must be greater than 0')
 
-        if self.node_num > self.node_count:
+        if self.node_num > self.node_count and not self.lease:
             raise ValueError(f'node_num({self.node_num}) cannot be greater than node_count({self.node_count})')
 
         if not isinstance(self.max_threads, int):
@@ -87,7 +102,10 @@ class AsyncTask:
         else:
             mode_str = 'Will Starting in mode single-threading'
 
-        self.logger.warning(f'{mode_str}, node_num={self.node_num}, node_count={self.node_count}')
+        if self.lease_manager is not None:
+            self.logger.warning(f'{mode_str}, shard lease mode, node name={self.lease_manager.name}')
+        else:
+            self.logger.warning(f'{mode_str}, node_num={self.node_num}, node_count={self.node_count}')
         if self.buckets:
             self.logger.warning(f'Only async buckets: {self.buckets}')
 
@@ -97,6 +115,9 @@ class AsyncTask:
         if self.small_size_first:
             self.logger.warning('Small object size first.')
 
+        if self.changelog:
+            self.logger.warning('Async by object change log.')
+
         while True:
             try:
                 for num in [1, 2]:
@@ -125,6 +146,12 @@ class AsyncTask:
                         break
             break
 
+        if self.lease_manager is not None:
+            try:
+                self.lease_manager.leave()
+            except Exception as e:
+                self.logger.error(f'Error, remove async worker node {self.lease_manager.name}, {str(e)}')
+
         self.logger.warning('Exit')
 
     @staticmethod
@@ -143,7 +170,10 @@ class AsyncTask:
 
         return host_node_num
 
-    def is_object_should_be_handled_by_me(self, object_id: int):
+    def is_object_should_be_handled_by_me(self, object_id: int, shard: dict = None):
+        if shard is not None:
+            return shard['id_start'] <= object_id < shard['id_end']
+
         yu = object_id % self.node_count
         if yu == 0:
             yu = self.node_count
@@ -176,7 +206,7 @@ class AsyncTask:
                         if self.in_multi_thread:
                             self.create_async_bucket_thread(bucket=bucket, backup=backup)
                         else:
-                            self.async_one_bucket(bucket=bucket, backup=backup)
+                            self.async_bucket(bucket=bucket, backup=backup)
 
                     last_bucket_id = bucket_id
                     error_count = 0
@@ -209,18 +239,60 @@ class AsyncTask:
 
     def thread_async_one_bucket(self, bucket: dict, last_object_id: int = 0, limit: int = 100, backup: dict = None):
         try:
-            self.async_one_bucket(bucket=bucket, last_object_id=last_object_id, limit=limit, backup=backup)
+            self.async_bucket(bucket=bucket, last_object_id=last_object_id, limit=limit, backup=backup)
         except Exception as e:
             self.in_exiting = True
         finally:
             self.pool_sem.release()  # 可用线程数+1
 
-    def async_one_bucket(self, bucket: dict, last_object_id: int = 0, limit: int = 100, backup: dict = None):
+    def async_bucket(self, bucket: dict, backup: dict, last_object_id: int = 0, limit: int = 100):
+        """
+        按工作模式同步桶的一个备份点
+        """
+        if self.lease_manager is not None:
+            self.async_bucket_shards(bucket=bucket, backup=backup, limit=limit)
+        elif self.changelog:
+            self.async_one_bucket_changes(bucket=bucket, backup=backup)
+        else:
+            self.async_one_bucket(bucket=bucket, last_object_id=last_object_id, limit=limit, backup=backup)
+
+    def async_bucket_shards(self, bucket: dict, backup: dict, limit: int = 100):
+        """
+        领取桶的备份点的分片租约，只同步领取到的分片id范围内的对象，完成后释放租约
+        """
+        backup_num = backup["backup_num"]
+        bucket_id = bucket["id"]
+        shards = self.lease_manager.acquire_shards(bucket_id=bucket_id, backup_num=backup_num)
+        if not shards:
+            self.logger.debug(f'No free shard of Bucket(id={bucket_id}, name={bucket["name"]}), '
+                              f'Backup number {backup_num}.')
+            return
+
+        try:
+            for shard in shards:
+                if self.in_exiting:
+                    break
+
+                self.logger.debug(f'Start async shard [{shard["id_start"]}, {shard["id_end"]}) '
+                                  f'of Bucket(id={bucket_id}), Backup number {backup_num}.')
+                if self.changelog:
+                    self.async_one_bucket_changes(bucket=bucket, backup=backup, shard=shard)
+                else:
+                    self.async_one_bucket(bucket=bucket, limit=limit, backup=backup, shard=shard)
+        finally:
+            try:
+                self.lease_manager.release_shards(shards)
+            except Exception as e:
+                self.logger.error(f'Error, release shards of Bucket(id={bucket_id}), {str(e)}')
+
+    def async_one_bucket(self, bucket: dict, last_object_id: int = 0, limit: int = 100, backup: dict = None,
+                         shard: dict = None):
         """
         :param bucket: Bucket instance
         :param last_object_id: 同步id大于last_object_id的对象
         :param limit: select objects number per times
         :param backup: 要同步的备份点
+        :param shard: 领取的分片租约，只同步分片id范围内的对象
         """
         backup_num = backup["backup_num"]
         bucket_id = bucket["id"]
@@ -232,11 +304,23 @@ class AsyncTask:
         query_hand = QueryHandler()
         last_object_id = last_object_id
         last_object_size = 0
+        range_kwargs = {}
+        if shard is not None:
+            last_object_id = max(last_object_id, shard['id_start'] - 1)
+            range_kwargs['id_lt'] = shard['id_end']
+            if self.small_size_first:
+                range_kwargs['id_gte'] = shard['id_start']
+
         while True:
             try:
                 if self.in_exiting:     # 退出中
                     break
 
+                if shard is not None and not self.lease_manager.keep_alive(shard):
+                    self.logger.warning(f'Lost lease of shard [{shard["id_start"]}, {shard["id_end"]}) '
+                                        f'of Bucket(id={bucket_id}, name={bucket_name}).')
+                    break
+
                 backup = query_hand.get_bucket_backup(bucket_id=bucket_id, backup_num=backup_num)
                 if backup is None:
                     raise Exception(f'Bucket backup number {backup_num} not exists')
@@ -249,14 +333,14 @@ class AsyncTask:
                     kwargs = {'id_gt': last_object_id}
                 objs = query_hand.get_need_async_objects(
                     bucket_id=bucket_id, limit=limit,
-                    backup_nums=[backup_num, ], **kwargs
+                    backup_nums=[backup_num, ], **kwargs, **range_kwargs
                 )
                 if len(objs) == 0:
                     break
 
                 ok_num, l_id, l_size, err = self.handle_async_objects(bucket=bucket, objs=objs, backup=backup,
                                                                       can_not_connection=can_not_connection,
-                                                                      failed_count=failed_count)
+                                                                      failed_count=failed_count, shard=shard)
                 ok_count += ok_num
                 if l_id is not None:
                     last_object_id = l_id
@@ -294,7 +378,8 @@ class AsyncTask:
         self.logger.debug(f'Exit async Bucket(id={bucket_id}, name={bucket_name}), Backup number {backup_num}, '
                           f'ok {ok_count}, failed {failed_count}.')
 
-    def handle_async_objects(self, bucket, objs: list, backup: dict, can_not_connection: int, failed_count: int):
+    def handle_async_objects(self, bucket, objs: list, backup: dict, can_not_connection: int, failed_count: int,
+                             shard: dict = None):
         """
         :return:
             (
@@ -311,8 +396,11 @@ class AsyncTask:
             if self.in_exiting:
                 break
 
+            if shard is not None and not self.lease_manager.keep_alive(shard):
+                break
+
             obj_id = obj['id']
-            if self.is_object_should_be_handled_by_me(obj_id):
+            if self.is_object_should_be_handled_by_me(obj_id, shard=shard):
                 if self.is_meet_async_to_backup(obj=obj, backup=backup):
                     r = self.async_one_object(bucket=bucket, obj=obj, backup=backup)
                     if r is not None:
@@ -327,6 +415,180 @@ class AsyncTask:
 
         return ok_count, last_object_id, last_object_size, None
 
+    def get_changelog_consumer(self, backup_num: int, shard: dict = None):
+        """
+        变更日志消费者名称，每个节点的每个备份点各自记录消费进度；
+        lease模式每个分片记录消费进度，分片被其他节点领取后从分片的检查点继续消费
+        """
+        if shard is not None:
+            return f'async_shard_{shard["id"]}'
+
+        return f'async_worker_{self.node_num}_{self.node_count}_{backup_num}'
+
+    def async_one_bucket_changes(self, bucket: dict, backup: dict, limit: int = 1000, shard: dict = None):
+        """
+        按对象变更日志同步一个桶，从检查点之后的日志开始消费，每批日志处理后更新检查点
+
+        :param bucket: Bucket instance
+        :param backup: 要同步的备份点
+        :param limit: select change logs number per times
+        :param shard: 领取的分片租约，只消费分片id范围内对象的日志
+        """
+        backup_num = backup["backup_num"]
+        bucket_id = bucket["id"]
+        bucket_name = bucket["name"]
+        consumer = self.get_changelog_consumer(backup_num=backup_num, shard=shard)
+        range_kwargs = {}
+        if shard is not None:
+            range_kwargs = {'obj_id_gte': shard['id_start'], 'obj_id_lt': shard['id_end']}
+
+        self.logger.debug(f'Start async changes of Bucket(id={bucket_id}, name={bucket_name}), '
+                          f'Backup number {backup_num}.')
+        can_not_connection = 0
+        failed_count = 0
+        ok_count = 0
+        query_hand = QueryHandler()
+        while True:
+            try:
+                if self.in_exiting:     # 退出中
+                    break
+
+                if shard is not None and not self.lease_manager.keep_alive(shard):
+                    self.logger.warning(f'Lost lease of shard [{shard["id_start"]}, {shard["id_end"]}) '
+                                        f'of Bucket(id={bucket_id}, name={bucket_name}).')
+                    break
+
+                backup = query_hand.get_bucket_backup(bucket_id=bucket_id, backup_num=backup_num)
+                if backup is None:
+                    raise Exception(f'Bucket backup number {backup_num} not exists')
+                elif backup['status'] != 'start':
+                    raise Exception(f'Bucket backup number {backup_num} not start')
+
+                seq = query_hand.get_changelog_checkpoint(consumer=consumer, bucket_id=bucket_id)
+                meet_time = query_hand.get_meet_time()
+                changes = query_hand.get_bucket_changes(bucket_id=bucket_id, seq_gt=seq,
+                                                        before_time=meet_time, limit=limit, **range_kwargs)
+                if len(changes) == 0:
+                    break
+
+                ok_num, done_seq, err = self.handle_changes(bucket=bucket, changes=changes, backup=backup,
+                                                            meet_time=meet_time,
+                                                            can_not_connection=can_not_connection,
+                                                            failed_count=failed_count, shard=shard)
+                ok_count += ok_num
+                if done_seq is not None and done_seq > seq:
+                    query_hand.update_changelog_checkpoint(consumer=consumer, bucket_id=bucket_id, seq=done_seq)
+                if err is not None:
+                    raise err
+                if len(changes) < limit:
+                    break
+
+                can_not_connection = max(can_not_connection - 1, 0)
+            except CanNotConnection as exc:
+                can_not_connection += 1
+                if can_not_connection > 6:
+                    self.in_exiting = True
+                    break
+
+                self.logger.error(f"Error, async changes of Bucket(id={bucket_id}, name={bucket_name}), "
+                                  f"CanNotConnection db, sleep {can_not_connection} s,{str(exc)}")
+                time.sleep(can_not_connection)
+            except Exception as err:
+                failed_count += 1
+                if failed_count > 6:
+                    self.in_exiting = True
+                    break
+
+                self.logger.error(f"Error, async_bucket_changes,{str(err)}")
+                continue
+
+        self.logger.debug(f'Exit async changes of Bucket(id={bucket_id}, name={bucket_name}), '
+                          f'Backup number {backup_num}, ok {ok_count}, failed {failed_count}.')
+
+    def handle_changes(self, bucket, changes: list, backup: dict, meet_time,
+                       can_not_connection: int, failed_count: int, shard: dict = None):
+        """
+        处理一批变更日志，同一个对象key的多条日志只处理最后一条
+
+        :return:
+            (
+                int         # 成功同步对象数
+                done_seq,   # int or None, 已处理完成的日志序号，之前的日志都已处理
+                error       # None or Exception, AsyncError, CanNotConnection
+            )
+        """
+        last = {}
+        for c in changes:
+            last[c['obj_key']] = c
+
+        items = sorted(last.values(), key=lambda c: c['id'])
+        query_hand = QueryHandler()
+        bucket_id = bucket['id']
+        put_ids = [c['obj_id'] for c in items if c['action'] == ChangeAction.PUT and
+                   self.is_object_should_be_handled_by_me(c['obj_id'], shard=shard)]
+        objs = {o['id']: o for o in query_hand.get_objects_by_ids(bucket_id=bucket_id, ids=put_ids)}
+
+        ok_count = 0
+        done_seq = None
+        for c in items:
+            if self.in_exiting or (shard is not None and not self.lease_manager.keep_alive(shard)):
+                return ok_count, done_seq, None
+
+            obj_id = c['obj_id']
+            object_key = c['obj_key']
+            if not self.is_object_should_be_handled_by_me(obj_id, shard=shard):
+                done_seq = c['id']
+                continue
+
+            if c['action'] == ChangeAction.DELETE:
+                r = self.async_delete_one_object(bucket=bucket, object_key=object_key, backup=backup)
+                if r is not None:
+                    return ok_count, c['id'] - 1, r
+
+                ok_count += 1
+            else:
+                obj = objs.get(obj_id)
+                if obj is not None and obj['na'] == object_key:     # 对象已删除或重命名时，之后有对应的日志
+                    if obj['upt'] is not None and obj['upt'] >= meet_time:  # 对象仍在修改中，重新追加日志稍后再同步
+                        query_hand.append_change_log(bucket_id=bucket_id, obj_id=obj_id, object_key=object_key)
+                    elif self.is_meet_async_to_backup(obj=obj, backup=backup):
+                        r = self.async_one_object(bucket=bucket, obj=obj, backup=backup)
+                        if r is not None:
+                            self.record_async_error(bucket=bucket, obj=obj, backup=backup, error=str(r),
+                                                    can_not_connection=can_not_connection, failed_count=failed_count)
+                            return ok_count, c['id'] - 1, r
+
+                        ok_count += 1
+
+            done_seq = c['id']
+
+        return ok_count, changes[-1]['id'], None
+
+    def async_delete_one_object(self, bucket: dict, object_key: str, backup: dict):
+        """
+        同步删除一个对象，对象已存在(删除后又上传了同名对象)时不删除
+
+        :return:
+            None    # success
+            Error   # failed Exception, AsyncError, CanNotConnection
+        """
+        backup_num = backup['backup_num']
+        msg = f"backup num {backup_num}, [bucket(id={bucket['id']}, name={bucket['name']})],[object(key={object_key})];"
+        try:
+            if QueryHandler().get_object_by_key(bucket_id=bucket['id'], object_key=object_key) is not None:
+                return None
+
+            if self.test:
+                self.logger.debug(f"Test async delete {msg}")
+            else:
+                AsyncBucketManager().async_delete_object(bucket=bucket, object_key=object_key, backup=backup)
+        except Exception as e:
+            self.logger.error(f"Failed Async delete, {msg}, {str(e)}")
+            return e
+
+        self.logger.debug(f"OK Async delete, {msg}")
+        return None
+
     def async_one_object(self, bucket: dict, obj: dict, backup: dict):
         """
         :return:
@@ -460,9 +722,9 @@ class AsyncTask:
                 break
 
     def test_working_multi_thread(self):
-        from .databases import db_readwrite_lock, DEFAULT, METADATA
+        from .databases import db_connection, DEFAULT, METADATA
 
-        @db_readwrite_lock
+        @db_connection
         def test_do_something(seconds: int, using):
             print(f'using {using}')
             time.sleep(seconds)
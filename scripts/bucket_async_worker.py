@@ -45,9 +45,11 @@ PARAM_STOP = 'stop'
 PARAM_STATUS = 'status'
 PARAM_BUCKETS = 'buckets'
 PARAM_SMALL_SIZE_FIRST = 'small-size-first'
+PARAM_CHANGELOG = 'changelog'
+PARAM_LEASE = 'lease'
 PARAM_NAME_LIST = [
     PARAM_DEBUG, PARAM_HELP, PARAM_TEST, PARAM_NODE_NUM, PARAM_NODE_COUNT, PARAM_MULTI_THREAD, PARAM_MAX_THREADS,
-    PARAM_STOP, PARAM_STATUS, PARAM_BUCKETS, PARAM_SMALL_SIZE_FIRST
+    PARAM_STOP, PARAM_STATUS, PARAM_BUCKETS, PARAM_SMALL_SIZE_FIRST, PARAM_CHANGELOG, PARAM_LEASE
 ]
 
 
@@ -67,6 +69,8 @@ def print_help():
     {PARAM_STATUS}:         Is it running
     {PARAM_BUCKETS}:        Only bucket to async, '["name1","name2"]'
     {PARAM_SMALL_SIZE_FIRST}:Objects with small sizes are synchronized first.
+    {PARAM_CHANGELOG}:      Async objects by the object change log instead of scanning bucket tables, No value is required.
+    {PARAM_LEASE}:          Claim object id range shards by lease instead of {PARAM_NODE_NUM} and {PARAM_NODE_COUNT}, nodes can join or leave at any time, No value is required.
     
     * daemon mode run cmd:
         nohup cmd >/dev/null 2>&1 &
@@ -288,6 +292,12 @@ def main():
     if PARAM_SMALL_SIZE_FIRST in params:
         kwargs['small_size_first'] = True
 
+    if PARAM_CHANGELOG in params:
+        kwargs['changelog'] = True
+
+    if PARAM_LEASE in params:
+        kwargs['lease'] = True
+
     try:
         check_same_task_run()
     except Exception as e:
@@ -1,5 +1,7 @@
 broker_url = 'amqp://guest@localhost//'
-task_acks_late = False  # 接受消息后立即确认，防止同一任务同时执行
+# 任务执行完成后确认消息，worker进程被杀死时消息重新入队，同步任务可以重复执行
+task_acks_late = True
+task_reject_on_worker_lost = True
 worker_prefetch_multiplier = 1  # 设置预取数量为1
 task_serializer = 'json'
 accept_content = ['json']
@@ -10,4 +12,11 @@ enable_utc = False
 broker_pool_limit = 20
 task_time_limit = 7200  # 软超时时间为2h
 imports = ['syncserver.tasks']
+# 小对象批量同步和大对象同步使用不同的队列，避免大对象传输占满worker，分别启动worker：
+# celery -A syncserver worker -Q sync_small ；celery -A syncserver worker -Q sync_large
+task_routes = {
+    'syncserver.tasks.sync_objects': {'queue': 'sync_small'},
+    'syncserver.tasks.sync_delete_object': {'queue': 'sync_small'},
+    'syncserver.tasks.sync_object': {'queue': 'sync_large'},
+}
 task_ignore_result = True
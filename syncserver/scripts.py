@@ -9,12 +9,90 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # 设置项目的配置文件 不做修改的话就是 settings 文件
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webserver.settings")
 django.setup()
-from syncserver.tasks import sync_object
+from syncserver.tasks import sync_object, sync_objects, sync_delete_object
 from syncserver.ratelimit import RabbitMQTool
 from api.backup import AsyncBucketManager
+from buckets.changelog import change_log
 
 manager = AsyncBucketManager()
-controller = RabbitMQTool(host='http://localhost:15672', queue='celery', user='guest', passwd='guest')
+controllers = [
+    RabbitMQTool(host='http://localhost:15672', queue=queue, user='guest', passwd='guest')
+    for queue in ['sync_small', 'sync_large']
+]
+CHANGELOG_CONSUMER = 'celery'
+SMALL_OBJECT_SIZE = 256 * 1024 ** 2     # 不大于此大小的对象批量同步
+BATCH_SIZE = 100                        # 每个批量同步任务的对象数量
+
+
+def wait_queues():
+    time.sleep(max([c.refresh() for c in controllers]))
+
+
+class BatchSubmitter:
+    """
+    按桶提交同步任务，小对象攒够BATCH_SIZE个提交一个批量任务，大对象单独提交任务
+    """
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.batch = []
+        self.count = 0
+
+    def add(self, object_id, object_key: str, size: int):
+        self.count += 1
+        if size is not None and size > SMALL_OBJECT_SIZE:
+            sync_object.delay(self.bucket.id, object_id, self.bucket.name, object_key)
+            return
+
+        self.batch.append([object_id, object_key])
+        if len(self.batch) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            sync_objects.delay(self.bucket.id, self.bucket.name, self.batch)
+            self.batch = []
+
+
+def main_changelog():
+    """
+    按对象变更日志向队列提交同步任务，每提交一批日志更新一次检查点；
+    任务失败时重新追加变更日志，下次运行时重试；开启备份之前桶内已有的对象需要全量扫描同步(main)
+    """
+    _item = 0
+    bucket_id = 0
+    while True:
+        try:
+            buckets = manager.get_need_async_bucket_queryset(bucket_id)
+        except Exception as err:
+            print("bucket sync error! bucket: {} with {}".format(bucket_id, err))
+            break
+        if not buckets:
+            break
+        for bucket in tqdm(buckets, desc="buckets from: {}".format(buckets[0].id)):
+            bucket_id = bucket.id
+            while True:
+                try:
+                    seq = change_log.get_checkpoint(consumer=CHANGELOG_CONSUMER, bucket_id=bucket.id)
+                    changes = change_log.get_changes(bucket_id=bucket.id, seq_gt=seq,
+                                                     before_time=manager.get_meet_time())
+                    if not changes:
+                        break
+                    wait_queues()
+                    changes = change_log.merge_changes(changes)
+                    sizes = manager.get_objects_size(bucket, [c.obj_id for c in changes if not c.is_delete()])
+                    submitter = BatchSubmitter(bucket)
+                    for c in tqdm(changes, desc="bucket: {}".format(bucket.id), leave=False):
+                        _item += 1
+                        if c.is_delete():
+                            sync_delete_object.delay(bucket.id, bucket.name, c.obj_key, c.obj_id)
+                        elif c.obj_id in sizes:     # 对象已删除时，之后有对应的删除日志
+                            submitter.add(c.obj_id, c.obj_key, sizes[c.obj_id])
+                    submitter.flush()
+                    change_log.set_checkpoint(consumer=CHANGELOG_CONSUMER, bucket_id=bucket.id, seq=changes[-1].id)
+                except Exception as err:
+                    print("change log sync error! bucket: {} with {}".format(bucket.id, err))
+                    break
+    return _item
 
 
 def main():
@@ -33,13 +111,15 @@ def main():
                 while True:
                     try:
                         objs = manager.get_need_async_objects_queryset(bucket, obj_id)
-                        time.sleep(controller.refresh())
+                        wait_queues()
                         if not objs:
                             break
+                        submitter = BatchSubmitter(bucket)
                         for obj in tqdm(objs, desc="bucket: {}".format(str(bucket.id)), leave=False):
                             obj_id = obj.id
                             _item += 1
-                            sync_object.delay(bucket.id, obj.id, bucket.name, obj.na)
+                            submitter.add(obj.id, obj.na, obj.si)
+                        submitter.flush()
                     except Exception as err:
                         if last_obj_id != obj_id:
                             last_obj_id = obj_id
@@ -59,5 +139,8 @@ def main():
 
 if __name__ == '__main__':
     s = time.perf_counter()
-    item = main()
+    if 'changelog' in sys.argv[1:]:     # 按变更日志增量同步
+        item = main_changelog()
+    else:                               # 扫描桶表全量同步
+        item = main()
     print("Done, spend time: {}, total items: {}".format(round(time.perf_counter() - s, 2), item))
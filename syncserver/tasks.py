@@ -40,13 +40,87 @@ class BaseTask(Task):
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         logger.error('args:{}|einfo:{}|exc:{}'.format(args, einfo, exc))
+        self.relog(args)
+
+    def relog(self, args):
+        """
+        同步失败的对象重新追加变更日志，变更日志检查点在提交任务后就已前移
+        """
+        pass
+
+    @staticmethod
+    def relog_changes(bucket_id, bucket_name: str, put: list = None, deleted: list = None):
+        try:
+            manager.relog_changes(bucket_id, bucket_name, put=put, deleted=deleted)
+        except Exception as e:
+            logger.error('relog failed|bucket:{}|put:{}|deleted:{}|exc:{}'.format(bucket_id, put, deleted, e))
+
+
+class ObjectTask(BaseTask):
+    def relog(self, args):
+        bucket_id, object_id, bucket_name, object_key = args[:4]
+        self.relog_changes(bucket_id, bucket_name, put=[(object_id, object_key)])
+
+
+class DeleteTask(BaseTask):
+    def relog(self, args):
+        bucket_id, bucket_name, object_key = args[:3]
+        object_id = args[3] if len(args) > 3 else 0
+        self.relog_changes(bucket_id, bucket_name, deleted=[(object_id, object_key)])
+
+
+class BatchTask(BaseTask):
+    def on_success(self, retval, task_id, args, kwargs):
+        spend = retval['spend']
+        failed = [r for r in retval['results'] if r[1]]
+        msg = 'bucket:{}|objects:{}|failed:{}|spend:{}'.format(args[0], len(retval['results']), len(failed), spend)
+        if failed:
+            logger.error('{}|errors:{}'.format(msg, failed))
+        elif spend < 60:
+            logger.info(msg)
+        else:
+            logger.warning('slow sync: {}'.format(msg))
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        logger.error('bucket:{}|objects:{}|einfo:{}|exc:{}'.format(args[0], len(args[2]), einfo, exc))
+        self.relog(args)
+
+    def relog(self, args):
+        bucket_id, bucket_name, objects = args[:3]
+        self.relog_changes(bucket_id, bucket_name, put=[tuple(o) for o in objects])
 
 
 @celery_app.task(
     bind=True,
-    base=BaseTask
+    base=ObjectTask
 )
 def sync_object(self, bucket_id, object_id, bucket_name: str, object_key: str):
     start = time.perf_counter()
     manager.async_object(bucket_id, object_id, bucket_name, object_key)
     return round(time.perf_counter() - start, 3)
+
+
+@celery_app.task(
+    bind=True,
+    base=BatchTask
+)
+def sync_objects(self, bucket_id, bucket_name: str, objects: list):
+    """
+    同步一个桶的一批对象
+
+    :param objects: [[object_id, object_key], ]
+    :return: {'spend': 耗时, 'results': [[object_id, error], ]}
+    """
+    start = time.perf_counter()
+    results = manager.async_objects(bucket_id, bucket_name, objects)
+    return {'spend': round(time.perf_counter() - start, 3), 'results': results}
+
+
+@celery_app.task(
+    bind=True,
+    base=DeleteTask
+)
+def sync_delete_object(self, bucket_id, bucket_name: str, object_key: str, object_id=0):
+    start = time.perf_counter()
+    manager.async_delete_object(bucket_id, bucket_name, object_key)
+    return round(time.perf_counter() - start, 3)
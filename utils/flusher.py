@@ -0,0 +1,75 @@
+import logging
+import os
+import threading
+import time
+
+from django.db import close_old_connections
+
+
+logger = logging.getLogger('django.request')
+
+
+class PeriodicFlusher:
+    """
+    后台守护线程定时执行注册的写入函数，进程空闲(没有新的请求触发写入)时内存中待写入的数据也能按时写入数据库；
+
+    * 线程在第一次使用(ensure_started)时启动，fork出的子进程(如uwsgi worker)中重新启动；
+    * 每个写入函数按自己的间隔执行，写入函数自己处理并发(和请求线程中触发的写入同时执行)；
+    """
+    def __init__(self, tick: float = 1):
+        """
+        :param tick: 检查是否到达写入间隔的周期(秒)
+        """
+        self.tick = tick
+        self._funcs = []    # [[func, interval, last_time], ]
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def register(self, func, interval: float):
+        """
+        :param func: 写入函数，func() -> None
+        :param interval: 执行间隔(秒)，<=0时不注册
+        """
+        if interval <= 0:
+            return
+
+        with self._lock:
+            self._funcs.append([func, interval, time.monotonic()])
+
+    def ensure_started(self):
+        """
+        当前进程中后台线程未启动时启动
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid or not self._funcs:
+                return
+
+            self._pid = pid
+            t = threading.Thread(target=self._run, name='periodic-flusher', daemon=True)
+            t.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            now = time.monotonic()
+            with self._lock:
+                due = [item for item in self._funcs if now - item[2] >= item[1]]
+                for item in due:
+                    item[2] = now
+
+            for func, _, _ in due:
+                close_old_connections()
+                try:
+                    func()
+                except Exception as e:
+                    logger.error(f'periodic flush error, {str(e)}')
+
+            if due:
+                close_old_connections()
+
+
+flusher = PeriodicFlusher()
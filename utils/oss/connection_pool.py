@@ -1,8 +1,34 @@
+import errno
 import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import rados
 from webserver import settings as django_settings
-import func_timeout
-from func_timeout import func_set_timeout
+
+
+# librados自身的操作超时(秒)，超时后rados操作抛出rados.TimedOut(rados.Error)；0表示不超时
+RADOS_OSD_OP_TIMEOUT = getattr(django_settings, 'RADOS_OSD_OP_TIMEOUT', 20)
+RADOS_MON_OP_TIMEOUT = getattr(django_settings, 'RADOS_MON_OP_TIMEOUT', 10)
+
+# 表示rados连接已不可用的错误码，单个rados操作的其他错误(对象不存在、写入失败、操作超时等)不使缓存的连接失效
+CONNECTION_ERRNOS = (errno.ESHUTDOWN, errno.ENOTCONN, errno.ECONNRESET, errno.ECONNREFUSED, errno.ECONNABORTED)
+
+# 关闭rados连接(shutdown)可能耗时较长，放到后台常驻线程执行，不阻塞请求线程
+_close_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rados-close')
+
+
+def build_rados_conf(conf: dict = None):
+    """
+    rados连接配置，加入librados操作超时配置
+
+    :param conf: 其他配置项，如keyring
+    :return: dict
+    """
+    c = dict(conf) if conf else {}
+    c.setdefault('rados_osd_op_timeout', str(RADOS_OSD_OP_TIMEOUT))
+    c.setdefault('rados_mon_op_timeout', str(RADOS_MON_OP_TIMEOUT))
+    return c
 
 
 class RadosConnectionPool:
@@ -17,15 +43,15 @@ class RadosConnectionPool:
         self.max_connect_num = getattr(django_settings, 'RADOS_POOL_MAX_CONNECT_NUM', 4)
         self.pool_queue = queue.Queue(maxsize=self.max_connect_num)
 
-    @func_set_timeout(10)
     def create_new_connect(self, user_name, cluster_name, conf_file, conf):
         """
-        创建新的Rados连接
+        创建新的Rados连接，连接的rados操作使用librados的操作超时
 
         :return: Rados()
+        :raises: rados.Error
         """
         rados_conncet = rados.Rados(name=user_name, clustername=cluster_name, conffile=conf_file,
-                                    conf=conf)
+                                    conf=build_rados_conf(conf))
         try:
             rados_conncet.connect(timeout=5)
         except rados.Error as e:
@@ -39,7 +65,7 @@ class RadosConnectionPool:
         获取连接
         :return: Rados()
 
-        :raises: func_timeout.exceptions.FunctionTimedOut
+        :raises: rados.Error
         """
 
         try:
@@ -56,17 +82,12 @@ class RadosConnectionPool:
 
     def put_connection(self, conn):
         """"释放rados连接到队列中"""
-        try:
-            self.release_rados_connect(connect=conn)
-        except func_timeout.exceptions.FunctionTimedOut:
-            pass
+        self.release_rados_connect(connect=conn)
 
     def release_rados_connect(self, connect):
         """
         向队列中添加Rados连接
         :return:Queue() --> Rados().....
-
-        :raises: func_timeout.exceptions.FunctionTimedOut
         """
         try:
             # 队列中没有可以存放的卡槽，直接 full错误
@@ -82,14 +103,18 @@ class RadosConnectionPool:
 
         return True
 
-    @func_set_timeout(10)
+    @staticmethod
+    def _shutdown(conn):
+        try:
+            conn.shutdown()
+        except Exception:
+            pass
+
     def close(self, conn):
         """
-        关闭一个连接
-
-        :raises: func_timeout.exceptions.FunctionTimedOut
+        关闭一个连接，在后台线程中执行，不等待关闭完成
         """
-        conn.shutdown()
+        _close_executor.submit(self._shutdown, conn)
 
     def close_all(self):
         """关闭所有连接"""
@@ -100,8 +125,103 @@ class RadosConnectionPool:
                     self.close(conn=conn)
             except queue.Empty:
                 break
-            except func_timeout.exceptions.FunctionTimedOut:
-                pass
+
+
+class RadosIoctxCache:
+    """
+    rados Ioctx缓存，key为(ceph集群别名, pool name)
+
+    每个ceph集群使用一个独立的rados连接(不放回连接池)，ioctx在uwsgi同一进程的多个线程间共享(librados ioctx是线程安全的)，
+    不需要每次读写都打开和关闭ioctx。连接出错时使缓存失效，被移除的ioctx和连接在不再被引用时由rados自动关闭。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._connections = {}      # {ceph_cluster_alias: Rados()}
+        self._ioctxs = {}           # {(ceph_cluster_alias, pool_name): Ioctx()}
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_ioctx(self, pool: RadosConnectionPool, ceph_cluster_alias, pool_name,
+                  user_name, cluster_name, conf_file, conf):
+        """
+        获取缓存的ioctx，不存在时创建
+
+        :return: rados.Ioctx()
+        :raises: rados.Error
+        """
+        key = (ceph_cluster_alias, pool_name)
+        ioctx = self._ioctxs.get(key, None)
+        if ioctx is not None:
+            self._count(hit=True)
+            return ioctx
+
+        with self._lock:
+            ioctx = self._ioctxs.get(key, None)
+            if ioctx is not None:
+                self._count(hit=True)
+                return ioctx
+
+            self._count(hit=False)
+            conn = self._connections.get(ceph_cluster_alias, None)
+            if conn is None or not pool.connect_state_check(rados_conncet=conn):
+                self._drop(ceph_cluster_alias)
+                conn = pool.create_new_connect(
+                    user_name=user_name, cluster_name=cluster_name, conf_file=conf_file, conf=conf)
+                self._connections[ceph_cluster_alias] = conn
+
+            ioctx = conn.open_ioctx(pool_name)
+            self._ioctxs[key] = ioctx
+            return ioctx
+
+    def _drop(self, ceph_cluster_alias):
+        """移除一个集群的连接和所有ioctx，调用者需持有锁"""
+        self._connections.pop(ceph_cluster_alias, None)
+        for key in [k for k in self._ioctxs if k[0] == ceph_cluster_alias]:
+            self._ioctxs.pop(key, None)
+
+    def invalidate(self, ceph_cluster_alias):
+        """使一个集群的连接和ioctx缓存失效"""
+        with self._lock:
+            self._drop(ceph_cluster_alias)
+
+    def is_connection_broken(self, ceph_cluster_alias, error: Exception):
+        """
+        rados操作出错后，判断是否是集群连接不可用导致的
+
+        :param error: rados操作抛出的错误
+        :return: True(连接不可用，需要使缓存失效); False(单个操作的错误)
+        """
+        e_no = getattr(error, 'errno', None)
+        if e_no is not None and abs(e_no) in CONNECTION_ERRNOS:
+            return True
+
+        conn = self._connections.get(ceph_cluster_alias, None)
+        if conn is not None and conn.state != 'connected':
+            return True
+
+        return False
+
+    def invalidate_all(self):
+        with self._lock:
+            self._connections = {}
+            self._ioctxs = {}
+
+    def stats(self):
+        """
+        缓存命中统计
+
+        :return: {'hits': int, 'misses': int, 'size': int}
+        """
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._ioctxs)}
 
 
 class Singleton(type):
@@ -118,6 +238,7 @@ class RadosConnectionPoolManager(metaclass=Singleton):
     """
     def __init__(self):
         self._pools = {}
+        self.ioctx_cache = RadosIoctxCache()
 
     def __del__(self):
         self.close_all()
@@ -134,8 +255,38 @@ class RadosConnectionPoolManager(metaclass=Singleton):
             return pool.get_connection(user_name=user_name, cluster_name=cluster_name, conf_file=conf_file, conf=conf)
         except rados.Error as e:
             raise rados.Error(e)
-        except func_timeout.exceptions.FunctionTimedOut:
-            raise rados.Error('ceph连接获取超时')
+
+    def ioctx(self, ceph_cluster_alias, pool_name, user_name, cluster_name, conf_file, conf):
+        """
+        获取缓存的ioctx，不需要关闭
+
+        :return: rados.Ioctx()
+        :raises: rados.Error
+        """
+        pool = self._get_pool(ceph_cluster_alias)
+        try:
+            return self.ioctx_cache.get_ioctx(
+                pool=pool, ceph_cluster_alias=ceph_cluster_alias, pool_name=pool_name,
+                user_name=user_name, cluster_name=cluster_name, conf_file=conf_file, conf=conf)
+        except rados.Error as e:
+            self.ioctx_cache.invalidate(ceph_cluster_alias)
+            raise rados.Error(e)
+
+    def invalidate_ioctx(self, ceph_cluster_alias):
+        """使一个集群的ioctx缓存失效"""
+        self.ioctx_cache.invalidate(ceph_cluster_alias)
+
+    def invalidate_ioctx_if_broken(self, ceph_cluster_alias, error: Exception):
+        """
+        rados操作出错时，只有集群连接不可用才使ioctx缓存失效
+
+        :return: True(已失效); False
+        """
+        if self.ioctx_cache.is_connection_broken(ceph_cluster_alias, error):
+            self.ioctx_cache.invalidate(ceph_cluster_alias)
+            return True
+
+        return False
 
     def put_connection(self, conn, ceph_cluster_alias):
         """释放连接"""
@@ -145,18 +296,17 @@ class RadosConnectionPoolManager(metaclass=Singleton):
     def close(self, conn, ceph_cluster_alias):
         """关闭一个连接"""
         pool = self._get_pool(ceph_cluster_alias)
-        try:
-            pool.close(conn=conn)
-        except func_timeout.exceptions.FunctionTimedOut:
-            pass
+        pool.close(conn=conn)
 
     def close_connect_ceph_cluster(self, ceph_cluster_alias):
         """关闭一个集群连接"""
+        self.ioctx_cache.invalidate(ceph_cluster_alias)
         pool = self._get_pool(ceph_cluster_alias)
         pool.close_all()
 
     def close_all(self):
         """关闭所有连接"""
+        self.ioctx_cache.invalidate_all()
         for alias in self._pools:
             self._get_pool(alias).close_all()
 
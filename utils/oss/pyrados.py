@@ -2,12 +2,15 @@ import os
 import math
 import json
 import datetime
+import errno
+import threading
+from collections import deque
+from contextlib import contextmanager
+
 import pytz
 import rados
 
-from func_timeout import func_set_timeout
-from func_timeout.exceptions import FunctionTimedOut
-
+from webserver import settings as django_settings
 from utils.oss.connection_pool import conn_pool_manager     # 模块import就是单例模式
 
 
@@ -25,6 +28,10 @@ class RadosWriteError(RadosError):
 
 
 MAXSIZE_PER_RADOS_OBJ = 2147483648  # 每个rados object 最大2Gb
+# 读取对象生成器预读(在途+待返回)数据块占用内存的上限，每个读请求独立计算；不足2个数据块时不预读
+READ_AHEAD_MEMORY_BUDGET = getattr(django_settings, 'RADOS_READ_AHEAD_MEMORY_BUDGET', 32 * 1024 ** 2)
+# 复制对象数据时，同时在途的读(和写)数据块数量
+COPY_MAX_IN_FLIGHT = getattr(django_settings, 'RADOS_COPY_MAX_IN_FLIGHT', 4)
 
 
 def build_part_id(obj_id, part_num):
@@ -41,16 +48,27 @@ def build_part_id(obj_id, part_num):
     return f'{obj_id}_{part_num}'
 
 
-def write_part_tasks(obj_id, offset, bytes_len):
+def get_part_size(stripe_unit: int = 0):
     """
-    分析对象写入操作具体写入任务, 即对象part的写入操作
+    对象数据布局对应的每个part(rados对象)的大小
+
+    :param stripe_unit: 对象的条带单元大小; <=0表示旧布局，每个part最大2GB
+    :return: int
+    """
+    if stripe_unit and stripe_unit > 0:
+        return stripe_unit
 
-    注：此函数实现基于下面情况考虑，当不满足以下情况时，请重新实现此函数:
-        由于每个part(rados对象)比较大，每次写入数据相对较小，即写入最多涉及到两个part。
+    return MAXSIZE_PER_RADOS_OBJ
+
+
+def write_part_tasks(obj_id, offset, bytes_len, part_size: int = MAXSIZE_PER_RADOS_OBJ):
+    """
+    分析对象写入操作具体写入任务, 即对象part的写入操作
 
     :param obj_id: 对象id
     :param offset: 数据写入的偏移量
     :param bytes_len: 要写入的bytes数组长度
+    :param part_size: 每个part(rados对象)的大小
     :return:
         [(part_id, offset, slice_start, slice_end), ]
         列表每项为一个元组，依次为涉及到的对象part的id，数据写入part的偏移量，数据切片的前索引，数据切片的后索引;
@@ -58,35 +76,32 @@ def write_part_tasks(obj_id, offset, bytes_len):
     if offset < 0 or bytes_len < 0:
         raise ValueError('“offset”和“rd_wr_size”不能小于0')
 
-    if bytes_len > MAXSIZE_PER_RADOS_OBJ:
-        raise ValueError('写入或读取长度不能大于一个rados对象的最大长度')
-
-    start_part_num = int(offset / MAXSIZE_PER_RADOS_OBJ)
-    end_part_num = int(math.ceil((offset + bytes_len) / MAXSIZE_PER_RADOS_OBJ)) - 1  # 向上取整数-1
-    start_part_offset = offset % MAXSIZE_PER_RADOS_OBJ
+    if part_size <= 0:
+        raise ValueError('“part_size”必须大于0')
 
-    # 要写入的数据在1个part上
-    if start_part_num == end_part_num:
-        part_id = build_part_id(obj_id=obj_id, part_num=start_part_num)
-        return [(part_id, start_part_offset, 0, bytes_len)]
+    tasks = []
+    start = 0
+    while start < bytes_len:
+        part_num, part_offset = divmod(offset + start, part_size)
+        end = min(bytes_len, start + part_size - part_offset)
+        part_id = build_part_id(obj_id=obj_id, part_num=part_num)
+        tasks.append((part_id, part_offset, start, end))
+        start = end
 
-    # 要写入的数据在2个part上
-    start_part_id = build_part_id(obj_id=obj_id, part_num=start_part_num)
-    end_part_id = build_part_id(obj_id=obj_id, part_num=end_part_num)
-    slice_index = MAXSIZE_PER_RADOS_OBJ - start_part_offset
-    return [(start_part_id, start_part_offset, 0, slice_index), (end_part_id, 0, slice_index, bytes_len)]
+    return tasks
 
 
-def read_part_tasks(obj_id, offset, bytes_len):
+def read_part_tasks(obj_id, offset, bytes_len, part_size: int = MAXSIZE_PER_RADOS_OBJ):
     """
     :param obj_id: 对象id
     :param offset: 读取对象的偏移量
     :param bytes_len: 读取字节长度
+    :param part_size: 每个part(rados对象)的大小
     :return:
         [(part_id, offset, read_len), ]
         列表每项为一个元组，依次为涉及到的对象part的id，从part读取数据的偏移量，读取数据长度
     """
-    tasks = write_part_tasks(obj_id=obj_id, offset=offset, bytes_len=bytes_len)
+    tasks = write_part_tasks(obj_id=obj_id, offset=offset, bytes_len=bytes_len, part_size=part_size)
     read_tasks = [(obj_key, offset, end - start) for obj_key, offset, start, end in tasks]
     return read_tasks
 
@@ -116,16 +131,100 @@ def get_size(fd):
     raise AttributeError("Unable to determine the file's size.")
 
 
+class PartManifest:
+    """
+    对象数据的part清单
+
+    多部分上传的对象由part组成，除最后一个外part大小一致；第N(从0开始)个part的数据存储在rados数据的偏移量N*stride处，
+    stride大于part大小时part之间有空隙，读写对象时按清单把对象偏移量映射为rados数据的偏移量；
+    最后一个part可能大于part大小(最大为stride)，对象偏移量(parts-1)*part_size之后的数据都在最后一个part中
+    """
+
+    def __init__(self, part_size: int, stride: int, parts: int = 0):
+        """
+        :param part_size: part大小(最后一个part除外)
+        :param stride: part存储的间隔
+        :param parts: part数量；0表示未知，此时最后一个part不能大于part_size
+        """
+        self.part_size = part_size
+        self.stride = stride
+        self.parts = parts
+
+    @property
+    def last_part_offset(self):
+        """
+        最后一个part在对象中的偏移量；None表示part数量未知
+        """
+        if self.parts > 0:
+            return (self.parts - 1) * self.part_size
+
+        return None
+
+    def ranges(self, offset, size):
+        """
+        对象数据区间映射为rados数据区间
+
+        :param offset: 对象偏移量
+        :param size: 字节长度
+        :return:
+            [(offset, size), ]    # rados数据区间，按对象数据顺序
+        """
+        ret = []
+        last_offset = self.last_part_offset
+        while size > 0:
+            if last_offset is not None and offset >= last_offset:
+                ret.append(((self.parts - 1) * self.stride + offset - last_offset, size))
+                break
+
+            index, within = divmod(offset, self.part_size)
+            length = min(self.part_size - within, size)
+            ret.append((index * self.stride + within, length))
+            offset += length
+            size -= length
+
+        return ret
+
+    def physical_size(self, size):
+        """
+        对象大小为size时，rados数据的大小
+        """
+        if size <= 0:
+            return 0
+
+        last_offset = self.last_part_offset
+        if last_offset is not None and size > last_offset:
+            return (self.parts - 1) * self.stride + size - last_offset
+
+        index, within = divmod(size - 1, self.part_size)
+        return index * self.stride + within + 1
+
+
+def get_data_ranges(offset, size, manifest: PartManifest = None):
+    """
+    对象数据区间对应的rados数据区间
+
+    :return:
+        [(offset, size), ]
+    """
+    if manifest is None:
+        return [(offset, size)]
+
+    return manifest.ranges(offset=offset, size=size)
+
+
 class HarborObjectStructure:
     """
     每个EVHarbor对象可能有多个部分part(rados对象)组成
     OBJ(part0, part1, part2, ...)
     part0 id == obj_id;  partN id == f'{obj_id}_{N}'
+
+    旧布局每个part最大2GB；条带布局每个part大小为对象的条带单元大小
     """
 
-    def __init__(self, obj_id, obj_size):
+    def __init__(self, obj_id, obj_size, part_size: int = MAXSIZE_PER_RADOS_OBJ):
         self._obj_id = obj_id
         self._obj_size = obj_size
+        self._part_size = part_size
         self._parts_id = []
 
     @property
@@ -137,10 +236,10 @@ class HarborObjectStructure:
 
     @property
     def size_part_by(self):
-        return MAXSIZE_PER_RADOS_OBJ
+        return self._part_size
 
     def _build(self):
-        last_part_num = int(math.ceil(self._obj_size / MAXSIZE_PER_RADOS_OBJ)) - 1
+        last_part_num = int(math.ceil(self._obj_size / self._part_size)) - 1
         self.build_parts_id(last_part_num=last_part_num)
 
     def build_parts_id(self, last_part_num):
@@ -186,6 +285,237 @@ class CephClusterCommand(dict):
                 self.update(json.loads(buf))
 
 
+class RadosAioWriter:
+    """
+    基于librados aio_write的流水线写入器
+
+    一个写入器对应一个rados ioctx，写入操作异步提交到ceph，不等待前一个写操作完成；
+    同时在途(in-flight)的写操作数量不超过max_in_flight，超过时等待最早提交的写操作完成。
+    异步写操作失败时会同步重试一次，仍失败时在下一次write()、flush()或close()时抛出RadosWriteError。
+    """
+
+    def __init__(self, ioctx, obj_id, max_in_flight: int = 4, timeout: int = 20,
+                 part_size: int = MAXSIZE_PER_RADOS_OBJ, manifest: PartManifest = None):
+        """
+        :param ioctx: rados.Ioctx()，缓存的ioctx，写入器不关闭
+        :param obj_id: 对象id
+        :param max_in_flight: 同时在途的最大写操作数
+        :param timeout: 等待一个写操作完成的超时时间(秒)
+        :param part_size: 每个part(rados对象)的大小
+        :param manifest: 对象的part清单，None表示对象数据连续存储
+        """
+        self._ioctx = ioctx
+        self._obj_id = obj_id
+        self._part_size = part_size
+        self._manifest = manifest
+        self._max_in_flight = max(max_in_flight, 1)
+        self._timeout = timeout
+        self._pending = deque()  # [(Completion, Event, obj_key, offset, data), ]
+        self._error = None
+        self.submitted_count = 0
+        self.completed_count = 0
+
+    @property
+    def in_flight(self):
+        """在途的写操作数量"""
+        return len(self._pending)
+
+    def _raise_if_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _submit(self, obj_key, offset, data: bytes):
+        """
+        :raises: class:`RadosWriteError`
+        """
+        event = threading.Event()
+
+        def _oncomplete(completion):
+            event.set()
+
+        try:
+            completion = self._ioctx.aio_write(obj_key, data, offset=offset, oncomplete=_oncomplete)
+        except rados.Error as e:
+            msg = e.args[0] if e.args else 'Failed to submit aio write to rados object'
+            raise RadosWriteError(msg, errno=e.errno)
+
+        self._pending.append((completion, event, obj_key, offset, data))
+        self.submitted_count += 1
+
+    def _wait_one(self):
+        """
+        等待最早提交的一个写操作完成
+
+        :raises: class:`RadosWriteError`
+        """
+        completion, event, obj_key, offset, data = self._pending.popleft()
+        if not event.wait(self._timeout):
+            raise RadosWriteError(f'Failed to write bytes to rados object {obj_key} timeout')
+
+        self.completed_count += 1
+        if completion.get_return_value() >= 0:
+            return
+
+        # 异步写入失败，同步重试一次
+        try:
+            RadosAPI.ioctx_write(ioctx=self._ioctx, obj_key=obj_key, data=data, offset=offset)
+        except rados.Error as e:
+            msg = e.args[0] if e.args else f'Failed to write bytes to rados object {obj_key}'
+            raise RadosWriteError(msg, errno=e.errno)
+
+    def _wait(self, count: int):
+        """
+        等待直到在途写操作数量不大于count，错误会被记录
+
+        :raises: class:`RadosWriteError`
+        """
+        while len(self._pending) > count:
+            try:
+                self._wait_one()
+            except RadosWriteError as e:
+                if self._error is None:
+                    self._error = e
+
+        self._raise_if_error()
+
+    def write(self, offset, data: bytes):
+        """
+        异步写入数据，在途写操作数量达到上限时阻塞
+
+        :param offset: 数据写入对象的偏移量
+        :param data: 数据，bytes
+        :raises: class:`RadosWriteError`   # 之前提交的写操作发生的错误也会在这里抛出
+        """
+        self._raise_if_error()
+        pos = 0
+        for oft, size in get_data_ranges(offset=offset, size=len(data), manifest=self._manifest):
+            tasks = write_part_tasks(self._obj_id, offset=oft, bytes_len=size, part_size=self._part_size)
+            for obj_key, off, start, end in tasks:
+                self._wait(self._max_in_flight - 1)
+                self._submit(obj_key=obj_key, offset=off, data=data[pos + start:pos + end])
+
+            pos += size
+
+    def flush(self):
+        """
+        等待所有在途写操作完成
+
+        :raises: class:`RadosWriteError`
+        """
+        self._wait(0)
+
+    def close(self):
+        """
+        等待所有在途写操作完成
+
+        :raises: class:`RadosWriteError`
+        """
+        try:
+            self.flush()
+        finally:
+            self._ioctx = None
+
+
+class RadosAioReader:
+    """
+    基于librados aio_read的异步读取器，用于预读
+
+    submit()提交读操作后立即返回，result()等待读操作完成并返回数据；
+    与同步读一致，rados对象不存在或数据不足时用0补足。
+    """
+
+    def __init__(self, ioctx, obj_id, timeout: int = 20, part_size: int = MAXSIZE_PER_RADOS_OBJ,
+                 manifest: PartManifest = None):
+        """
+        :param ioctx: rados.Ioctx()，缓存的ioctx，读取器不关闭
+        :param obj_id: 对象id
+        :param timeout: 等待一个读操作完成的超时时间(秒)
+        :param part_size: 每个part(rados对象)的大小
+        :param manifest: 对象的part清单，None表示对象数据连续存储
+        """
+        self._ioctx = ioctx
+        self._obj_id = obj_id
+        self._part_size = part_size
+        self._manifest = manifest
+        self._timeout = timeout
+        self._handles = []
+
+    def _submit_part(self, obj_key, offset, size):
+        """
+        :return: [Completion, Event, result_holder, size]
+        :raises: class:`RadosError`
+        """
+        event = threading.Event()
+        holder = []
+
+        def _oncomplete(completion, data_read):
+            holder.append(data_read)
+            event.set()
+
+        try:
+            completion = self._ioctx.aio_read(obj_key, size, offset, _oncomplete)
+        except rados.Error as e:
+            msg = e.args[0] if e.args else 'Failed to submit aio read from rados object'
+            raise RadosError(msg, errno=e.errno)
+
+        return [completion, event, holder, size]
+
+    def submit(self, offset, size):
+        """
+        提交一个异步读操作
+
+        :param offset: 对象偏移量
+        :param size: 读取字节长度
+        :return: handle  # 用于result()获取数据
+        :raises: class:`RadosError`
+        """
+        handle = []
+        for oft, length in get_data_ranges(offset=offset, size=size, manifest=self._manifest):
+            tasks = read_part_tasks(self._obj_id, offset=oft, bytes_len=length, part_size=self._part_size)
+            handle += [self._submit_part(obj_key=obj_key, offset=off, size=rd_size) for obj_key, off, rd_size in tasks]
+
+        self._handles.append(handle)
+        return handle
+
+    def result(self, handle):
+        """
+        等待读操作完成并返回数据
+
+        :return: bytes
+        :raises: class:`RadosError`
+        """
+        self._handles.remove(handle)
+        ret_data = bytes()
+        for completion, event, holder, size in handle:
+            if not event.wait(self._timeout):
+                raise RadosError('Failed to read bytes from rados object timeout')
+
+            r = completion.get_return_value()
+            if r == -errno.ENOENT:
+                data = bytes(size)  # rados对象不存在，构造一个指定长度的bytes
+            elif r < 0:
+                raise RadosError('Failed to read bytes from rados object', errno=-r)
+            else:
+                data = holder[0] if holder and holder[0] else bytes()
+                if len(data) < size:
+                    data += bytes(size - len(data))
+
+            ret_data += data
+
+        return ret_data
+
+    def close(self):
+        """
+        等待未取结果的读操作结束
+        """
+        for handle in self._handles:
+            for completion, event, holder, size in handle:
+                event.wait(self._timeout)
+
+        self._handles = []
+        self._ioctx = None
+
+
 class RadosAPI:
     """
     ceph cluster rados对象接口封装
@@ -279,9 +609,43 @@ class RadosAPI:
 
         return self._open_ioctx(pool_name=pool_name, try_times=(try_times + 1))
 
+    def _get_cached_ioctx(self):
+        """
+        获取连接池管理器缓存的ioctx，ioctx在线程间共享，不能关闭
+
+        :return:
+            rados.Ioctx()
+        :raises: class:`RadosError`
+        """
+        conf = dict(keyring=self._keyring_file) if self._keyring_file else None
+        try:
+            return conn_pool_manager.ioctx(
+                ceph_cluster_alias=self.alise_cluster, pool_name=self._pool_name,
+                user_name=self._user_name, cluster_name=self._cluster_name,
+                conf_file=self._conf_file, conf=conf)
+        except (rados.Error, Exception) as e:
+            raise RadosError(f'Failed to open_ioctx, pool={self._pool_name},{str(e)}')
+
+    @contextmanager
+    def _cached_ioctx(self):
+        """
+        with语句中使用缓存的ioctx，rados连接不可用时使ioctx缓存失效，下次重新连接；
+        单个rados操作的错误(对象不存在、写入失败等)不影响其他线程共享的连接
+
+        :raises: class:`RadosError`
+        """
+        ioctx = self._get_cached_ioctx()
+        try:
+            yield ioctx
+        except rados.Error as e:
+            conn_pool_manager.invalidate_ioctx_if_broken(ceph_cluster_alias=self.alise_cluster, error=e)
+            raise
+
     @staticmethod
-    @func_set_timeout(10)
     def ioctx_write(ioctx, obj_key, data, offset):
+        """
+        :raises: class:`RadosError`     # 超时由librados的rados_osd_op_timeout控制
+        """
         try:
             r = ioctx.write(obj_key, data, offset=offset)
         except rados.Error as e:
@@ -291,18 +655,24 @@ class RadosAPI:
         if r != 0:
             raise RadosError('Failed to write bytes to rados object')
 
-    def _io_write(self, ioctx, obj_id, offset, data: bytes):
+    def _io_write(self, ioctx, obj_id, offset, data: bytes, part_size: int = MAXSIZE_PER_RADOS_OBJ):
         """
-        向对象写入数据
+        向对象写入数据，数据涉及多个part时并行写入各part
 
         :param obj_id: 对象id
         :param offset: 数据写入偏移量
         :param data: 数据，bytes
+        :param part_size: 每个part(rados对象)的大小
         :return:
             success: True
         :raises: class:`RadosError`
         """
-        tasks = write_part_tasks(obj_id, offset=offset, bytes_len=len(data))
+        tasks = write_part_tasks(obj_id, offset=offset, bytes_len=len(data), part_size=part_size)
+        if len(tasks) > 1:
+            writer = RadosAioWriter(ioctx=ioctx, obj_id=obj_id, max_in_flight=len(tasks), part_size=part_size)
+            writer.write(offset=offset, data=data)
+            writer.close()
+            return True
 
         for obj_key, off, start, end in tasks:
             try:
@@ -310,33 +680,49 @@ class RadosAPI:
             except rados.Error as e:
                 msg = e.args[0] if e.args else 'Failed to write bytes to rados object'
                 raise RadosError(msg, errno=e.errno)
-            except FunctionTimedOut as e:
-                msg = 'Failed to write bytes to rados object timeout'
-                raise RadosError(msg)
 
         return True
 
-    def write(self, obj_id, offset, data: bytes):
+    def write(self, obj_id, offset, data: bytes, part_size: int = MAXSIZE_PER_RADOS_OBJ):
         """
         向对象写入数据
 
         :param obj_id: 对象id
         :param offset: 数据写入偏移量
         :param data: 数据，bytes
+        :param part_size: 每个part(rados对象)的大小
         :return:
             success: True
         :raises: class:`RadosError`
         """
-        with self._open_ioctx(self._pool_name) as ioctx:
+        with self._cached_ioctx() as ioctx:
             try:
-                self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset, data=data)
+                self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset, data=data, part_size=part_size)
             except rados.Error as e:
                 msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
                 raise RadosError(msg, errno=e.errno)
 
         return True
 
-    def _io_write_file(self, ioctx, obj_id, offset, file, per_size=20 * 1024 ** 2):
+    def aio_writer(self, obj_id, max_in_flight: int = 4, part_size: int = MAXSIZE_PER_RADOS_OBJ,
+                   manifest: PartManifest = None):
+        """
+        创建一个异步流水线写入器
+
+        :param obj_id: 对象id
+        :param max_in_flight: 同时在途的最大写操作数
+        :param part_size: 每个part(rados对象)的大小
+        :param manifest: 对象的part清单
+        :return:
+            RadosAioWriter()
+        :raises: class:`RadosError`
+        """
+        ioctx = self._get_cached_ioctx()
+        return RadosAioWriter(ioctx=ioctx, obj_id=obj_id, max_in_flight=max_in_flight, part_size=part_size,
+                              manifest=manifest)
+
+    def _io_write_file(self, ioctx, obj_id, offset, file, per_size=20 * 1024 ** 2,
+                       part_size: int = MAXSIZE_PER_RADOS_OBJ):
         """
         向对象写入一个类文件数据
 
@@ -344,6 +730,7 @@ class RadosAPI:
         :param offset: 文件数据写入对象偏移量
         :param file: 类文件
         :param per_size: 每次从文件读取数据的大小,默认20MB
+        :param part_size: 每个part(rados对象)的大小
         :return:
             success: True
         :raises: class:`RadosError`
@@ -363,16 +750,18 @@ class RadosAPI:
             chunk = file.read(per_size)
             if chunk:
                 try:
-                    self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset + file_offset, data=chunk)
+                    self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset + file_offset, data=chunk,
+                                   part_size=part_size)
                 except RadosError:
                     # 写入失败再尝试一次
-                    self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset + file_offset, data=chunk)
+                    self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset + file_offset, data=chunk,
+                                   part_size=part_size)
 
                 file_offset += len(chunk)  # 更新已写入大小
             else:
                 raise RadosError('read error when write a file to rados')
 
-    def write_file(self, obj_id, offset, file, per_size=20 * 1024 ** 2):
+    def write_file(self, obj_id, offset, file, per_size=20 * 1024 ** 2, part_size: int = MAXSIZE_PER_RADOS_OBJ):
         """
         向对象写入一个类文件数据
 
@@ -380,13 +769,15 @@ class RadosAPI:
         :param offset: 文件数据写入对象偏移量
         :param file: 类文件
         :param per_size: 每次从文件读取数据的大小,默认20MB
+        :param part_size: 每个part(rados对象)的大小
         :return:
             success: True
         :raises: class:`RadosError`
         """
-        with self._open_ioctx(self._pool_name) as ioctx:
+        with self._cached_ioctx() as ioctx:
             try:
-                self._io_write_file(ioctx=ioctx, obj_id=obj_id, offset=offset, file=file, per_size=per_size)
+                self._io_write_file(ioctx=ioctx, obj_id=obj_id, offset=offset, file=file, per_size=per_size,
+                                    part_size=part_size)
             except rados.Error as e:
                 msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
                 raise RadosError(msg, errno=e.errno)
@@ -394,7 +785,6 @@ class RadosAPI:
         return True
 
     @staticmethod
-    @func_set_timeout(20)
     def _rados_read(ioctx, obj_id, offset, read_size):
         """
         从rados对象指定偏移量开始读取指定长度的字节数据
@@ -421,13 +811,14 @@ class RadosAPI:
 
         return data
 
-    def read(self, obj_id, offset, read_size):
+    def read(self, obj_id, offset, read_size, part_size: int = MAXSIZE_PER_RADOS_OBJ):
         """
-        读对象数据
+        读对象数据，数据涉及多个part时并行读取各part
 
         :param obj_id: 对象id
         :param offset: 数据读取偏移量
         :param read_size: 读取数据byte大小
+        :param part_size: 每个part(rados对象)的大小
         :return:
             success; bytes
         :raises: class:`RadosError`
@@ -435,30 +826,100 @@ class RadosAPI:
         if offset < 0 or read_size <= 0:
             return bytes()
 
-        tasks = read_part_tasks(obj_id, offset=offset, bytes_len=read_size)
-        with self._open_ioctx(self._pool_name) as ioctx:
+        tasks = read_part_tasks(obj_id, offset=offset, bytes_len=read_size, part_size=part_size)
+        with self._cached_ioctx() as ioctx:
             try:
                 # 要读取的数据在一个rados对象上
                 if len(tasks) == 1:
                     obj_key, off, size = tasks[0]
                     return self._rados_read(ioctx=ioctx, obj_id=obj_key, read_size=size, offset=off)
 
-                ret_data = bytes()
-                for obj_key, off, size in tasks:
-                    data = self._rados_read(ioctx=ioctx, obj_id=obj_key, read_size=size, offset=off)
-                    ret_data += data
-
-                return ret_data
+                reader = RadosAioReader(ioctx=ioctx, obj_id=obj_id, part_size=part_size)
+                try:
+                    return reader.result(reader.submit(offset=offset, size=read_size))
+                finally:
+                    reader.close()
 
             except rados.Error as e:
                 msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
                 raise RadosError(msg, errno=e.errno)
-            except FunctionTimedOut as e:
-                raise RadosError(str(e))
             except Exception as e:
                 raise RadosError(str(e))
 
-    @func_set_timeout(10)
+    def aio_reader(self, obj_id, part_size: int = MAXSIZE_PER_RADOS_OBJ, manifest: PartManifest = None):
+        """
+        创建一个异步读取器
+
+        :param obj_id: 对象id
+        :param part_size: 每个part(rados对象)的大小
+        :param manifest: 对象的part清单
+        :return:
+            RadosAioReader()
+        :raises: class:`RadosError`
+        """
+        ioctx = self._get_cached_ioctx()
+        return RadosAioReader(ioctx=ioctx, obj_id=obj_id, part_size=part_size, manifest=manifest)
+
+    def copy_from(self, obj_id, source: 'RadosAPI', source_obj_id, size: int, block_size: int = 8 * 1024 ** 2,
+                  max_in_flight: int = 4, part_size: int = MAXSIZE_PER_RADOS_OBJ,
+                  source_part_size: int = MAXSIZE_PER_RADOS_OBJ, md5_handler=None,
+                  manifest: PartManifest = None, source_manifest: PartManifest = None):
+        """
+        从源对象复制数据到对象，源数据异步读和目标数据异步写流水线进行，
+        同时在途的读、写数据块分别不超过max_in_flight个
+
+        :param obj_id: 目标对象id
+        :param source: 源对象所在ceph集群的RadosAPI()，可以是自己
+        :param source_obj_id: 源对象id
+        :param size: 复制数据的长度
+        :param block_size: 每个数据块的大小
+        :param max_in_flight: 同时在途的最大读(写)操作数
+        :param part_size: 目标对象每个part(rados对象)的大小
+        :param source_part_size: 源对象每个part(rados对象)的大小
+        :param md5_handler: 不为None时，复制的数据按顺序更新到md5_handler
+        :param manifest: 目标对象的part清单
+        :param source_manifest: 源对象的part清单
+        :return:
+            int     # 复制的字节数
+        :raises: class:`RadosError`
+        """
+        max_in_flight = max(max_in_flight, 1)
+        with self._cached_ioctx() as ioctx, source._cached_ioctx() as src_ioctx:
+            reader = RadosAioReader(ioctx=src_ioctx, obj_id=source_obj_id, part_size=source_part_size,
+                                    manifest=source_manifest)
+            writer = RadosAioWriter(ioctx=ioctx, obj_id=obj_id, max_in_flight=max_in_flight, part_size=part_size,
+                                    manifest=manifest)
+            pending = deque()  # [(offset, handle), ]
+            next_oft = 0
+            copied = 0
+            try:
+                while True:
+                    while len(pending) < max_in_flight and next_oft < size:
+                        length = min(size - next_oft, block_size)
+                        pending.append((next_oft, reader.submit(offset=next_oft, size=length)))
+                        next_oft += length
+
+                    if not pending:
+                        break
+
+                    oft, handle = pending.popleft()
+                    data = reader.result(handle)
+                    writer.write(offset=oft, data=data)
+                    if md5_handler is not None:
+                        md5_handler.update(offset=oft, data=data)
+
+                    copied += len(data)
+
+                writer.flush()
+            finally:
+                reader.close()
+                try:
+                    writer.close()
+                except RadosError:
+                    pass
+
+        return copied
+
     def ioctx_delete(self, ioctx, part_id):
         try:
             ok = ioctx.remove_object(part_id)
@@ -470,26 +931,98 @@ class RadosAPI:
             msg = e.args[0] if e.args else f'Failed to remove rados object {part_id}'
             raise RadosError(msg, errno=e.errno)
 
-    def delete(self, obj_id, obj_size):
+    @staticmethod
+    def ioctx_aio_delete(ioctx, parts_id: list, batch_size: int = 64, timeout: int = 20):
+        """
+        并行删除多个rados对象，每批最多batch_size个删除操作同时在途
+
+        :raises: class:`RadosError`
+        """
+        for i in range(0, len(parts_id), batch_size):
+            pending = []
+            for part_id in parts_id[i:i + batch_size]:
+                event = threading.Event()
+                try:
+                    completion = ioctx.aio_remove(part_id, oncomplete=lambda c, e=event: e.set())
+                except rados.Error as e:
+                    msg = e.args[0] if e.args else f'Failed to remove rados object {part_id}'
+                    raise RadosError(msg, errno=e.errno)
+
+                pending.append((part_id, completion, event))
+
+            for part_id, completion, event in pending:
+                if not event.wait(timeout):
+                    raise RadosError(f'Failed to remove rados object {part_id} timeout')
+
+                r = completion.get_return_value()
+                if r < 0 and r != -errno.ENOENT:
+                    raise RadosError(f'Failed to remove rados object {part_id}', errno=-r)
+
+    def aio_delete_objects(self, objs: dict, max_in_flight: int = 64, timeout: int = 20):
+        """
+        并行删除多个对象的所有part(rados对象)，最多max_in_flight个删除操作同时在途，
+        一个对象的part删除失败不影响其他对象
+
+        :param objs: {key: parts_id}    # key由调用者定义，用于标识对象
+        :param max_in_flight: 同时在途的删除操作数量
+        :param timeout: 等待每个删除操作完成的超时时间(秒)
+        :return:
+            dict    # 删除失败的对象，{key: 错误描述}
+        :raises: class:`RadosError`     # 获取ioctx错误
+        """
+        failed = {}
+        tasks = [(key, part_id) for key, parts_id in objs.items() for part_id in parts_id]
+        with self._cached_ioctx() as ioctx:
+            for i in range(0, len(tasks), max_in_flight):
+                pending = []
+                for key, part_id in tasks[i:i + max_in_flight]:
+                    if key in failed:
+                        continue
+
+                    event = threading.Event()
+                    try:
+                        completion = ioctx.aio_remove(part_id, oncomplete=lambda c, e=event: e.set())
+                    except rados.Error as e:
+                        failed[key] = e.args[0] if e.args else f'Failed to remove rados object {part_id}'
+                        continue
+
+                    pending.append((key, part_id, completion, event))
+
+                for key, part_id, completion, event in pending:
+                    if not event.wait(timeout):
+                        failed.setdefault(key, f'Failed to remove rados object {part_id} timeout')
+                        continue
+
+                    r = completion.get_return_value()
+                    if r < 0 and r != -errno.ENOENT:
+                        failed.setdefault(key, f'Failed to remove rados object {part_id}, errno={-r}')
+
+        return failed
+
+    def delete(self, obj_id, obj_size, part_size: int = MAXSIZE_PER_RADOS_OBJ):
         """
         删除对象
 
         :param obj_id: 对象id
         :param obj_size: 对象大小
+        :param part_size: 每个part(rados对象)的大小
         :return:
             success: True
         :raises: class:`RadosError`
         """
         try:
-            with self._open_ioctx(self._pool_name) as ioctx:
-                hos = HarborObjectStructure(obj_id=obj_id, obj_size=obj_size)
-                for part_id in hos.parts_id:
+            with self._cached_ioctx() as ioctx:
+                hos = HarborObjectStructure(obj_id=obj_id, obj_size=obj_size, part_size=part_size)
+                parts_id = hos.parts_id
+                if len(parts_id) > 1:
+                    self.ioctx_aio_delete(ioctx=ioctx, parts_id=parts_id)
+                    return True
+
+                for part_id in parts_id:
                     try:
                         self.ioctx_delete(ioctx=ioctx, part_id=part_id)
                     except rados.Error as e:
                         raise RadosError(e, errno=e.errno)
-                    except FunctionTimedOut as e:
-                        raise RadosError(f'Failed to remove rados object {part_id} timeout')
 
                 return True
 
@@ -509,7 +1042,7 @@ class RadosAPI:
         :raises: class:`RadosError`, `RadosNotFound`
         """
         try:
-            with self._open_ioctx(self._pool_name) as ioctx:
+            with self._cached_ioctx() as ioctx:
                 size, t = ioctx.stat(obj_id)
         except rados.ObjectNotFound:
             raise RadosNotFound('rados对象不存在')
@@ -719,7 +1252,14 @@ class HarborObject:
     iHarbor对象操作接口封装，
     """
     def __init__(self, pool_name: str, obj_id: str, obj_size: int, cluster_name: str,  user_name: str, conf_file: str,
-                 keyring_file: str, alise_cluster, *args, **kwargs):
+                 keyring_file: str, alise_cluster, stripe_unit: int = 0, manifest: PartManifest = None,
+                 *args, **kwargs):
+        """
+        :param stripe_unit: 对象数据布局的条带单元大小；0表示旧布局(每个rados对象最大2GB)
+        :param manifest: 对象的part清单；None表示对象数据连续存储
+        """
+        self._part_size = get_part_size(stripe_unit)
+        self._manifest = manifest
         self._cluster_name = cluster_name
         self._user_name = user_name
         self._conf_file = conf_file
@@ -740,6 +1280,34 @@ class HarborObject:
         """获取对象大小"""
         return self._obj_size
 
+    def get_part_size(self):
+        """对象数据布局每个part(rados对象)的大小"""
+        return self._part_size
+
+    def get_manifest(self):
+        """对象的part清单，None表示对象数据连续存储"""
+        return self._manifest
+
+    def reset_manifest(self, manifest: PartManifest = None):
+        self._manifest = manifest
+
+    def get_physical_size(self, obj_size=None):
+        """
+        对象在rados中存储数据的大小，有part清单时包括part之间的空隙
+        """
+        size = obj_size if isinstance(obj_size, int) else self.get_obj_size()
+        if self._manifest is None:
+            return size
+
+        return self._manifest.physical_size(size)
+
+    def get_parts_id(self, obj_size=None):
+        """
+        对象数据所在的所有part(rados对象)的名称
+        """
+        size = self.get_physical_size(obj_size)
+        return HarborObjectStructure(obj_id=self._obj_id, obj_size=size, part_size=self._part_size).parts_id
+
     @property
     def rados(self):
         """
@@ -789,7 +1357,9 @@ class HarborObject:
 
         try:
             rados_ = self.get_rados_api()
-            data = rados_.read(obj_id=self._obj_id, offset=offset, read_size=read_size)
+            data = bytes()
+            for oft, size in get_data_ranges(offset=offset, size=read_size, manifest=self._manifest):
+                data += rados_.read(obj_id=self._obj_id, offset=oft, read_size=size, part_size=self._part_size)
         except RadosError as e:
             return False, str(e)
 
@@ -827,7 +1397,11 @@ class HarborObject:
                 rados_ = None
                 try:
                     rados_ = self.get_rados_api()
-                    rados_.write(obj_id=self._obj_id, offset=offset, data=chunk)
+                    pos = 0
+                    for oft, size in get_data_ranges(offset=offset, size=len(chunk), manifest=self._manifest):
+                        rados_.write(obj_id=self._obj_id, offset=oft, data=chunk[pos:pos + size],
+                                     part_size=self._part_size)
+                        pos += size
                 except (RadosError, Exception) as e:
                     if rados_ is not None:
                         rados_.close_cluster_connect()
@@ -839,6 +1413,23 @@ class HarborObject:
         self._obj_size = max(offset + block_size, self._obj_size)
         return True, 'write success'
 
+    def get_aio_writer(self, max_in_flight: int = 4):
+        """
+        获取对象的异步流水线写入器
+
+        :param max_in_flight: 同时在途的最大写操作数
+        :return:
+            RadosAioWriter()
+        :raises: class:`RadosError`
+        """
+        rados_ = self.get_rados_api()
+        try:
+            return rados_.aio_writer(obj_id=self._obj_id, max_in_flight=max_in_flight, part_size=self._part_size,
+                                     manifest=self._manifest)
+        except RadosError as e:
+            rados_.close_cluster_connect()
+            raise e
+
     def write_file(self, offset, file, per_size=20 * 1024 ** 2):
         """
         向对象写入一个类文件数据
@@ -850,10 +1441,13 @@ class HarborObject:
                 （True, msg）无误
                  (False msg) 错误
         """
+        if self._manifest is not None:
+            return self._write_file_by_chunk(offset=offset, file=file, per_size=per_size)
+
         rados_ = None
         try:
             rados_ = self.get_rados_api()
-            rados_.write_file(obj_id=self._obj_id, offset=offset, file=file)
+            rados_.write_file(obj_id=self._obj_id, offset=offset, file=file, part_size=self._part_size)
         except (RadosError, Exception) as e:
             if rados_ is not None:
                 rados_.close_cluster_connect()
@@ -863,6 +1457,29 @@ class HarborObject:
         self._obj_size = max(offset + file_size, self._obj_size)
         return True, 'success to write file'
 
+    def _write_file_by_chunk(self, offset, file, per_size):
+        """
+        逐块读取类文件数据写入对象
+        """
+        try:
+            file.seek(0)
+        except Exception as e:
+            return False, str(e)
+
+        oft = offset
+        while True:
+            chunk = file.read(per_size)
+            if not chunk:
+                break
+
+            ok, msg = self.write(data_block=chunk, offset=oft)
+            if not ok:
+                return False, msg
+
+            oft += len(chunk)
+
+        return True, 'success to write file'
+
     def delete(self, obj_size=None):
         """
         删除对象
@@ -870,11 +1487,11 @@ class HarborObject:
             成功时：(True, str) str是成功结果描述
             错误时：(False, str) str是错误描述
         """
-        size = obj_size if isinstance(obj_size, int) else self.get_obj_size()
+        size = self.get_physical_size(obj_size)
         rados_ = None
         try:
             rados_ = self.get_rados_api()
-            rados_.delete(obj_id=self._obj_id, obj_size=size)
+            rados_.delete(obj_id=self._obj_id, obj_size=size, part_size=self._part_size)
         except (RadosError, Exception) as e:
             if rados_ is not None:
                 rados_.close_cluster_connect()
@@ -883,12 +1500,14 @@ class HarborObject:
         self._obj_size = 0
         return True, 'delete success'
 
-    def read_obj_generator(self, offset=0, end=None, block_size=10 * 1024 ** 2):
+    def read_obj_generator(self, offset=0, end=None, block_size=10 * 1024 ** 2, memory_budget=None):
         """
-        读取对象生成器
+        读取对象生成器，在返回一个数据块时预读后面的数据块
+
         :param offset: 读起始偏移量；type: int
         :param end: 读结束偏移量(包含)；type: int；None:表示对象结尾；
         :param block_size: 每次读取数据块长度；type: int
+        :param memory_budget: 预读数据块占用内存上限；type: int；None:默认READ_AHEAD_MEMORY_BUDGET；
         :return:
         """
         obj_size = self.get_obj_size()
@@ -898,6 +1517,22 @@ class HarborObject:
             end_oft = obj_size
 
         oft = max(offset, 0)
+        if memory_budget is None:
+            memory_budget = READ_AHEAD_MEMORY_BUDGET
+
+        # 包括正在返回的数据块，同时存在的数据块数量
+        max_blocks = memory_budget // block_size if block_size > 0 else 0
+        if max_blocks >= 2 and (end_oft - oft) > block_size:
+            return self._read_ahead_generator(offset=oft, end_oft=end_oft, block_size=block_size,
+                                              max_blocks=max_blocks)
+
+        return self._read_generator(offset=oft, end_oft=end_oft, block_size=block_size)
+
+    def _read_generator(self, offset, end_oft, block_size):
+        """
+        逐个数据块同步读取对象生成器
+        """
+        oft = offset
         while True:
             # 下载完成
             if oft >= end_oft:
@@ -916,6 +1551,86 @@ class HarborObject:
             else:
                 break
 
+    def _read_ahead_generator(self, offset, end_oft, block_size, max_blocks):
+        """
+        预读对象生成器，保持最多max_blocks个数据块在途(包括正在返回的数据块)
+
+        预读失败的数据块会同步再读一次
+        """
+        try:
+            reader = self.get_rados_api().aio_reader(obj_id=self._obj_id, part_size=self._part_size,
+                                                     manifest=self._manifest)
+        except RadosError:
+            yield from self._read_generator(offset=offset, end_oft=end_oft, block_size=block_size)
+            return
+
+        pending = deque()  # [(offset, size, handle), ]
+        next_oft = offset
+        try:
+            while True:
+                while len(pending) < max_blocks and next_oft < end_oft:
+                    size = min(end_oft - next_oft, block_size)
+                    try:
+                        handle = reader.submit(offset=next_oft, size=size)
+                    except RadosError:
+                        handle = None
+
+                    pending.append((next_oft, size, handle))
+                    next_oft += size
+
+                if not pending:
+                    break
+
+                oft, size, handle = pending.popleft()
+                ok = False
+                if handle is not None:
+                    try:
+                        data_block = reader.result(handle)
+                        ok = True
+                    except RadosError:
+                        pass
+
+                # 预读发生错误，同步再读一次
+                if not ok:
+                    ok, data_block = self.read(offset=oft, size=size)
+
+                if ok and data_block:
+                    yield data_block
+                else:
+                    break
+        finally:
+            reader.close()
+
+    def copy_from(self, source: 'HarborObject', size: int = None, md5_handler=None,
+                  max_in_flight: int = COPY_MAX_IN_FLIGHT):
+        """
+        从源对象复制数据到本对象(从偏移量0开始)，源对象可以在其他ceph集群或存储池，
+        在本节点异步读写流水线完成，不逐块同步等待
+
+        :param source: 源对象
+        :param size: 复制数据的长度，默认源对象大小
+        :param md5_handler: 不为None时，计算复制数据的md5
+        :param max_in_flight: 同时在途的最大读(写)操作数
+        :return: Tuple
+            成功时：(True, int) int是复制的字节数
+            错误时：(False, str) str是错误描述
+        """
+        size = size if isinstance(size, int) else source.get_obj_size()
+        rados_ = None
+        try:
+            rados_ = self.get_rados_api()
+            copied = rados_.copy_from(
+                obj_id=self._obj_id, source=source.get_rados_api(), source_obj_id=source._obj_id, size=size,
+                max_in_flight=max_in_flight, part_size=self._part_size, source_part_size=source.get_part_size(),
+                md5_handler=md5_handler, manifest=self._manifest, source_manifest=source.get_manifest())
+        except (RadosError, Exception) as e:
+            if rados_ is not None:
+                rados_.close_cluster_connect()
+            return False, str(e)
+
+        self._obj_size = max(copied, self._obj_size)
+        return True, copied
+
     def write_obj_generator(self):
         """
         写入对象生成器
@@ -973,7 +1688,7 @@ class HarborObject:
         :return:
                int, [item, ...]   # item: str; format = iharbor:{cluster_name}/{pool_name}/{rados-key}
         """
-        hos = HarborObjectStructure(obj_id=self._obj_id, obj_size=self._obj_size)
+        hos = HarborObjectStructure(obj_id=self._obj_id, obj_size=self.get_physical_size(), part_size=self._part_size)
         parts = hos.parts_id
         cn = self._cluster_name
         pn = self._pool_name
@@ -998,10 +1713,15 @@ class HarborObject:
 
 
 class FileWrapper:
-    def __init__(self, ho: HarborObject):
+    def __init__(self, ho: HarborObject, aio_max_in_flight: int = 0):
+        """
+        :param aio_max_in_flight: aio_write()同时在途的最大写操作数; <=0时aio_write()同write()
+        """
         self._ho = ho
         self.offset = 0
         self.closed = True
+        self._aio_max_in_flight = aio_max_in_flight
+        self._aio_writer = None
 
     def open(self):
         try:
@@ -1015,6 +1735,14 @@ class FileWrapper:
 
     def close(self):
         self.closed = True
+        writer = self._aio_writer
+        if writer is not None:
+            self._aio_writer = None
+            try:
+                writer.close()
+            except RadosError:
+                pass
+
         self._ho.get_rados_api().clear_cluster()
 
     @property
@@ -1048,6 +1776,36 @@ class FileWrapper:
         self.offset += wl
         return wl
 
+    def aio_write(self, data, offset=None):
+        """
+        流水线异步写入，不等待数据写入完成，需要调用flush()确认所有数据写入完成
+
+        :raises: RadosError
+        """
+        if self._aio_max_in_flight <= 0:
+            return self.write(data, offset=offset)
+
+        offset = offset if offset is not None else self.offset
+        if self._aio_writer is None:
+            self._aio_writer = self._ho.get_aio_writer(max_in_flight=self._aio_max_in_flight)
+
+        self._aio_writer.write(offset=offset, data=data)
+        wl = len(data)
+        self.offset += wl
+        self.size = max(offset + wl, self.size)
+        return wl
+
+    def flush(self):
+        """
+        等待所有异步写入完成
+
+        :raises: RadosError
+        """
+        writer = self._aio_writer
+        if writer is not None:
+            self._aio_writer = None
+            writer.close()
+
     def seek(self, offset):
         size = self.size
         if size <= 0:
@@ -1,9 +1,10 @@
 from django.conf import settings
 
-from .pyrados import HarborObject, RadosError
+from .pyrados import HarborObject, RadosError, PartManifest
 
 
-def build_harbor_object(using: str, pool_name: str, obj_id: str, obj_size: int = 0) -> HarborObject:
+def build_harbor_object(using: str, pool_name: str, obj_id: str, obj_size: int = 0,
+                        stripe_unit: int = 0, manifest: PartManifest = None) -> HarborObject:
     """
     构建iharbor对象对应的ceph读写接口
 
@@ -11,6 +12,8 @@ def build_harbor_object(using: str, pool_name: str, obj_id: str, obj_size: int =
     :param pool_name: ceph存储池名称，对应对象数据所在存储池名称; 当值为None时，pool name从django settings中获取
     :param obj_id: 对象在ceph存储池中对应的rados名称
     :param obj_size: 对象的大小
+    :param stripe_unit: 对象数据布局的条带单元大小；0表示旧布局
+    :param manifest: 对象的part清单；None表示对象数据连续存储
     """
     cephs = settings.CEPH_RADOS
 
@@ -26,7 +29,8 @@ def build_harbor_object(using: str, pool_name: str, obj_id: str, obj_size: int =
         pool_name = ceph['POOL_NAME'][0]
 
     return HarborObject(pool_name=pool_name, obj_id=obj_id, obj_size=obj_size, cluster_name=cluster_name,
-                        user_name=user_name, conf_file=conf_file, keyring_file=keyring_file, alise_cluster=using)
+                        user_name=user_name, conf_file=conf_file, keyring_file=keyring_file, alise_cluster=using,
+                        stripe_unit=stripe_unit, manifest=manifest)
 
 
 def build_rados_harbor_object(
@@ -53,6 +57,9 @@ def build_rados_harbor_object(
     if obj_size is None:
         obj_size = obj.obj_size
 
+    part_manifest = obj.get_part_manifest()
+    manifest = PartManifest(*part_manifest) if part_manifest else None
     return build_harbor_object(
-        using=using, pool_name=pool_name, obj_id=obj_rados_key, obj_size=obj_size
+        using=using, pool_name=pool_name, obj_id=obj_rados_key, obj_size=obj_size,
+        stripe_unit=obj.get_stripe_unit(), manifest=manifest
     )
@@ -7,7 +7,7 @@ from utils.md5 import offset_chunks
 from api.tests import config_ceph_clustar_settings
 
 # os.environ.setdefault("DJANGO_SETTINGS_MODULE", "webserver.settings")
-from .pyrados import get_size
+from .pyrados import get_size, FileWrapper, PartManifest
 from .shortcuts import build_harbor_object
 
 
@@ -66,6 +66,42 @@ class TestHarborObject(unittest.TestCase):
 
         self.read_check_and_delete(data_io, data_md5, ho)
 
+    def test_aio_write(self):
+        data_io, data_md5 = self.build_data()
+        ho = build_harbor_object(using=self.USING, pool_name=self.POOL_NAME, obj_id='test_object')
+
+        # aio write
+        data_io.seek(0)
+        fw = FileWrapper(ho, aio_max_in_flight=4)
+        offset = 0
+        while True:
+            chunk = data_io.read(5 * 1024 ** 2)
+            if not chunk:
+                break
+            fw.aio_write(chunk, offset=offset)
+            offset += len(chunk)
+
+        fw.flush()
+        self.read_check_and_delete(data_io, data_md5, ho)
+
+    def test_stripe_layout(self):
+        data_io, data_md5 = self.build_data()
+        ho = build_harbor_object(using=self.USING, pool_name=self.POOL_NAME, obj_id='test_object',
+                                 stripe_unit=4 * 1024 ** 2)
+
+        # write file, 60MB数据切分为15个rados对象
+        data_io.seek(0)
+        ok, msg = ho.write_file(offset=0, file=data_io)
+        self.assertTrue(ok, msg=f'write rados error, {msg}')
+
+        # 跨条带读
+        ok, data = ho.read(offset=3 * 1024 ** 2, size=3 * 1024 ** 2)
+        self.assertTrue(ok, msg=f'read rados error, {data}')
+        data_io.seek(3 * 1024 ** 2)
+        self.assertEqual(data, data_io.read(3 * 1024 ** 2), msg='read across stripe error')
+
+        self.read_check_and_delete(data_io, data_md5, ho)
+
     def test_write_generator(self):
         data_io, data_md5 = self.build_data()
         ho = build_harbor_object(using=self.USING, pool_name=self.POOL_NAME, obj_id='test_object')
@@ -105,6 +141,40 @@ class TestHarborObject(unittest.TestCase):
         self.assertTrue(ok, msg='delete rados error.')
 
 
+class TestPartManifest(unittest.TestCase):
+    @staticmethod
+    def read_through(manifest: PartManifest, physical: bytes, offset, size):
+        return b''.join(physical[o:o + n] for o, n in manifest.ranges(offset=offset, size=size))
+
+    def test_last_part_larger_than_part1(self):
+        # parts [5, 5, 5, 8]，分块大小(stride)按最后一个part确定为8
+        parts = [b'a' * 5, b'b' * 5, b'c' * 5, b'd' * 8]
+        data = b''.join(parts)
+        physical = bytearray(3 * 8 + 8)
+        for i, p in enumerate(parts):
+            physical[i * 8:i * 8 + len(p)] = p
+
+        physical = bytes(physical)
+        manifest = PartManifest(part_size=5, stride=8, parts=4)
+        self.assertEqual(manifest.physical_size(len(data)), 32)
+        self.assertEqual(manifest.ranges(offset=20, size=3), [(29, 3)])
+        self.assertEqual(manifest.ranges(offset=13, size=10), [(19, 2), (24, 8)])
+        self.assertEqual(self.read_through(manifest, physical, 0, len(data)), data)
+        for offset in range(len(data)):
+            for size in range(1, len(data) - offset + 1):
+                self.assertEqual(self.read_through(manifest, physical, offset, size), data[offset:offset + size])
+
+    def test_last_part_smaller_than_part1(self):
+        parts = [b'a' * 5, b'b' * 5, b'c' * 3]
+        data = b''.join(parts)
+        physical = b'a' * 5 + b'\0' * 3 + b'b' * 5 + b'\0' * 3 + b'c' * 3
+        for p in (3, 0):    # part数量未知时按part_size映射
+            manifest = PartManifest(part_size=5, stride=8, parts=p)
+            self.assertEqual(manifest.physical_size(len(data)), 19)
+            self.assertEqual(self.read_through(manifest, physical, 0, len(data)), data)
+            self.assertEqual(self.read_through(manifest, physical, 4, 8), data[4:12])
+
+
 if __name__ == '__main__':
     config_ceph_clustar_settings()
     unittest.main()
@@ -13,6 +13,10 @@ from utils.oss.shortcuts import build_harbor_object
 from utils.md5 import FileMD5Handler, Sha256Handler
 
 
+# 上传文件写入ceph时，同时在途(未完成)的异步写操作的最大数量；<=0时同步写入
+RADOS_AIO_WRITE_MAX_IN_FLIGHT = getattr(settings, 'RADOS_AIO_WRITE_MAX_IN_FLIGHT', 4)
+
+
 def try_close_file(f):
     try:
         if hasattr(f, 'close'):
@@ -215,11 +219,12 @@ class FileUploadToCephHandler(FileUploadHandler):
     chunk_size = 5 * 2 ** 20    # 5MB
     max_size_upload_limit = None
 
-    def __init__(self, request, using, pool_name='', obj_key=''):
+    def __init__(self, request, using, pool_name='', obj_key='', stripe_unit: int = 0):
         super().__init__(request=request)
         self.using = using
         self.pool_name = pool_name
         self.obj_key = obj_key
+        self.stripe_unit = stripe_unit
         self.file = None
         self.file_md5_handler = None
 
@@ -249,16 +254,26 @@ class FileUploadToCephHandler(FileUploadHandler):
         Create the file object to append to as data is coming in.
         """
         super().new_file(*args, **kwargs)
-        ho = build_harbor_object(using=self.using, pool_name=self.pool_name, obj_id=self.obj_key)
-        self.file = FileWrapper(ho)
+        ho = build_harbor_object(using=self.using, pool_name=self.pool_name, obj_id=self.obj_key,
+                                 stripe_unit=self.stripe_unit)
+        self.file = FileWrapper(ho, aio_max_in_flight=RADOS_AIO_WRITE_MAX_IN_FLIGHT)
         self.file_md5_handler = FileMD5Handler()
 
     def receive_data_chunk(self, raw_data, start):
-        self.file.write(raw_data, offset=start)
+        """
+        数据块异步写入ceph，不等待写入完成就返回继续接收下一个数据块
+
+        :raises: RadosError
+        """
+        self.file.aio_write(raw_data, offset=start)
         if self.file_md5_handler:
             self.file_md5_handler.update(offset=start, data=raw_data)
 
     def file_complete(self, file_size):
+        """
+        :raises: RadosError     # 等待所有异步写入完成，写入失败
+        """
+        self.file.flush()
         self.file.seek(0)
         self.file.size = file_size
         return CephUploadFile(
@@ -273,6 +288,13 @@ class FileUploadToCephHandler(FileUploadHandler):
             md5_handler=self.file_md5_handler
         )
 
+    def upload_interrupted(self):
+        """
+        上传中断，等待在途的异步写入结束，避免之后的数据清理与未完成的写入并发
+        """
+        if self.file is not None:
+            try_close_file(self.file)
+
     def file_md5(self):
         fmh = self.file_md5_handler
         if fmh:
@@ -345,9 +367,10 @@ class PartUploadToCephHandler(FileUploadToCephHandler):
     chunk_size = 5 * 2 ** 20    # 5MB
     max_size_upload_limit = 5 * 1024 ** 3       # 5GB
 
-    def __init__(self, request, using: str, pool_name='', obj_key='', offset=0):
+    def __init__(self, request, using: str, pool_name='', obj_key='', offset=0, stripe_unit: int = 0):
         self.offset = offset
-        super().__init__(request=request, using=using, pool_name=pool_name, obj_key=obj_key)
+        super().__init__(request=request, using=using, pool_name=pool_name, obj_key=obj_key,
+                         stripe_unit=stripe_unit)
         amz_content_sha256 = self.request.headers.get('X-Amz-Content-SHA256', None)
         if amz_content_sha256 and amz_content_sha256 != 'UNSIGNED-PAYLOAD':
             self.file_sha256_handler = Sha256Handler()
@@ -358,7 +381,7 @@ class PartUploadToCephHandler(FileUploadToCephHandler):
         """
         :raises: RadosError
         """
-        self.file.write(raw_data, offset=self.offset)
+        self.file.aio_write(raw_data, offset=self.offset)
         self.offset += len(raw_data)
         if self.file_md5_handler:
             self.file_md5_handler.update(offset=start, data=raw_data)
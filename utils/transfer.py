@@ -0,0 +1,223 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib import parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.md5 import FileMD5Handler
+
+
+class SessionPool:
+    """
+    按endpoint(scheme://host:port)复用的requests.Session，保持长连接，避免每个请求都新建TCP/TLS连接
+    """
+    def __init__(self, pool_maxsize: int = 32):
+        """
+        :param pool_maxsize: 每个endpoint的连接池最多保持的连接数
+        """
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _endpoint(url: str):
+        r = parse.urlsplit(url)
+        return f'{r.scheme}://{r.netloc}'
+
+    def get_session(self, url: str):
+        endpoint = self._endpoint(url)
+        session = self._sessions.get(endpoint)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(endpoint)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[endpoint] = session
+
+        return session
+
+    def request(self, method: str, url: str, data=None, headers=None, **kwargs):
+        """
+        :raises: requests.exceptions.RequestException
+        """
+        return self.get_session(url).request(method=method.upper(), url=url, data=data, headers=headers, **kwargs)
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for s in sessions:
+            s.close()
+
+
+sessions = SessionPool()
+
+
+class ChunkUploadError(Exception):
+    def __init__(self, message: str, offset: int = None):
+        self.message = message
+        self.offset = offset
+
+    def __str__(self):
+        return self.message
+
+
+class ChunkUploader:
+    """
+    分片并发上传一个对象到iharbor v2分片上传接口
+
+    * 从rados预读对象数据，第一个分片(offset=0时带reset参数)上传完成后，其余分片最多max_in_flight个并发上传；
+    * 已上传完成的最低分片之后最多max_in_flight个分片在途，中断后已写入数据的最大偏移量之前
+      max_in_flight个分片以内可能有未写入的空洞，续传时从get_resume_offset()开始；
+    * 每个分片单独重试，重试间隔按退避时间指数增长
+    """
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    RETRY_CODES = ('BadDigest', 'InvalidDigest')
+
+    def __init__(self, chunk_url, headers: dict, per_size: int = 32 * 1024 ** 2, max_in_flight: int = 4,
+                 retries: int = 3, backoff: float = 1, session_pool: SessionPool = None):
+        """
+        :param chunk_url: 分片上传url的构建函数，chunk_url(offset, reset) -> str
+        :param headers: 认证等请求头，每个分片另外添加Content-MD5
+        :param per_size: 分片大小
+        :param max_in_flight: 同时在途的分片数，1为逐个上传
+        :param retries: 每个分片失败后的重试次数
+        :param backoff: 第一次重试前等待的秒数，之后每次翻倍
+        """
+        self.chunk_url = chunk_url
+        self.headers = headers
+        self.per_size = per_size
+        self.max_in_flight = max(max_in_flight, 1)
+        self.retries = max(retries, 0)
+        self.backoff = backoff
+        self.session_pool = session_pool if session_pool is not None else sessions
+
+    def get_resume_offset(self, uploaded_size: int):
+        """
+        续传的起始偏移量
+
+        :param uploaded_size: 目标对象当前的大小
+        """
+        start = max(uploaded_size - self.max_in_flight * self.per_size, 0)
+        return start - start % self.per_size
+
+    def upload(self, ho, offset: int = 0):
+        """
+        :param ho: HarborObject()
+        :param offset: 起始偏移量
+        :raises: ChunkUploadError
+        """
+        obj_size = ho.get_obj_size()
+        if offset >= obj_size:
+            return
+
+        blocks = ho.read_obj_generator(offset=offset, block_size=self.per_size)
+        next_oft = offset
+        try:
+            if offset == 0:     # reset要在其他分片之前完成
+                data = next(blocks, None)
+                if not data:
+                    raise ChunkUploadError('read empty bytes from ceph', offset=0)
+
+                self.post_chunk(offset=0, data=data, reset=True)
+                next_oft = len(data)
+
+            if self.max_in_flight == 1:
+                for data in blocks:
+                    self.post_chunk(offset=next_oft, data=data)
+                    next_oft += len(data)
+            else:
+                next_oft = self._upload_concurrently(blocks=blocks, offset=next_oft)
+        finally:
+            blocks.close()
+
+        if next_oft < obj_size:
+            raise ChunkUploadError('read empty bytes from ceph, 对象同步可能不完整', offset=next_oft)
+
+    def _upload_concurrently(self, blocks, offset: int):
+        """
+        :return: int    # 读取的数据结尾偏移量
+        """
+        window = self.max_in_flight * self.per_size
+        pending = {}    # {future: offset}
+        next_oft = offset
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            try:
+                for data in blocks:
+                    # 在途分片数量和偏移量跨度都不超过max_in_flight个分片
+                    while pending and (len(pending) >= self.max_in_flight or
+                                       next_oft >= min(pending.values()) + window):
+                        self._wait_first(pending)
+
+                    pending[executor.submit(self.post_chunk, next_oft, data)] = next_oft
+                    next_oft += len(data)
+
+                while pending:
+                    self._wait_first(pending)
+            except Exception:
+                for f in pending:
+                    f.cancel()
+                raise
+
+        return next_oft
+
+    @staticmethod
+    def _wait_first(pending: dict):
+        """
+        :raises: ChunkUploadError
+        """
+        done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+        for f in done:
+            pending.pop(f)
+            f.result()
+
+    def post_chunk(self, offset: int, data: bytes, reset: bool = False):
+        """
+        上传一个分片，失败时退避重试
+
+        :raises: ChunkUploadError
+        """
+        md5_handler = FileMD5Handler()
+        md5_handler.update(offset=0, data=data)
+        headers = dict(self.headers)
+        headers['Content-MD5'] = md5_handler.hex_md5
+        url = self.chunk_url(offset, reset)
+        error = ''
+        for i in range(self.retries + 1):
+            if i > 0:
+                time.sleep(self.backoff * 2 ** (i - 1))
+
+            try:
+                r = self.session_pool.request(method='post', url=url, data=data, headers=headers)
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+                continue
+
+            if r.status_code == 200:
+                return
+
+            error = r.text
+            if r.status_code in self.RETRY_STATUS:
+                continue
+
+            if r.status_code == 400 and self._get_error_code(r) in self.RETRY_CODES:
+                continue
+
+            break
+
+        raise ChunkUploadError(f'post chunk(offset={offset}), {error}', offset=offset)
+
+    @staticmethod
+    def _get_error_code(r):
+        try:
+            return r.json().get('code', '')
+        except Exception:
+            return ''
@@ -11,6 +11,7 @@ from rest_framework.response import Response
 from rest_framework import serializers
 
 from api import exceptions
+from .writebehind import write_behind
 
 
 def exception_handler(exc, context):
@@ -104,7 +105,7 @@ class CustomGenericViewSet(viewsets.GenericViewSet):
                 date = timezone.now().date()
                 if user.last_active < date:
                     user.last_active = date
-                    user.save(update_fields=['last_active'])
+                    write_behind.touch(model=user._meta.model, obj_id=user.id, field='last_active', value=date)
             except Exception:
                 pass
 
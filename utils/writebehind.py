@@ -0,0 +1,145 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Case, When, F
+
+from utils.flusher import flusher
+
+
+logger = logging.getLogger('django.request')
+
+
+class WriteBehindBuffer:
+    """
+    延后批量写入的计数和时间标记，在进程内存中合并后批量更新到数据库，减少热点行的写锁竞争；
+
+    * incr(): 计数字段累加，如对象下载次数；
+    * touch(): 只增不减的字段，如用户最后活跃日期，合并取最大值；
+    * 距离上次写入超过flush_interval秒，或者待写入记录超过max_pending时写入，进程退出时写入；
+    * 进程空闲时由后台线程(utils.flusher)每flush_interval秒写入；
+    * 进程异常退出时最多丢失flush_interval秒内的数据；
+    """
+
+    def __init__(self, flush_interval: int = 5, max_pending: int = 10000):
+        """
+        :param flush_interval: 写入间隔(秒)，<=0时立即写入
+        :param max_pending: 待写入记录数量上限
+        """
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._counters = {}  # {(model, field): {id: n}}
+        self._touches = {}  # {(model, field): {id: value}}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.metrics = {'merged': 0, 'flushed': 0, 'flushes': 0, 'errors': 0}
+
+    def incr(self, model, obj_id, field: str, n: int = 1):
+        """
+        计数字段累加
+
+        :param model: 模型类
+        :param obj_id: 记录id
+        :param field: 字段名
+        :param n: 增量
+        """
+        with self._lock:
+            items = self._counters.setdefault((model, field), {})
+            if obj_id in items:
+                items[obj_id] += n
+                self.metrics['merged'] += 1
+            else:
+                items[obj_id] = n
+                self._pending += 1
+
+        self._maybe_flush()
+
+    def touch(self, model, obj_id, field: str, value):
+        """
+        字段更新为value，只增不减
+
+        :param model: 模型类
+        :param obj_id: 记录id
+        :param field: 字段名
+        :param value: 字段值，可比较大小，如日期
+        """
+        with self._lock:
+            items = self._touches.setdefault((model, field), {})
+            if obj_id in items:
+                items[obj_id] = max(items[obj_id], value)
+                self.metrics['merged'] += 1
+            else:
+                items[obj_id] = value
+                self._pending += 1
+
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        flusher.ensure_started()
+        if (self._pending >= self.max_pending or
+                time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        待写入的数据批量写入数据库，写入失败的数据丢弃并记录日志
+        """
+        with self._flush_lock:
+            with self._lock:
+                counters, self._counters = self._counters, {}
+                touches, self._touches = self._touches, {}
+                self._pending = 0
+                self._last_flush = time.monotonic()
+
+            for (model, field), items in counters.items():
+                self._flush_counters(model=model, field=field, items=items)
+
+            for (model, field), items in touches.items():
+                self._flush_touches(model=model, field=field, items=items)
+
+            self.metrics['flushes'] += 1
+
+    def _flush_counters(self, model, field: str, items: dict, batch_size: int = 500):
+        """
+        UPDATE ... SET field = CASE id WHEN .. THEN field + n ... END WHERE id IN (...)
+        """
+        ids = list(items.keys())
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            whens = [When(id=obj_id, then=F(field) + items[obj_id]) for obj_id in batch]
+            try:
+                model.objects.filter(id__in=batch).update(**{field: Case(*whens, default=F(field))})
+                self.metrics['flushed'] += len(batch)
+            except Exception as e:
+                self.metrics['errors'] += 1
+                logger.error(f'write behind {model._meta.db_table}.{field} error, {str(e)}')
+
+    def _flush_touches(self, model, field: str, items: dict, batch_size: int = 500):
+        """
+        相同值的记录一条sql更新，UPDATE ... SET field = value WHERE id IN (...) AND field < value
+        """
+        values = {}
+        for obj_id, value in items.items():
+            values.setdefault(value, []).append(obj_id)
+
+        for value, ids in values.items():
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i:i + batch_size]
+                try:
+                    model.objects.filter(id__in=batch, **{f'{field}__lt': value}).update(**{field: value})
+                    self.metrics['flushed'] += len(batch)
+                except Exception as e:
+                    self.metrics['errors'] += 1
+                    logger.error(f'write behind {model._meta.db_table}.{field} error, {str(e)}')
+
+
+write_behind = WriteBehindBuffer(
+    flush_interval=getattr(settings, 'WRITE_BEHIND_FLUSH_INTERVAL', 5),
+    max_pending=getattr(settings, 'WRITE_BEHIND_MAX_PENDING', 10000)
+)
+flusher.register(write_behind.flush, interval=write_behind.flush_interval)
+atexit.register(write_behind.flush)
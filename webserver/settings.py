@@ -447,7 +447,16 @@ CUSTOM_UPLOAD_MAX_FILE_SIZE = 10 * 2**30  # 10GB; None: 无限制
 # bucket备份同步相关自定义设置
 BACKUP_BUCKET_SETTINGS = {
     # 对象修改时间与async同步时间的时间差大于此设定值（尽量确保对象已上传完成），才允许同步;在同步时使用此参数
-    'meet_async_timedelta_minutes': 60
+    'meet_async_timedelta_minutes': 60,
+    # 备份同步脚本每个数据库的连接池连接数上限，多线程模式时不小于线程数+1；等待空闲连接的超时时间(秒)
+    'db_pool_max_size': 20,
+    'db_pool_timeout': 60,
+    # 备份同步脚本lease模式，每个分片的对象id范围大小；分片租约时长(秒)，需大于同步一个对象的最长时间
+    'shard_size': 1000000,
+    'lease_seconds': 600,
+    # 分片上传对象到备份点时，每个对象同时在途的分片数(1为逐个上传)；每个分片失败后的重试次数
+    'chunk_max_in_flight': 4,
+    'chunk_retries': 3
 }
 
 # http/https
@@ -531,6 +540,52 @@ CORS_EXPOSE_HEADERS = [
 
 # rados 连接池最大数量 根据 uwsgi 配置的线程数
 RADOS_POOL_MAX_CONNECT_NUM = 1
+# librados操作超时(秒)，rados读写删除等操作由librados自身控制超时，超时抛出rados.TimedOut
+RADOS_OSD_OP_TIMEOUT = 20
+RADOS_MON_OP_TIMEOUT = 10
+# 上传文件写入ceph时，每个上传同时在途(未完成)的异步写操作最大数量(每个写操作约5MB)；<=0时同步写入
+RADOS_AIO_WRITE_MAX_IN_FLIGHT = 4
+# 下载读取对象时，每个读请求预读数据块(默认每块10MB)占用内存上限；不足2个数据块时不预读
+RADOS_READ_AHEAD_MEMORY_BUDGET = 32 * 1024 ** 2
+# 新对象数据的条带布局单元大小(每个rados对象大小)，建议4MB-64MB，如16 * 1024 ** 2；0表示使用旧布局(每个rados对象最大2GB)
+# 所有桶表升级(manage.py upgradebuckettable --all)后再开启
+OBJECT_STRIPE_UNIT = 0
+# 复制对象数据时，同时在途的异步读(写)数据块(每块8MB)数量
+RADOS_COPY_MAX_IN_FLIGHT = 4
+# 后台任务(manage.py fillobjectsmd5)补全延后计算的对象md5时，读取对象数据的速率上限(MB/s)，0表示不限制
+OBJECT_MD5_FILL_RATE = 50
+
+# 进程内存储桶查询缓存，有效时间(秒)，0表示不缓存；最多缓存桶的数量
+BUCKET_CACHE_TTL = 10
+BUCKET_CACHE_MAX_SIZE = 1024
+# 多进程间通过此django cache的版本戳失效桶缓存，需要配置为共享的缓存后端(如memcached、redis)，
+# 未配置时(django默认的LocMemCache只在进程内有效)桶缓存不生效，例如在security_settings.py中配置：
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     }
+# }
+BUCKET_CACHE_ALIAS = 'default'
+# 进程内目录元数据缓存，有效时间(秒)，0表示不缓存；不存在路径的缓存有效时间(秒)，0表示不缓存；最多缓存目录的数量
+# 和桶缓存一样通过BUCKET_CACHE_ALIAS的版本戳通知其他进程，未配置共享的缓存后端时不生效
+DIR_CACHE_TTL = 10
+DIR_CACHE_NEGATIVE_TTL = 0
+DIR_CACHE_MAX_SIZE = 10000
+# 桶用量(对象数量、大小)增量批量写入数据库的间隔(秒)，待写入桶数量上限
+BUCKET_USAGE_FLUSH_INTERVAL = 5
+BUCKET_USAGE_MAX_PENDING = 1000
+# 对象下载次数、用户最后活跃日期等延后批量写入数据库的间隔(秒)，待写入记录数量上限
+WRITE_BEHIND_FLUSH_INTERVAL = 5
+WRITE_BEHIND_MAX_PENDING = 10000
+# v1 API游标分页列举目录时，目录下对象和目录近似总数的缓存时间(秒)
+DIR_COUNT_CACHE_TTL = 60
+# 对象检索索引表是否存在、是否补全完成的检查结果在进程内的缓存时间(秒)
+SEARCH_INDEX_CHECK_TTL = 60
+# 后台删除对象rados数据(manage.py gcobjects)每秒最多删除的rados对象数量，0不限制
+GC_RADOS_REMOVE_RATE = 500
+# 桶是否开启备份(是否记录对象变更日志)的检查结果在进程内的缓存时间(秒)
+CHANGE_LOG_CHECK_TTL = 60
 # # rados 连接池上限范围
 # RADOS_POOL_UPPER_LIMIT = 0.8 * RADOS_POOL_MAX_CONNECT_NUM
 # # rados 连接池下限范围